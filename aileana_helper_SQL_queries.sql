@@ -8,3 +8,63 @@
 -- DELETE FROM job_listings WHERE job_description IS NULL OR job_description = '';
 
 -- SELECT * FROM job_listings WHERE reference = 'REF. NUM: XXXXXX';
+
+-- Near-duplicate detection (created by ensure_duplicate_detection_schema() in helpers_sqldb.py)
+-- ALTER TABLE job_listings ADD COLUMN IF NOT EXISTS extracted_data JSONB;
+-- ALTER TABLE job_listings ADD COLUMN IF NOT EXISTS description_minhash BIGINT[];
+-- CREATE TABLE IF NOT EXISTS job_duplicate_clusters (
+--     job_reference TEXT PRIMARY KEY,
+--     canonical_reference TEXT NOT NULL,
+--     similarity REAL NOT NULL,
+--     detected_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+-- );
+
+-- Job listings without the reposts (only the canonical job of each duplicate cluster)
+-- SELECT * FROM job_listings WHERE reference NOT IN (SELECT job_reference FROM job_duplicate_clusters);
+
+-- The duplicate clusters and their size
+-- SELECT canonical_reference, COUNT(*) + 1 AS cluster_size FROM job_duplicate_clusters GROUP BY canonical_reference ORDER BY cluster_size DESC;
+
+-- Normalized job descriptions (created by ensure_description_normalization_schema() in helpers_sqldb.py)
+-- ALTER TABLE job_listings ADD COLUMN IF NOT EXISTS job_description_clean TEXT;
+-- ALTER TABLE job_listings ADD COLUMN IF NOT EXISTS job_description_tokens INTEGER;
+-- ALTER TABLE job_listings ADD COLUMN IF NOT EXISTS job_description_clean_tokens INTEGER;
+-- ALTER TABLE job_listings ADD COLUMN IF NOT EXISTS job_description_hash TEXT;
+
+-- Tokens saved by the normalization of the descriptions
+-- SELECT SUM(job_description_tokens) AS raw_tokens, SUM(job_description_clean_tokens) AS clean_tokens,
+--        1 - SUM(job_description_clean_tokens)::float / NULLIF(SUM(job_description_tokens), 0) AS reduction
+-- FROM job_listings WHERE job_description_clean IS NOT NULL;
+
+-- Industry of each company (created by ensure_company_industry_schema() in helpers_sqldb.py, see helpers_company_industry.py)
+-- CREATE TABLE IF NOT EXISTS company_industry_cache (
+--     company_key TEXT PRIMARY KEY,          -- lower case company name with single spaces
+--     company_name TEXT,
+--     industry_name TEXT,
+--     nace_standardized_name TEXT,
+--     nace_code TEXT,
+--     confidence REAL NOT NULL DEFAULT 0,
+--     classifications INTEGER NOT NULL DEFAULT 1,
+--     manual_override BOOLEAN NOT NULL DEFAULT FALSE,
+--     source_job_reference TEXT,
+--     updated_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+-- );
+-- ALTER TABLE company_industry_cache ADD COLUMN IF NOT EXISTS agreements INTEGER NOT NULL DEFAULT 1;     -- classifications that agree with the cached division
+-- ALTER TABLE company_industry_cache ADD COLUMN IF NOT EXISTS disagreements INTEGER NOT NULL DEFAULT 0;  -- classifications that gave another division
+
+-- Manual override of the industry of a company (never replaced by the LLM)
+-- INSERT INTO company_industry_cache (company_key, company_name, industry_name, nace_standardized_name, nace_code, confidence, manual_override)
+-- VALUES ('acme ltd', 'ACME Ltd', 'Software development', 'Computer programming, consultancy and related activities', '62', 1, TRUE)
+-- ON CONFLICT (company_key) DO UPDATE
+-- SET industry_name = EXCLUDED.industry_name, nace_standardized_name = EXCLUDED.nace_standardized_name, nace_code = EXCLUDED.nace_code,
+--     confidence = 1, manual_override = TRUE, updated_date = CURRENT_TIMESTAMP;
+
+-- A company that is never cached (e.g. a recruitment agency that posts jobs of many industries): an override without a NACE title
+-- INSERT INTO company_industry_cache (company_key, company_name, manual_override) VALUES ('some agency', 'Some Agency', TRUE)
+-- ON CONFLICT (company_key) DO UPDATE SET nace_standardized_name = NULL, manual_override = TRUE;
+
+-- The companies with a low confidence classification
+-- SELECT * FROM company_industry_cache WHERE NOT manual_override ORDER BY confidence, classifications DESC;
+
+-- The companies whose classifications disagree (e.g. recruitment agencies and anonymous posters), which are never reused
+-- SELECT * FROM company_industry_cache WHERE NOT manual_override AND disagreements >= 2 ORDER BY disagreements DESC;
@@ -7,6 +7,7 @@ from helpers_sqldb import insert_data_to_db, nuke_neo4j_db, reset_imported_statu
 from helpers_scrape import scrape_for_new_jobs
 from helpers_translation_ai import translate_job_listings
 from helpers_other import get_jobs_without_description_scrape_and_translate
+from helpers_description_normalizer import normalize_job_descriptions
 from helper_llm_main import process_jobs_and_import_to_graphDB, job_rag_pipeline,driver
 
 #  -----------------     Variables    ----------------- #
@@ -26,6 +27,9 @@ insert_data_to_db(translated_listings)
 # Scrape the description of new jobs, translate if in Greek and update the PostgreSQL DB
 get_jobs_without_description_scrape_and_translate()
 
+# Remove the boilerplate (footers, contacts, GDPR notices, LLM preambles) of the descriptions before any LLM call
+normalize_job_descriptions()
+
 # Uncomment the below code to reset the imported status of all the jobs in the DB and
 # nuke_neo4j_db()
 # reset_imported_status()
@@ -0,0 +1,231 @@
+""" Benchmark of the LLM models for each extraction stage """
+# Replays a labelled sample of jobs through each candidate model (every stage routed to the candidate) and reports, for each stage,
+# the accuracy of the labels it produces against the taxonomies, the p50/p95 latency and the tokens (and cost) per job.
+# The fastest model that is accurate enough for each stage can be written as a model routing file (see helpers_model_routing).
+#
+# Export a sample of extracted jobs from the DB, then check and correct its "expected" labels by hand:
+#   python benchmark_models.py --export-sample 50 --sample data/benchmark_sample.json
+# Run the benchmark:
+#   python benchmark_models.py --sample data/benchmark_sample.json --candidate ollama:llama3.2:3b-instruct-fp16 --candidate lmstudio:qwen2.5-14b-instruct \
+#       --write-routing data/model_routing.json
+# The candidates can also be a JSON file: [{"provider": "groq", "model": "...", "input_price": 0.59, "output_price": 0.79}] (USD per 1M tokens)
+#
+# Note: each stage is measured with the whole chain on the same model, so a summary stage is scored by the labels of the stages that read it.
+import os, json, argparse
+
+parser = argparse.ArgumentParser(description="Per-stage accuracy, latency and tokens of candidate LLM models on a labelled sample of jobs")
+parser.add_argument("--sample", required=True, help="The JSON file of the labelled jobs")
+parser.add_argument("--export-sample", type=int, metavar="N", help="Write a sample of N extracted jobs from the DB to --sample (to be checked by hand) and exit")
+parser.add_argument("--candidate", action="append", default=[], metavar="PROVIDER:MODEL", help="A candidate model (repeat for more)")
+parser.add_argument("--candidates", help="A JSON file with the candidates (provider, model and optional input_price / output_price per 1M tokens)")
+parser.add_argument("--mode", choices=["chain", "one_shot"], default="chain", help="The extraction to benchmark")
+parser.add_argument("--limit", type=int, help="Use only the first N jobs of the sample")
+parser.add_argument("--min-accuracy", type=float, default=0.9, help="The accuracy a model needs for a stage to be recommended")
+parser.add_argument("--use-cache", action="store_true", help="Answer from the LLM response cache (the latencies are then not meaningful)")
+parser.add_argument("--write-routing", help="Write the recommended model of each stage as a model routing file")
+parser.add_argument("--output", help="Write the results of every job to a JSON file")
+args = parser.parse_args()
+
+import helpers_company_industry
+from helper_llm_main import job_data_preprocessing_extraction_classification, job_data_one_shot_extraction
+from helpers_stage_graph import StageGraphError
+from helpers_model_routing import ModelRouter, set_model_router, recording_llm_usage
+from helpers_label_match import normalize_label
+from helpers_taxonomy import get_taxonomy
+from helpers_sqldb import get_extracted_jobs_sample
+from helpers_llm_cache import get_llm_cache
+
+#  -----------------     Variables    ----------------- #
+# The labels that are checked, and the stages scored by each of them (a summary is scored by the labels of the stages that read it)
+benchmark_fields = ["NACE_level_I", "NACE_level_II", "ISCO", "job_title", "ISCED_level", "job_seniority"]
+stage_fields = {
+    "industry_summarization": ["NACE_level_I", "NACE_level_II"],
+    "NACE_level_I": ["NACE_level_I"],
+    "NACE_level_II": ["NACE_level_II"],
+    "job_title_summarization": ["job_title", "ISCO"],
+    "job_title": ["job_title"],
+    "ISCO": ["ISCO"],
+    "experience_and_employment_summarization": ["ISCED_level", "job_seniority"],
+    "occupation_details": ["ISCED_level", "job_seniority"],
+    "one_shot": benchmark_fields,
+}
+
+
+# The labels of the extracted data of a job: {field: label}
+def job_labels(data):
+    taxonomy = get_taxonomy()
+    industry = data.get("industry") or {}
+    occupation = data.get("occupation_details") or {}
+    nace_code = taxonomy.nace_code(industry.get("NACE_standardized_name") or "")
+    return {
+        "NACE_level_I": taxonomy.nace_name(taxonomy.nace_parent(nace_code)) if nace_code else None,
+        "NACE_level_II": industry.get("NACE_standardized_name"),
+        "ISCO": data.get("isco_name"),
+        "job_title": data.get("job_title"),
+        "ISCED_level": occupation.get("minimum_level_of_education"),
+        "job_seniority": occupation.get("job_seniority"),
+    }
+
+
+# Is the predicted label the expected one? The NACE and ISCO labels are compared by their code (a label that is not in the taxonomy is wrong)
+def label_is_correct(field, predicted, expected):
+    if predicted is None:
+        return False
+    taxonomy = get_taxonomy()
+    if field in ("NACE_level_I", "NACE_level_II"):
+        level = 1 if field == "NACE_level_I" else 2
+        code = taxonomy.nace_code(predicted, level=level)
+        return code is not None and taxonomy.nace_name(code) == predicted and code == taxonomy.nace_code(expected, level=level)
+    if field == "ISCO":
+        return taxonomy.is_isco_title(predicted) and taxonomy.isco_code(predicted) == taxonomy.isco_code(expected)
+    if field == "ISCED_level":
+        return predicted == expected
+    return normalize_label(predicted) == normalize_label(expected)
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))]
+
+
+def export_sample(n, path):
+    sample = [{"job_reference": job["job_reference"], "job_title": job["job_title"], "company_name": job["company_name"],
+               "job_description": job["job_description"], "job_description_clean": job["job_description_clean"],
+               "expected": job_labels(job["extracted_data"])} for job in get_extracted_jobs_sample(n)]
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(sample, f, ensure_ascii=False, indent=2)
+    print(f"{len(sample)} jobs written to {path}. Check the expected labels before running the benchmark.")
+
+
+def load_candidates():
+    candidates = []
+    for spec in args.candidate:
+        provider, _, model = spec.partition(":")
+        candidates.append({"provider": provider, "model": model})
+    if args.candidates:
+        with open(args.candidates, 'r', encoding='utf-8') as f:
+            candidates += json.load(f)
+    if not candidates:
+        parser.error("No candidate models (use --candidate PROVIDER:MODEL or --candidates FILE)")
+    return candidates
+
+
+# Extract every job of the sample with every stage routed to the candidate. Returns one record per job:
+# {"job_reference", "labels", "correct": {field: bool}, "failed_stages", "usage": [usage of each LLM call]}
+def run_candidate(candidate, jobs):
+    set_model_router(ModelRouter(default=(candidate["provider"], candidate["model"])))
+    extract_job_data = job_data_one_shot_extraction if args.mode == "one_shot" else job_data_preprocessing_extraction_classification
+    records = []
+    for number, job in enumerate(jobs, 1):
+        print(f"~~ {candidate['provider']}:{candidate['model']} --> job {number}/{len(jobs)} ({job['job_reference']})")
+        failed_stages = {}
+        with recording_llm_usage() as usage:
+            try:
+                data = extract_job_data(candidate["model"], job)
+            except StageGraphError as e:
+                # The labels of the stages that finished are still scored
+                data = {key: value for result in e.results.values() if isinstance(result, dict) for key, value in result.items()}
+                failed_stages = e.failures
+            except Exception as e:
+                data, failed_stages = {}, {args.mode: f"{type(e).__name__}: {e}"}
+        labels = job_labels(data if isinstance(data, dict) else {})
+        expected = job.get("expected", {})
+        records.append({
+            "job_reference": job["job_reference"],
+            "labels": labels,
+            "correct": {field: label_is_correct(field, labels[field], expected[field]) for field in benchmark_fields if expected.get(field) is not None},
+            "failed_stages": failed_stages,
+            "usage": list(usage),
+        })
+    return records
+
+
+# The report of a candidate: {stage: {"jobs", "accuracy", "valid", "p50", "p95", "prompt_tokens", "completion_tokens", "cost"}} (per job)
+def summarize_candidate(candidate, records):
+    stages = sorted({call["stage"] for record in records for call in record["usage"]} | set(stage for record in records for stage in record["failed_stages"]))
+    summary = {}
+    for stage in stages:
+        latencies, prompt_tokens, completion_tokens, correct = [], [], [], []
+        for record in records:
+            calls = [call for call in record["usage"] if call["stage"] == stage]
+            latencies.append(sum(call["latency"] for call in calls))
+            prompt_tokens.append(sum(call["prompt_tokens"] or 0 for call in calls))
+            completion_tokens.append(sum(call["completion_tokens"] or 0 for call in calls))
+            correct += [record["correct"][field] for field in stage_fields.get(stage, []) if field in record["correct"]]
+        jobs = len(records)
+        cost = None
+        if candidate.get("input_price") is not None or candidate.get("output_price") is not None:
+            cost = (sum(prompt_tokens) * (candidate.get("input_price") or 0) + sum(completion_tokens) * (candidate.get("output_price") or 0)) / 1e6 / jobs
+        summary[stage] = {
+            "jobs": jobs,
+            "accuracy": sum(correct) / len(correct) if correct else None,
+            "valid": sum(1 for record in records if stage not in record["failed_stages"]) / jobs,
+            "p50": percentile(latencies, 50),
+            "p95": percentile(latencies, 95),
+            "prompt_tokens": sum(prompt_tokens) / jobs,
+            "completion_tokens": sum(completion_tokens) / jobs,
+            "cost": cost,
+        }
+    return summary
+
+
+def print_report(name, summary):
+    print(f"\n==== {name} ====")
+    print(f"   {'stage':<52}{'accuracy':>9}{'valid':>7}{'p50 s':>8}{'p95 s':>8}{'in tok':>8}{'out tok':>8}{'$/job':>10}")
+    for stage, row in summary.items():
+        accuracy = f"{row['accuracy']:.0%}" if row["accuracy"] is not None else "-"
+        cost = f"{row['cost']:.5f}" if row["cost"] is not None else "-"
+        print(f"   {stage:<52}{accuracy:>9}{row['valid']:>7.0%}{row['p50']:>8.2f}{row['p95']:>8.2f}{row['prompt_tokens']:>8.0f}{row['completion_tokens']:>8.0f}{cost:>10}")
+
+
+# For each stage, the fastest candidate (p50) that is accurate enough (the stages without labels only need `min_accuracy` valid answers)
+def recommend_routes(summaries):
+    routes = {}
+    stages = {stage for summary in summaries.values() for stage in summary}
+    for stage in sorted(stages):
+        good_enough = [(summary[stage]["p50"], name) for name, summary in summaries.items() if stage in summary
+                       and (summary[stage]["accuracy"] if summary[stage]["accuracy"] is not None else summary[stage]["valid"]) >= args.min_accuracy]
+        if good_enough:
+            routes[stage] = min(good_enough)[1]
+    return routes
+
+
+#  -----------------  Main Code  ----------------- #
+if args.export_sample:
+    export_sample(args.export_sample, args.sample)
+    raise SystemExit
+
+with open(args.sample, 'r', encoding='utf-8') as f:
+    jobs = json.load(f)[:args.limit]
+# The company industry cache would skip the NACE stages
+helpers_company_industry.company_industry_cache_enabled = False
+# The benchmark does not use the response cache by default (set after the imports, so LLM_CACHE_MODE of a .env file does not change it)
+get_llm_cache().mode = "use" if args.use_cache else "bypass"
+
+candidates = load_candidates()
+summaries, all_records = {}, {}
+for candidate in candidates:
+    name = f"{candidate['provider']}:{candidate['model']}"
+    all_records[name] = run_candidate(candidate, jobs)
+    summaries[name] = summarize_candidate(candidate, all_records[name])
+for name, summary in summaries.items():
+    print_report(name, summary)
+
+routes = recommend_routes(summaries)
+print(f"\n==== Recommended model per stage (accuracy >= {args.min_accuracy:.0%}, fastest p50) ====")
+for stage, name in routes.items():
+    print(f"   {stage:<52}{name}")
+
+if args.write_routing:
+    candidates_by_name = {f"{candidate['provider']}:{candidate['model']}": candidate for candidate in candidates}
+    router = ModelRouter({stage: (candidates_by_name[name]["provider"], candidates_by_name[name]["model"]) for stage, name in routes.items()})
+    with open(args.write_routing, 'w', encoding='utf-8') as f:
+        json.dump(router.to_config(), f, ensure_ascii=False, indent=2)
+    print(f"Model routing written to {args.write_routing}")
+
+if args.output:
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump({"mode": args.mode, "summaries": summaries, "records": all_records}, f, ensure_ascii=False, indent=2)
@@ -1,14 +1,27 @@
 """ ALL THE IMPORTS """
 # Imports of necessary libraries
-import os, json, time, random, logging, datetime, psycopg2, requests, time
+import os, json, time, random, logging, datetime, psycopg2, requests, time, queue, threading
+from collections import Counter
 from dotenv import load_dotenv
 from neo4j import GraphDatabase
 # from groq import Groq  ~~~~~~~ UNINSTALL THIS PACKAGE ~~~~~~~
-from pydantic import BaseModel, ValidationError
-from typing import List, Optional
+from pydantic import BaseModel, ValidationError, create_model
+from typing import List, Optional, Literal
 
 # Imports from other .py scripts
-from helpers_sqldb import get_jobs_not_imported_to_neo4j, import_job_data_to_neo4j, nuke_neo4j_db, reset_imported_status
+from helpers_sqldb import get_jobs_not_imported_to_neo4j, import_job_data_to_neo4j, nuke_neo4j_db, reset_imported_status, ensure_description_normalization_schema, ensure_company_industry_schema
+from helpers_description_normalizer import format_job_for_prompt
+from helpers_model_routing import get_model_router, record_llm_usage
+from helpers_micro_batch import micro_batching, get_micro_batcher, report_micro_batching
+from helpers_company_industry import cached_company_industry, record_company_industry, classification_confidence, report_company_industry_cache
+from helpers_sqldb import ensure_duplicate_detection_schema, save_extracted_data, get_extracted_data, save_duplicate_of, get_canonical_embedding
+from helpers_llm_client import get_llm_client, LLMRequestError
+from helpers_llm_cache import get_llm_cache
+from helpers_stage_graph import Stage, run_stage_graph
+from helpers_label_index import get_label_index
+from helpers_label_match import get_label_matcher
+from helpers_taxonomy import get_taxonomy
+from helpers_near_duplicates import duplicate_detection, load_duplicate_index, minhash_signature
 
 load_dotenv(override=True)
 
@@ -63,10 +76,31 @@ lmstudio_chat_completions_url = os.getenv("LM_STUDIO_COMPLETIONS_URL")
 lmstudio_model = "qwen2.5-14b-instruct"
 lmstudio_embedding_model = "text-embedding-bge-m3"
 
-#### Set up of the API key and the URL to be used for the LLM inference API requests ####
+#### Set up of the provider (see `llm_providers` in helpers_llm_client: "openrouter", "groq", "lmstudio" or "ollama") and the model to be used for the LLM inference API requests ####
+#### Each extraction stage can use a different provider and model, see the model routing in helpers_model_routing (these are the default) ####
 provider_model_to_be_used = llama_31_70_free
-provider_key_to_be_used = OpenRouter_API_key
-provider_url_to_be_used = OpenRouter_completions_url
+provider_to_be_used = "openrouter"
+
+#### Extraction mode: "chain" (default) runs the step by step summarize-then-classify prompts of `job_data_preprocessing_extraction_classification`,
+#### "one_shot" (opt-in) extracts the whole JobListing with one LLM call (only the invalid sections are asked again)
+extraction_mode = os.getenv("EXTRACTION_MODE", "chain")
+# How many times the sections that failed the validation are requested again in the one-shot mode
+one_shot_max_repairs = int(os.getenv("ONE_SHOT_MAX_REPAIRS", 2))
+
+#### Structured outputs: the answers of the LLM are constrained to the JSON Schema of the expected output (built from the pydantic
+#### models, with the NACE / ISCO titles and ISCED levels as enums). Set to "false" for servers that do not support JSON Schemas.
+structured_outputs = os.getenv("STRUCTURED_OUTPUTS", "true").lower() == "true"
+
+#### How many jobs are extracted and imported to the Graph DB at the same time (one Neo4j session per worker).
+#### All the workers share the request budget and the concurrency limit of the provider client (see `llm_providers` in helpers_llm_client)
+job_workers = int(os.getenv("JOB_WORKERS", 4))
+#### Only the extraction runs in parallel: the imports to the Graph DB run one at a time, because `import_job_data_to_neo4j` MERGEs the
+#### shared nodes (skills, benefits, ...) without uniqueness constraints and matches the JOB by its title
+graph_import_lock = threading.Lock()
+
+#### How many ISCO / NACE titles go into the prompts: the titles nearest to the job (by embedding, see helpers_label_index), instead of the full lists
+isco_shortlist_size = int(os.getenv("ISCO_SHORTLIST_SIZE", 20))
+nace_shortlist_size = int(os.getenv("NACE_SHORTLIST_SIZE", 8))
 
 
 #### Confifgure the logger and the timestamp
@@ -125,6 +159,55 @@ class JobListing(BaseModel):
     benefits: List[benefits]
     responsibilities: List[responsibilities]
 
+
+
+#  -----------------   JSON Schemas for Structured Outputs    ----------------- #
+# The pydantic fields of each section of a JobListing. The NACE / ISCO titles and the ISCED levels are `Literal`s (enums in the
+# JSON Schema), so a server with structured outputs can only answer with a title of the list given (e.g. the shortlist of the prompt).
+def job_listing_output_fields(NACE_names=None, ISCO_names=None, ISCED_levels=None):
+    industry_output = create_model("industry", __base__=industry, NACE_standardized_name=(Literal[tuple(NACE_names)], ...)) if NACE_names else industry
+    occupation_details_output = create_model("occupation_details", __base__=occupation_details, minimum_level_of_education=(Literal[tuple(ISCED_levels)], ...)) if ISCED_levels else occupation_details
+    return {
+        "industry": (industry_output, ...),
+        "job_title": (str, ...),
+        "isco_name": (Literal[tuple(ISCO_names)], ...) if ISCO_names else (str, ...),
+        "occupation_details": (occupation_details_output, ...),
+        "skills": (List[skills], ...),
+        "certifications": (List[certifications], ...),
+        "academic_degree": (List[academic_degree], ...),
+        "experience": (experience, ...),
+        "benefits": (List[benefits], ...),
+        "responsibilities": (List[responsibilities], ...),
+    }
+
+
+# The JSON Schema of an output with the given pydantic fields ({name: (type, default)}), with the `$ref`s inlined
+# (not every server resolves references in the schemas)
+def output_json_schema(name, fields):
+    schema = create_model(name, **fields).model_json_schema()
+    definitions = schema.pop("$defs", {})
+
+    def inline(node):
+        if isinstance(node, dict):
+            if "$ref" in node:
+                return inline(definitions[node["$ref"].split("/")[-1]])
+            return {key: inline(value) for key, value in node.items()}
+        if isinstance(node, list):
+            return [inline(value) for value in node]
+        return node
+    return inline(schema)
+
+
+# The JSON Schema of some sections of a JobListing
+def job_listing_sections_schema(name, sections, NACE_names=None, ISCO_names=None, ISCED_levels=None):
+    fields = job_listing_output_fields(NACE_names, ISCO_names, ISCED_levels)
+    return output_json_schema(name, {section: fields[section] for section in sections})
+
+
+# The JSON Schema of a summary: {"<key>": "text"}
+def summary_schema(key):
+    return output_json_schema(key, {key: (str, ...)})
+
     
 # Function to open the system file. Files likes user or system prompts and instructions.
 def open_prompt_files(file):
@@ -138,87 +221,68 @@ def open_JSON_files(file_path):
 
 """ ----------------- Helper Functions ----------------- """
 ###  -----------------  API LLM Requests ----------------- ###
-# Function to call Local LLM using the Ollama API in JSON mode
-def call_ollama_JSON(model, system_prompt, user_prompt_for_parsing):
-    url = ollama_chat_completions_url
-    payload = {
-        "model": model,
-        "messages": [
-            {
-                "role": "system",
-                "content": f"{system_prompt}"
-            },
-            {
-                "role": "user", 
-                "content": f"{user_prompt_for_parsing}"
-            }
-        ], 
-        "format": "json",
-        "stream": False,
-        # "temperature": 0
-        "options": 
-        {
-            # "num_keep": 1, 
-            # "top_p": 0.2,
-            "temperature": 0
-            # "mirostat": 1,
-            # "mirostat_tau": 0.1,  
-            # "mirostat_eta": 0.1,
-            # "tfs_z": 0.1
-        }
-    }
-    headers = {
-        "Content-Type": "application/json"
-    }
+# All the LLM calls go through the shared clients of `helpers_llm_client` (keep-alive connections, retries with backoff
+# and pacing from the provider rate limits), so there are no fixed sleeps before the calls.
+
+# Function to call Local LLM using the Ollama API in JSON mode (constrained to `json_schema`, if given)
+def call_ollama_JSON(model, system_prompt, user_prompt_for_parsing, json_schema=None):
+    messages = [
+        {"role": "system", "content": f"{system_prompt}"},
+        {"role": "user", "content": f"{user_prompt_for_parsing}"}
+    ]
     try:
-        response = requests.post(url, json=payload, headers=headers)
-        # print(f"Response text: \n{response.text}\n\n")
-        response.raise_for_status()  # Raise an error for bad status codes
-        return response.json()['message']['content']
-    except requests.RequestException as e:
+        return get_llm_client("ollama").chat(model, messages, temperature=0, json_mode=True, json_schema=json_schema if structured_outputs else None)
+    except (LLMRequestError, requests.RequestException) as e:
         print(f"Error: {e} response from Ollama API.")
         return f"Error: {e} response from Ollama API."
 
 
 #---------- Function to call Local or Cloud LLM API in JSON mode (same request as OPENAI API) ----------#
-def call_LLM_API_JSON(provider_model_to_be_used, system_prompt, user_prompt_for_parsing):
+# With a `json_schema` the answer is constrained to it (structured outputs). If the server rejects the schema, the request is sent again in JSON mode.
+# The provider and model of the `stage` come from the model routing (by default `provider_to_be_used` and the model given).
+# `cache` is passed to the LLM client: a retry of the same prompt uses "refresh", so it does not get the same cached answer again.
+def call_LLM_API_JSON(provider_model_to_be_used, system_prompt, user_prompt_for_parsing, json_schema=None, stage=None, cache=True):
     # Note for Models that worked well, especially with the JSON mode:: 
     ## Models with the best quality of output:  lmstudio-community/Qwen2.5-14B-Instruct-Q4_K_M.gguf,  lmstudio-community/Meta-Llama-3.1-8B-Instruct-Q4_K_M.gguf
     ## Models that worked ok: MaziyarPanahi/Qwen2.5-7B-Instruct-Uncensored.Q5_K_S.gguf, bartowski/Llama-3.2-3B-Instruct-f16.gguf
-    
-    # Prepare the headers 
-    url = provider_url_to_be_used
-    headers = {
-        'Content-Type': 'application/json',
-        'Authorization': f'Bearer {provider_key_to_be_used}',
-    }
 
     # Prepare the messages for the chat completion
     messages = [
         {"role": "system", "content": system_prompt},
         {"role": "user", "content": user_prompt_for_parsing}
     ]
-    # Prepare the payload
-    payload = {
-        'model': provider_model_to_be_used,
-        'messages': messages,
-        "type": "json_object",
-        'temperature': 0,
-        'max_tokens': 9216
-    }
-    
+
+    provider, model = get_model_router().route(stage, (provider_to_be_used, provider_model_to_be_used))
+    client = get_llm_client(provider)
     try:
-        response = requests.post(url, json=payload, headers=headers)
-        # print(f"Response text: \n{response.json()}\n\n")
-        response.raise_for_status()  # Raise an error for bad status codes
-        # return response.json()['choices'][0]['message']['content']
-        return response.json()['choices'][0]['message']['content']
-    except requests.RequestException as e:
+        if json_schema and structured_outputs:
+            try:
+                content, usage = client.chat_with_usage(model, messages, temperature=0, max_tokens=9216, json_mode=True, json_schema=json_schema, cache=cache)
+                record_llm_usage(stage, usage)
+                return content
+            except LLMRequestError as e:
+                print(f"The JSON Schema was not accepted ({e}). Sending the request in JSON mode.")
+        content, usage = client.chat_with_usage(model, messages, temperature=0, max_tokens=9216, json_mode=True, cache=cache)
+        record_llm_usage(stage, usage)
+        return content
+    except (LLMRequestError, requests.RequestException) as e:
         print(f"Error: {e} response from LLM API.")
-        time.sleep(60)  # Optional: wait a bit before retrying
         return f"Error: {e} response from LLM API."
 
 
+# Function to call the Groq API in JSON mode
+def call_groq_JSON(model, system_prompt, user_prompt_for_parsing):
+    messages = [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_prompt_for_parsing}
+    ]
+    try:
+        return get_llm_client("groq").chat(model, messages, temperature=0, json_mode=True)
+    except (LLMRequestError, requests.RequestException) as e:
+        print(f"Error: {e} response from Groq API.")
+        return f"Error: {e} response from Groq API."
+
+
 # A function to validate the job listing data
 def validate_job_listing(data: dict) -> bool:
     try:
@@ -231,9 +295,25 @@ def validate_job_listing(data: dict) -> bool:
         return False
 
 
+# Replace the label `data[key]` given by the LLM with the canonical label of the taxonomy, when the fuzzy match is good enough
+# (see helpers_label_match). A label that cannot be snapped is left as it is, so the caller can ask the LLM again. Returns True if the label was replaced.
+def snap_label(data, key, matcher, within=None):
+    if not isinstance(data, dict) or not isinstance(data.get(key), str):
+        return False
+    snapped = matcher.snap(data[key], within=within)
+    if snapped is not None and snapped != data[key]:
+        print(f"~~ Snapped the label `{data[key]}` to `{snapped}`")
+        data[key] = snapped
+        return True
+    return False
+
+
 ###  -----------------  System & User Prompts for Data Extraction, Structuring and Classification  ----------------- ###
 # A function that takes the extracted data from two different LLM models and uses a third to define the correct output
-def job_data_preprocessing_extraction_classification(model, db_job_data):
+# With `refresh_cache` (a new attempt for the same job) the cached LLM answers are not read, so a bad answer is not given again.
+def job_data_preprocessing_extraction_classification(model, db_job_data, refresh_cache=False):
+    job_prompt_text = format_job_for_prompt(db_job_data)
+    llm_cache_mode = "refresh" if refresh_cache else True
     # Alternatively Ollama can be used by changing the function call to call_ollama_JSON. LMStudio does not specific parameters for the model, just have a dummy model name.
     # print(f"Job description -->\n{db_job_data[0]}\n{db_job_data[1]}\n\n")
     
@@ -242,231 +322,551 @@ def job_data_preprocessing_extraction_classification(model, db_job_data):
     # attempt = 0
     
     system_prompt = open_prompt_files("data/prompts/system_prompt_extract_data.txt")
+    # The industry depends on the company, not on the job: if the company is in the cache, its industry is reused (no summary and NACE stages).
+    # The confidence of each NACE level (see `classification_confidence`) is kept for the cache.
+    cached_industry = cached_company_industry(db_job_data.get("company_name"))
+    industry_confidence = {}
+
+    # Every step of the extraction is a stage of a small dependency graph (see `helpers_stage_graph`): the summaries start at the same time
+    # and each classification starts as soon as the summary it reads is ready, so the time per job is about the time of the longest chain.
 
     #---------------------- Data preprocessing and extraction for Industry Data ----------------------#
-    user_prompt_industry_summarization = ("You will read the description of a job posting."
-    + "Then you will make a small description of company, what the company does and the industry this company operates."
-    + "Here is the job description: "+ str(db_job_data)
-    + "Your output must follow the JSON template: {'industry_summarization':'The description of the company and the industry this company operates in'}"
-    + "Ensure to output ONLY in JSON format without any additional explanations!")
-    
-    time.sleep(59)
-    summarization_industry = call_LLM_API_JSON(provider_model_to_be_used, system_prompt, user_prompt_industry_summarization)
-    print("The industry summarization is: ", summarization_industry, "\n")
-    
-    NACE_standardized_industry_title = [title.strip().strip('"').strip('\n') for title in open_prompt_files(r'data\prompts\standard_NACE.txt').strip('[]').split(',\n')]
-    # print("NACE Standardized Industry Titles: ", NACE_standardized_industry_title,"\n")
-    
-    user_prompt_industry_data_classification = (f" Read the information provided for a company and the industry it operates in. "
-    + "You will have to provide the the NACE industry title, from the list provided below."
-    + "The NACE Standards Clasicifation List is here: "+ str(NACE_standardized_industry_title  )  
-    + f" *** The company information is the following *** {summarization_industry}:\n"
-    + 'Your outpout must follow the JSON template:'
-    + '{"industry": {"industry_name":"A title of the industry","NACE_standardized_name":"The NACE title from the list that matches the company industry"}}'
-    + "Ensure to output EXACTLY the JSON format without any additional explanations!"
-    + "Ensure that you choose the NACE title that matches the company industry best.")
-    
-    # Read the NACE classification and loop until the correct classification is made based on the job description
-    for attempt in range(3):
-        time.sleep(59)
-        output_industry_classification_lvl_I = json.loads(call_LLM_API_JSON(provider_model_to_be_used, system_prompt, user_prompt_industry_data_classification))
-        
-        if output_industry_classification_lvl_I['industry']['NACE_standardized_name'] in NACE_standardized_industry_title:
-            print("~~ The NACE Level I classification is: ", output_industry_classification_lvl_I)
-            break
-        else:
-            print(f"~~ The NACE Level I classification {output_industry_classification_lvl_I['industry']['NACE_standardized_name']} is incorrect. Please classify the NACE industry again.")
-            # output_industry_classification_lvl_I = json.loads(call_LLM_API_JSON(provider_model_to_be_used, system_prompt, user_prompt_industry_data_classification))
-            continue
+    def summarize_industry(results):
+        user_prompt_industry_summarization = ("You will read the description of a job posting."
+        + "Then you will make a small description of company, what the company does and the industry this company operates."
+        + "Here is the job description: "+ job_prompt_text
+        + "Your output must follow the JSON template: {'industry_summarization':'The description of the company and the industry this company operates in'}"
+        + "Ensure to output ONLY in JSON format without any additional explanations!")
+
+        summarization_industry = call_LLM_API_JSON(provider_model_to_be_used, system_prompt, user_prompt_industry_summarization, summary_schema("industry_summarization"), stage="industry_summarization", cache=llm_cache_mode)
+        print("The industry summarization is: ", summarization_industry, "\n")
+        return summarization_industry
+
+
+    def classify_NACE_level_I(results):
+        summarization_industry = results["industry_summarization"]
+        taxonomy = get_taxonomy()
+        NACE_standardized_industry_title = taxonomy.nace_section_names()
+        # print("NACE Standardized Industry Titles: ", NACE_standardized_industry_title,"\n")
+        # Only the NACE titles nearest to the company summary go into the prompt
+        NACE_shortlisted_industry_title = get_label_index("NACE_sections", NACE_standardized_industry_title).top_k(summarization_industry, nace_shortlist_size)
+        NACE_level_I_schema = job_listing_sections_schema("NACE_level_I", ["industry"], NACE_names=NACE_shortlisted_industry_title)
+
+        user_prompt_industry_data_classification = (f" Read the information provided for a company and the industry it operates in. "
+        + "You will have to provide the the NACE industry title, from the list provided below."
+        + "The NACE Standards Clasicifation List is here: "+ str(NACE_shortlisted_industry_title)
+        + f" *** The company information is the following *** {summarization_industry}:\n"
+        + 'Your outpout must follow the JSON template:'
+        + '{"industry": {"industry_name":"A title of the industry","NACE_standardized_name":"The NACE title from the list that matches the company industry"}}'
+        + "Ensure to output EXACTLY the JSON format without any additional explanations!"
+        + "Ensure that you choose the NACE title that matches the company industry best.")
+
+        # Read the NACE classification and loop until the correct classification is made based on the job description
+        # Near misses (case, punctuation, truncation...) are snapped to the NACE title locally, the LLM is asked again only for the rest
+        for attempt in range(3):
+            output_industry_classification_lvl_I = json.loads(call_LLM_API_JSON(provider_model_to_be_used, system_prompt, user_prompt_industry_data_classification, NACE_level_I_schema, stage="NACE_level_I", cache=llm_cache_mode if attempt == 0 else "refresh"))
+            snapped = snap_label(output_industry_classification_lvl_I['industry'], 'NACE_standardized_name', get_label_matcher("NACE_sections", NACE_standardized_industry_title))
+
+            if taxonomy.is_nace_section(output_industry_classification_lvl_I['industry']['NACE_standardized_name']):
+                print("~~ The NACE Level I classification is: ", output_industry_classification_lvl_I)
+                industry_confidence["NACE_level_I"] = classification_confidence(attempt, snapped)
+                break
+            else:
+                print(f"~~ The NACE Level I classification {output_industry_classification_lvl_I['industry']['NACE_standardized_name']} is incorrect. Please classify the NACE industry again.")
+                # output_industry_classification_lvl_I = json.loads(call_LLM_API_JSON(provider_model_to_be_used, system_prompt, user_prompt_industry_data_classification))
+                continue
+        return output_industry_classification_lvl_I
+
 
-    
     #---------------------- Data preprocessing and extraction for Industry Subcategory Data ----------------------#
-    NACE_standardized_subcategory_list = json.loads(open_prompt_files(r'data\prompts\NACE_Classification_Tree.json')) # [output_industry_classification_lvl_I['industry']['NACE_standardized_name']]
-    NACE_standardized_subcategories = NACE_standardized_subcategory_list[output_industry_classification_lvl_I['industry']['NACE_standardized_name']]
-
-
-    user_prompt_industry_subcategory_classification = (f" Read the information provided for a company and the industry it operates in. "
-    + "You will have to provide the the NACE industry title, from the list provided below."
-    + "The NACE Standards Clasicifation List is here: "+ str(NACE_standardized_subcategories)
-    + f" *** The company information is the following *** {summarization_industry}:\n"
-    + 'Your outpout must follow the JSON template:'
-    + '{"industry": {"industry_name":"A title of the industry","NACE_standardized_name":"The NACE title from the list that matches the company industry"}}'
-    + "Ensure to output EXACTLY the JSON format without any additional explanations!")
-
-    # Read the NACE classification with subcategories and loop until the correct classification of the subcategory is made based on the job description
-    for attempt in range(3):
-        time.sleep(59)
-        output_industry_classification_lvl_II = json.loads(call_LLM_API_JSON(provider_model_to_be_used, system_prompt, user_prompt_industry_subcategory_classification))
-        
-        if output_industry_classification_lvl_II['industry']['NACE_standardized_name'] in NACE_standardized_subcategories:
-            print("~~ The NACE Level II classification is: ", output_industry_classification_lvl_II)
-            break
-        else:
-            print(f"~~ The NACE Level II classification {output_industry_classification_lvl_II['industry']['NACE_standardized_name']} is incorrect. Please classify the NACE industry again.")
-            # output_industry_classification_lvl_II = json.loads(call_LLM_API_JSON(provider_model_to_be_used, system_prompt, user_prompt_industry_subcategory_classification))
-            continue
+    def classify_NACE_level_II(results):
+        summarization_industry = results["industry_summarization"]
+        output_industry_classification_lvl_I = results["NACE_level_I"]
+        taxonomy = get_taxonomy()
+        NACE_level_I_name = output_industry_classification_lvl_I['industry']['NACE_standardized_name']
+        if not taxonomy.is_nace_section(NACE_level_I_name):
+            raise ValueError(f"The NACE Level I classification {NACE_level_I_name} is not a NACE section")
+        NACE_standardized_subcategories = taxonomy.nace_division_names(NACE_level_I_name)
+        NACE_all_subcategories = taxonomy.nace_division_names()
+        NACE_shortlisted_subcategories = get_label_index("NACE_divisions", NACE_all_subcategories).top_k(summarization_industry, nace_shortlist_size, within=NACE_standardized_subcategories)
+        NACE_level_II_schema = job_listing_sections_schema("NACE_level_II", ["industry"], NACE_names=NACE_shortlisted_subcategories)
+
+
+        user_prompt_industry_subcategory_classification = (f" Read the information provided for a company and the industry it operates in. "
+        + "You will have to provide the the NACE industry title, from the list provided below."
+        + "The NACE Standards Clasicifation List is here: "+ str(NACE_shortlisted_subcategories)
+        + f" *** The company information is the following *** {summarization_industry}:\n"
+        + 'Your outpout must follow the JSON template:'
+        + '{"industry": {"industry_name":"A title of the industry","NACE_standardized_name":"The NACE title from the list that matches the company industry"}}'
+        + "Ensure to output EXACTLY the JSON format without any additional explanations!")
+
+        # The request of this job alone (also when the packed request misses it, see `run_packable_stage`)
+        def request_NACE_level_II():
+            # Read the NACE classification with subcategories and loop until the correct classification of the subcategory is made based on the job description
+            for attempt in range(3):
+                output_industry_classification_lvl_II = json.loads(call_LLM_API_JSON(provider_model_to_be_used, system_prompt, user_prompt_industry_subcategory_classification, NACE_level_II_schema, stage="NACE_level_II", cache=llm_cache_mode if attempt == 0 else "refresh"))
+                snapped = snap_label(output_industry_classification_lvl_II['industry'], 'NACE_standardized_name', get_label_matcher("NACE_divisions", NACE_all_subcategories), within=NACE_standardized_subcategories)
+
+                if taxonomy.is_nace_division(output_industry_classification_lvl_II['industry']['NACE_standardized_name'], section=NACE_level_I_name):
+                    print("~~ The NACE Level II classification is: ", output_industry_classification_lvl_II)
+                    industry_confidence["NACE_level_II"] = classification_confidence(attempt, snapped)
+                    break
+                else:
+                    print(f"~~ The NACE Level II classification {output_industry_classification_lvl_II['industry']['NACE_standardized_name']} is incorrect. Please classify the NACE industry again.")
+                    # output_industry_classification_lvl_II = json.loads(call_LLM_API_JSON(provider_model_to_be_used, system_prompt, user_prompt_industry_subcategory_classification))
+                    continue
+            return output_industry_classification_lvl_II
+
+        output_industry_classification_lvl_II = run_packable_stage("NACE_level_II", {"company_information": summarization_industry, "NACE_list": NACE_shortlisted_subcategories,
+                                                                                  "NACE_section": NACE_level_I_name}, request_NACE_level_II)
+        # A packed answer was already checked by `pack_NACE_level_II`. An answer that is not a division of the section gets no confidence (it is not cached).
+        if "NACE_level_II" not in industry_confidence and taxonomy.is_nace_division(output_industry_classification_lvl_II['industry'].get('NACE_standardized_name'), section=NACE_level_I_name):
+            industry_confidence["NACE_level_II"] = classification_confidence(0)
+        return output_industry_classification_lvl_II
+
 
-        
     #---------------------- Data preprocessing and extraction for Main Job Data ----------------------#
-    user_prompt_for_job_title_summarization = ("You will read the description of a job posting. "
-    +"Then you will summarize the description of the job in a sentence."
-    +"Here is the job description: "+ str(db_job_data)
-    +'Your output must follow the JSON template: {"job_title_description":"The job title summarization in a sentence"}'
-    +"Ensure to output ONLY in JSON format without any additional explanations!")
-    
-    summarization_of_job_title = json.loads(call_LLM_API_JSON(provider_model_to_be_used, system_prompt, user_prompt_for_job_title_summarization))
-    # print("The job title summarization is: ", summarization_of_job_title, "\n")
-    
-    user_prompt_for_job_title = ("You will receive information about the job title of a job posting."
-    + "You will output ONLY the title of the job. Do not include the company name or any other information, just the job title itself."
-    + "The job information is the following: "+ str(summarization_of_job_title)
-    + 'Your output must follow the JSON template: {"job_title":"The job title"}'
-    + "Ensure to output ONLY in JSON format without any additional explanations!")
-    
-    time.sleep(59)
-    output_job_title = json.loads(call_LLM_API_JSON(provider_model_to_be_used, system_prompt, user_prompt_for_job_title))
-    print("The job title is: ", output_job_title, "\n")
-    
-    # ISCO_standardized_occupation_title = open_ISCO_file(r'data\prompts\standard_ISCO.txt')
-    ISCO_standardized_occupation_title = [title.strip('"') for title in open_prompt_files(r'data\prompts\standard_ISCO.txt').strip('[]').split(',\n')]
-    user_prompt_for_ISCO_classification = ("You will receive job information about the job title of a job posting."
-    +"You will have to classify the ISCO title based on the job description."
-    +"Step A: Read all ISCO titles"
-    +"Step B: Think step by step and choose the ISCO title that matches the job description!\n" 
-    +"Here is a list of ISCO titles is:"+ str(ISCO_standardized_occupation_title)
-    +"The job title is the following: "+ str(summarization_of_job_title) +"\n"
-    +'Your output must follow the JSON template: {"isco_name":"The ISCO title from the provided list"}'
-    +"Ensure that you choose the correct ISCO title in JSON format without any additional explanations."
-    +"The output must ONLY be an ISCO title that matches the job job description. Do not output Anything else except and ISCO Title")
-    
-    for attempt in range(3):
-        time.sleep(59)
-        output_ISCO_classification = json.loads(call_LLM_API_JSON(provider_model_to_be_used, system_prompt, user_prompt_for_ISCO_classification))
-        
-        if output_ISCO_classification['isco_name'] in ISCO_standardized_occupation_title:
-            print("~~ The ISCO classification is: ", output_ISCO_classification)
-            break
-        else:
-            print(f"~~ The ISCO classification {output_ISCO_classification['isco_name']} is incorrect. Retrying... (Attempt {attempt + 1}/3)")
-            time.sleep(1)  # Optional: Add small delay between retries
-            continue
+    def summarize_job_title(results):
+        user_prompt_for_job_title_summarization = ("You will read the description of a job posting. "
+        +"Then you will summarize the description of the job in a sentence."
+        +"Here is the job description: "+ job_prompt_text
+        +'Your output must follow the JSON template: {"job_title_description":"The job title summarization in a sentence"}'
+        +"Ensure to output ONLY in JSON format without any additional explanations!")
+
+        summarization_of_job_title = json.loads(call_LLM_API_JSON(provider_model_to_be_used, system_prompt, user_prompt_for_job_title_summarization, summary_schema("job_title_description"), stage="job_title_summarization", cache=llm_cache_mode))
+        # print("The job title summarization is: ", summarization_of_job_title, "\n")
+        return summarization_of_job_title
+
+
+    def extract_job_title(results):
+        summarization_of_job_title = results["job_title_summarization"]
+        user_prompt_for_job_title = ("You will receive information about the job title of a job posting."
+        + "You will output ONLY the title of the job. Do not include the company name or any other information, just the job title itself."
+        + "The job information is the following: "+ str(summarization_of_job_title)
+        + 'Your output must follow the JSON template: {"job_title":"The job title"}'
+        + "Ensure to output ONLY in JSON format without any additional explanations!")
+
+        def request_job_title():
+            return json.loads(call_LLM_API_JSON(provider_model_to_be_used, system_prompt, user_prompt_for_job_title, job_listing_sections_schema("job_title", ["job_title"]), stage="job_title", cache=llm_cache_mode))
+
+        output_job_title = run_packable_stage("job_title", str(summarization_of_job_title), request_job_title)
+        print("The job title is: ", output_job_title, "\n")
+        return output_job_title
+
+
+    def classify_ISCO(results):
+        summarization_of_job_title = results["job_title_summarization"]
+        taxonomy = get_taxonomy()
+        ISCO_standardized_occupation_title = taxonomy.isco_names()
+        # Only the ISCO titles nearest to the job summary go into the prompt
+        ISCO_shortlisted_occupation_title = get_label_index("ISCO", ISCO_standardized_occupation_title).top_k(summarization_of_job_title, isco_shortlist_size)
+        ISCO_schema = job_listing_sections_schema("ISCO", ["isco_name"], ISCO_names=ISCO_shortlisted_occupation_title)
+        user_prompt_for_ISCO_classification = ("You will receive job information about the job title of a job posting."
+        +"You will have to classify the ISCO title based on the job description."
+        +"Step A: Read all ISCO titles"
+        +"Step B: Think step by step and choose the ISCO title that matches the job description!\n" 
+        +"Here is a list of ISCO titles is:"+ str(ISCO_shortlisted_occupation_title)
+        +"The job title is the following: "+ str(summarization_of_job_title) +"\n"
+        +'Your output must follow the JSON template: {"isco_name":"The ISCO title from the provided list"}'
+        +"Ensure that you choose the correct ISCO title in JSON format without any additional explanations."
+        +"The output must ONLY be an ISCO title that matches the job job description. Do not output Anything else except and ISCO Title")
+
+        for attempt in range(3):
+            output_ISCO_classification = json.loads(call_LLM_API_JSON(provider_model_to_be_used, system_prompt, user_prompt_for_ISCO_classification, ISCO_schema, stage="ISCO", cache=llm_cache_mode if attempt == 0 else "refresh"))
+            snap_label(output_ISCO_classification, 'isco_name', get_label_matcher("ISCO", ISCO_standardized_occupation_title))
+
+            if taxonomy.is_isco_title(output_ISCO_classification['isco_name']):
+                print("~~ The ISCO classification is: ", output_ISCO_classification)
+                break
+            else:
+                print(f"~~ The ISCO classification {output_ISCO_classification['isco_name']} is incorrect. Retrying... (Attempt {attempt + 1}/3)")
+                continue
+        return output_ISCO_classification
+
 
     #---------------------- Data preprocessing and extraction for Experience and Employment Data ----------------------#
-    user_prompt_for_experience_and_employment = ("You will read the description of a job posting."
-    +"Then you will summarize, in one sentence: a) how many years experience is required for this job, b) what type of employment is offered (full time, part-time, remote, hybrid etc) c) the education level and degree required for this job."
-    +'Your output must follow the JSON template: {"experience_and_employment":"Summarization of the minimum years of experience required, educational level or degrees required and the employment type. The output must be in one sentence"}'
-    +"Ensure to output EXACTLY the JSON format without any additional explanations!"
-    +"Here is the job description: "+ str(db_job_data))
-    
-    time.sleep(59)
-    summarization_of_experience_and_employment = json.loads(call_LLM_API_JSON(provider_model_to_be_used, system_prompt, user_prompt_for_experience_and_employment))    
-    print("The experience and employment summarization is: ", summarization_of_experience_and_employment, "\n")
-    
-    ISCED_stabdardized_occupation_title = [open_prompt_files(r'data\prompts\standard_ISCED.txt')]
-    user_prompt_for_employment_seniority_educationalLevel_classification = ("You will receive information about the experience required and employment type of a job posting."
-    + "You will A) Read the information provided B) classify the job seniority C) classify the minimum level of education required based on ISCED"
-    + "D) employment Type and E) employment model for this job.\n"
-    + "The job information is the following: "+ str(summarization_of_experience_and_employment)
-    + " *** The ISCED Standard to choose from are here: *** :" + str(ISCED_stabdardized_occupation_title)
-    + "Your output must follow the JSON template:\n"
-    + '{"occupation_details":{"job_seniority": " "Internship", "Entry" (if no experience required), "Junior" (if 1-2 years required), "Mid", "Senior", "Director/Executive" level (if mentioned, eitherwise Mid level is the default value)","minimum_level_of_education": "Integer. The minimum level of education required, that matches the ISCED definition. Not the level that will be considered as an advantage","employment_type": "[optional] Choose "Full-time", "Part-time", or something else. If not available the output is "Null".","employment_model": "[optional] Choose "On Site", "Remote", "Hybrid", or another kind of employment model - if mentioned, otherwise null."}}'
-    + "Ensure to output EXACTLY the JSON format without any additional explanations!")
-    
-    time.sleep(59)
-    output_employment_seniority_educationalLevel_classification = json.loads(call_LLM_API_JSON(provider_model_to_be_used, system_prompt, user_prompt_for_employment_seniority_educationalLevel_classification))
-    print("~~ The experience and employment classification is: ", output_employment_seniority_educationalLevel_classification)
+    def summarize_experience_and_employment(results):
+        user_prompt_for_experience_and_employment = ("You will read the description of a job posting."
+        +"Then you will summarize, in one sentence: a) how many years experience is required for this job, b) what type of employment is offered (full time, part-time, remote, hybrid etc) c) the education level and degree required for this job."
+        +'Your output must follow the JSON template: {"experience_and_employment":"Summarization of the minimum years of experience required, educational level or degrees required and the employment type. The output must be in one sentence"}'
+        +"Ensure to output EXACTLY the JSON format without any additional explanations!"
+        +"Here is the job description: "+ job_prompt_text)
+
+        summarization_of_experience_and_employment = json.loads(call_LLM_API_JSON(provider_model_to_be_used, system_prompt, user_prompt_for_experience_and_employment, summary_schema("experience_and_employment"), stage="experience_and_employment_summarization", cache=llm_cache_mode))    
+        print("The experience and employment summarization is: ", summarization_of_experience_and_employment, "\n")
+        return summarization_of_experience_and_employment
+
+
+    def classify_occupation_details(results):
+        summarization_of_experience_and_employment = results["experience_and_employment_summarization"]
+        ISCED_stabdardized_occupation_title = [get_taxonomy().isced_prompt()]
+        user_prompt_for_employment_seniority_educationalLevel_classification = ("You will receive information about the experience required and employment type of a job posting."
+        + "You will A) Read the information provided B) classify the job seniority C) classify the minimum level of education required based on ISCED"
+        + "D) employment Type and E) employment model for this job.\n"
+        + "The job information is the following: "+ str(summarization_of_experience_and_employment)
+        + " *** The ISCED Standard to choose from are here: *** :" + str(ISCED_stabdardized_occupation_title)
+        + "Your output must follow the JSON template:\n"
+        + '{"occupation_details":{"job_seniority": " "Internship", "Entry" (if no experience required), "Junior" (if 1-2 years required), "Mid", "Senior", "Director/Executive" level (if mentioned, eitherwise Mid level is the default value)","minimum_level_of_education": "Integer. The minimum level of education required, that matches the ISCED definition. Not the level that will be considered as an advantage","employment_type": "[optional] Choose "Full-time", "Part-time", or something else. If not available the output is "Null".","employment_model": "[optional] Choose "On Site", "Remote", "Hybrid", or another kind of employment model - if mentioned, otherwise null."}}'
+        + "Ensure to output EXACTLY the JSON format without any additional explanations!")
+
+        def request_occupation_details():
+            return json.loads(call_LLM_API_JSON(provider_model_to_be_used, system_prompt, user_prompt_for_employment_seniority_educationalLevel_classification,
+                                                job_listing_sections_schema("occupation_details", ["occupation_details"], ISCED_levels=list(get_taxonomy().isced)), stage="occupation_details", cache=llm_cache_mode))
+
+        output_employment_seniority_educationalLevel_classification = run_packable_stage("occupation_details", str(summarization_of_experience_and_employment), request_occupation_details)
+        print("~~ The experience and employment classification is: ", output_employment_seniority_educationalLevel_classification)
+        return output_employment_seniority_educationalLevel_classification
 
 
     #---------------------- Data preprocessing and extraction for Skills, Education Degree and Qualifications Data ----------------------#
-    user_prompt_for_skills_and_qualifications_summarization = ("You will read the description of a job posting."
-    + "Then you will summarize the skills and qualifications required for this job."
-    + "Here is the job description: "+ str(db_job_data)
-    + 'Your output must follow the JSON template: {"skills_and_qualifications":"Summary of the skills, types of skills and other requirements for the job"}'
-    +"Ensure to output EXACTLY the JSON format without any additional explanations!")
-    
-    time.sleep(59)
-    summarization_of_skills_and_qualifications = call_LLM_API_JSON(provider_model_to_be_used, system_prompt, user_prompt_for_skills_and_qualifications_summarization)
-    print("The skills and qualifications summarization is: ", summarization_of_skills_and_qualifications, "\n\n")
-
-    user_prompt_for_skills_classification = ("You will receive information about the skills required for a job posting."
-    + "You will A) Read the information provided B) classify the skills required for this job."
-    + "The job information is the following: "+ str(summarization_of_skills_and_qualifications)
-    + "Do not include degrees and Certificates in this section."
-    + "Your output must follow the JSON template:\n"
-    + '{"skills": [{"skills_category": "Either `Soft Skill` or `Hard Skill`", "skills_name": "The name of each individual skill mentioned. The name must be brief, from 1 to 3 words. Each knowledge of languages, software or similar must be classified separately", "skills_type": "`Technical skills`, `Programming Languages`, `Software`, `Professional`, `Drivers Licence`, `Personality Trait` and others should be included here. Each skill must have an individual record in the list"}]}'
-    +"Ensure to output EXACTLY the JSON format without any additional explanations!")
-
-    time.sleep(59)
-    output_skills_classification = json.loads(call_LLM_API_JSON(provider_model_to_be_used, system_prompt, user_prompt_for_skills_classification))
-    print("~~ The skills classification is: ", output_skills_classification)
-    
-    user_prompt_for_degrees_and_qualifications_classification = ("You will receive information about the degrees and qualifications required for a job posting."
-    + "You will A) Read the information provided B) classify the degrees and qualifications required for this job."
-    + "The job information is the following: "+ str(summarization_of_skills_and_qualifications)
-    + "Do not include skills or past work experience in this section."
-    + "If multiple certifications, degrees or fields of study are mentioned, then they must have all be classified individually."
-    + "Your output must follow the JSON template:\n"
-    + '{"certifications": [{"certification_name": "Certification Name"}], "academic_degree": [{"academic_degree_type": "The academic degree type (e.g. Bachelors, Masters, PhD, etc)", "academic_degree_field": "The Field of Study for the degree"}]}'
-    +"Ensure to output EXACTLY the JSON format without any additional explanations!")
-    
-    time.sleep(59)
-    output_degrees_and_qualifications_classification = json.loads(call_LLM_API_JSON(provider_model_to_be_used, system_prompt, user_prompt_for_degrees_and_qualifications_classification))
-    print("~~ The degrees and qualifications classification is: ", output_degrees_and_qualifications_classification)
+    def summarize_skills_and_qualifications(results):
+        user_prompt_for_skills_and_qualifications_summarization = ("You will read the description of a job posting."
+        + "Then you will summarize the skills and qualifications required for this job."
+        + "Here is the job description: "+ job_prompt_text
+        + 'Your output must follow the JSON template: {"skills_and_qualifications":"Summary of the skills, types of skills and other requirements for the job"}'
+        +"Ensure to output EXACTLY the JSON format without any additional explanations!")
+
+        summarization_of_skills_and_qualifications = call_LLM_API_JSON(provider_model_to_be_used, system_prompt, user_prompt_for_skills_and_qualifications_summarization, summary_schema("skills_and_qualifications"), stage="skills_and_qualifications_summarization", cache=llm_cache_mode)
+        print("The skills and qualifications summarization is: ", summarization_of_skills_and_qualifications, "\n\n")
+        return summarization_of_skills_and_qualifications
+
+
+    def classify_skills(results):
+        summarization_of_skills_and_qualifications = results["skills_and_qualifications_summarization"]
+        user_prompt_for_skills_classification = ("You will receive information about the skills required for a job posting."
+        + "You will A) Read the information provided B) classify the skills required for this job."
+        + "The job information is the following: "+ str(summarization_of_skills_and_qualifications)
+        + "Do not include degrees and Certificates in this section."
+        + "Your output must follow the JSON template:\n"
+        + '{"skills": [{"skills_category": "Either `Soft Skill` or `Hard Skill`", "skills_name": "The name of each individual skill mentioned. The name must be brief, from 1 to 3 words. Each knowledge of languages, software or similar must be classified separately", "skills_type": "`Technical skills`, `Programming Languages`, `Software`, `Professional`, `Drivers Licence`, `Personality Trait` and others should be included here. Each skill must have an individual record in the list"}]}'
+        +"Ensure to output EXACTLY the JSON format without any additional explanations!")
+
+        output_skills_classification = json.loads(call_LLM_API_JSON(provider_model_to_be_used, system_prompt, user_prompt_for_skills_classification, job_listing_sections_schema("skills", ["skills"]), stage="skills", cache=llm_cache_mode))
+        print("~~ The skills classification is: ", output_skills_classification)
+        return output_skills_classification
+
+
+    def classify_degrees_and_qualifications(results):
+        summarization_of_skills_and_qualifications = results["skills_and_qualifications_summarization"]
+        user_prompt_for_degrees_and_qualifications_classification = ("You will receive information about the degrees and qualifications required for a job posting."
+        + "You will A) Read the information provided B) classify the degrees and qualifications required for this job."
+        + "The job information is the following: "+ str(summarization_of_skills_and_qualifications)
+        + "Do not include skills or past work experience in this section."
+        + "If multiple certifications, degrees or fields of study are mentioned, then they must have all be classified individually."
+        + "Your output must follow the JSON template:\n"
+        + '{"certifications": [{"certification_name": "Certification Name"}], "academic_degree": [{"academic_degree_type": "The academic degree type (e.g. Bachelors, Masters, PhD, etc)", "academic_degree_field": "The Field of Study for the degree"}]}'
+        +"Ensure to output EXACTLY the JSON format without any additional explanations!")
+
+        output_degrees_and_qualifications_classification = json.loads(call_LLM_API_JSON(provider_model_to_be_used, system_prompt, user_prompt_for_degrees_and_qualifications_classification,
+                                                                                      job_listing_sections_schema("degrees_and_qualifications", ["certifications", "academic_degree"]), stage="degrees_and_qualifications", cache=llm_cache_mode))
+        print("~~ The degrees and qualifications classification is: ", output_degrees_and_qualifications_classification)
+        return output_degrees_and_qualifications_classification
 
-    #---------------------- Data preprocessing and extraction for Experience, Benefits, and Responsibilities  ----------------------#
-    user_prompt_for_summarization_of_experience_responsibilities_benefits = ("You will read the description of a job posting."
-    + "Then you will summarize the experience required, the employee benefits and the employee responsibilities for this job."
-    + "Here is the job description: "+ str(db_job_data)
-    + "Your output must follow the JSON template: {'experience_benefits_and_responsibilities':'Summary of all the experience required, benefits and responsibilities from the job text provided'}"
-    +"Ensure to output EXACTLY the JSON format without any additional explanations!")
-    
-    time.sleep(59)
-    summarization_of_experience_responsibilities_benefits = call_LLM_API_JSON(provider_model_to_be_used, system_prompt, user_prompt_for_summarization_of_experience_responsibilities_benefits)
-
-    user_prompt_for_experience_responsibilities_benefits_classification = (
-    "You will receive information about the benefits of a job posting."
-    " You will: "
-    "A) Read the information provided. "
-    "B) Classify the experience required of this job, if any. "
-    "C) Classify the benefits offered by the employer, if any. "
-    "D) Classify the responsibilities of the employee, if any. "
-    "The job information is the following: " + str(summarization_of_experience_responsibilities_benefits) +
-    " Your output must follow the JSON template: "
-    '{"experience": {"experience_required": "[boolean] The minimum years of experience required as a boolean value - if experience is required or not", '
-    '"years_of_experience": "[Integer] The minimum years of experience required. Outpute an integer,"}, '
-    '"benefits": [{"benefit_name": "The description of the benefit mentioned in the job listing. VERY brief description, 1 to 4 words."}], '
-    '"responsibilities": [{"responsibility_name": "The description of the responsibility mentioned in the job listing. VERY brief description, 1 to 4 words."}]} '
-    "Ensure to output EXACTLY the JSON format without any additional explanations!"
-    )
-
-    time.sleep(59)
-    output_experience_benefits_classification = json.loads(call_LLM_API_JSON(provider_model_to_be_used, system_prompt, user_prompt_for_experience_responsibilities_benefits_classification))
-    print("~~ The experience, benefits and responsibilities classification is: ", output_experience_benefits_classification)
 
+    #---------------------- Data preprocessing and extraction for Experience, Benefits, and Responsibilities  ----------------------#
+    def summarize_experience_responsibilities_benefits(results):
+        user_prompt_for_summarization_of_experience_responsibilities_benefits = ("You will read the description of a job posting."
+        + "Then you will summarize the experience required, the employee benefits and the employee responsibilities for this job."
+        + "Here is the job description: "+ job_prompt_text
+        + "Your output must follow the JSON template: {'experience_benefits_and_responsibilities':'Summary of all the experience required, benefits and responsibilities from the job text provided'}"
+        +"Ensure to output EXACTLY the JSON format without any additional explanations!")
+
+        summarization_of_experience_responsibilities_benefits = call_LLM_API_JSON(provider_model_to_be_used, system_prompt, user_prompt_for_summarization_of_experience_responsibilities_benefits, summary_schema("experience_benefits_and_responsibilities"), stage="experience_responsibilities_benefits_summarization", cache=llm_cache_mode)
+        return summarization_of_experience_responsibilities_benefits
+
+
+    def classify_experience_benefits_and_responsibilities(results):
+        summarization_of_experience_responsibilities_benefits = results["experience_responsibilities_benefits_summarization"]
+        user_prompt_for_experience_responsibilities_benefits_classification = (
+        "You will receive information about the benefits of a job posting."
+        " You will: "
+        "A) Read the information provided. "
+        "B) Classify the experience required of this job, if any. "
+        "C) Classify the benefits offered by the employer, if any. "
+        "D) Classify the responsibilities of the employee, if any. "
+        "The job information is the following: " + str(summarization_of_experience_responsibilities_benefits) +
+        " Your output must follow the JSON template: "
+        '{"experience": {"experience_required": "[boolean] The minimum years of experience required as a boolean value - if experience is required or not", '
+        '"years_of_experience": "[Integer] The minimum years of experience required. Outpute an integer,"}, '
+        '"benefits": [{"benefit_name": "The description of the benefit mentioned in the job listing. VERY brief description, 1 to 4 words."}], '
+        '"responsibilities": [{"responsibility_name": "The description of the responsibility mentioned in the job listing. VERY brief description, 1 to 4 words."}]} '
+        "Ensure to output EXACTLY the JSON format without any additional explanations!"
+        )
+
+        output_experience_benefits_classification = json.loads(call_LLM_API_JSON(provider_model_to_be_used, system_prompt, user_prompt_for_experience_responsibilities_benefits_classification,
+                                                                               job_listing_sections_schema("experience_benefits_and_responsibilities", ["experience", "benefits", "responsibilities"]), stage="experience_benefits_and_responsibilities", cache=llm_cache_mode))
+        print("~~ The experience, benefits and responsibilities classification is: ", output_experience_benefits_classification)
+        return output_experience_benefits_classification
+
+
+    # Run the stages (a failed stage raises a StageGraphError, after the stages that do not depend on it have finished)
+    industry_stages = [
+        Stage("industry_summarization", summarize_industry),
+        Stage("NACE_level_I", classify_NACE_level_I, ["industry_summarization"]),
+        Stage("NACE_level_II", classify_NACE_level_II, ["industry_summarization", "NACE_level_I"]),
+    ] if cached_industry is None else []
+    results = run_stage_graph(industry_stages + [
+        Stage("job_title_summarization", summarize_job_title),
+        Stage("job_title", extract_job_title, ["job_title_summarization"]),
+        Stage("ISCO", classify_ISCO, ["job_title_summarization"]),
+        Stage("experience_and_employment_summarization", summarize_experience_and_employment),
+        Stage("occupation_details", classify_occupation_details, ["experience_and_employment_summarization"]),
+        Stage("skills_and_qualifications_summarization", summarize_skills_and_qualifications),
+        Stage("skills", classify_skills, ["skills_and_qualifications_summarization"]),
+        Stage("degrees_and_qualifications", classify_degrees_and_qualifications, ["skills_and_qualifications_summarization"]),
+        Stage("experience_responsibilities_benefits_summarization", summarize_experience_responsibilities_benefits),
+        Stage("experience_benefits_and_responsibilities", classify_experience_benefits_and_responsibilities, ["experience_responsibilities_benefits_summarization"]),
+    ], label=f"Extraction of {db_job_data['job_reference']}")
+
+    if cached_industry is None:
+        # Only an industry checked at both NACE levels is cached
+        if "NACE_level_I" in industry_confidence and "NACE_level_II" in industry_confidence:
+            record_company_industry(db_job_data.get("company_name"), results["NACE_level_II"]["industry"], min(industry_confidence.values()), db_job_data["job_reference"])
+    else:
+        print(f"~~ The industry of {db_job_data.get('company_name')} is taken from the company cache: {cached_industry}")
 
     # Combine all JSON outputs into a single JSON object
     final_output_data_extracted_classified = {
         "job_reference": db_job_data["job_reference"],
         "job_description": db_job_data["job_description"],
-        **output_industry_classification_lvl_II,
-        **output_job_title,
-        **output_ISCO_classification,
-        **output_employment_seniority_educationalLevel_classification,
-        **output_skills_classification,
-        **output_degrees_and_qualifications_classification,
-        **output_experience_benefits_classification,
+        **(cached_industry or results["NACE_level_II"]),
+        **results["job_title"],
+        **results["ISCO"],
+        **results["occupation_details"],
+        **results["skills"],
+        **results["degrees_and_qualifications"],
+        **results["experience_benefits_and_responsibilities"],
     }
     # print(final_output_data_extracted_classified)
-    
-    with open(f'final_output_data_extractedclassified_test.json', 'w', encoding='utf-8') as f:
-        json.dump(final_output_data_extracted_classified, f, ensure_ascii=False, indent=4)
+    # (the extracted data of every job is kept in job_listings.extracted_data, see save_extracted_data)
 
     return final_output_data_extracted_classified
 
 
+#---------------------- Multi-job packing of the small stages ----------------------#
+# The short stages of the chain (job title from the summary, seniority and education from the summary, NACE level II) can pack the
+# inputs of several jobs in one request with one key per job (see helpers_micro_batch). Each function gets {key: input} and returns
+# {key: output} with only the valid outputs, the jobs that are missing are requested again on their own.
+def run_packable_stage(stage, item, single_call):
+    if not micro_batching:
+        return single_call()
+    return get_micro_batcher(stage, packed_stage_calls[stage]).submit(item, single_call)
+
+
+def call_packed_stage(stage, items, instructions, item_template, item_fields):
+    system_prompt = open_prompt_files("data/prompts/system_prompt_extract_data.txt")
+    user_prompt = (instructions
+    + " *** The jobs are the following (one key for each job) *** " + json.dumps(items, ensure_ascii=False)
+    + " Your output must follow the JSON template: {\"<key of the job>\": " + item_template + "}, with one entry for each of the keys " + ", ".join(items) + "."
+    + " Ensure to output EXACTLY the JSON format without any additional explanations!")
+    schema = output_json_schema(f"{stage}_packed", {key: (create_model(f"{stage}_{key}", **item_fields(key)), ...) for key in items})
+    output = json.loads(call_LLM_API_JSON(provider_model_to_be_used, system_prompt, user_prompt, schema, stage=stage))
+    return output if isinstance(output, dict) else {}
+
+
+def pack_job_titles(items):
+    output = call_packed_stage("job_title", items,
+        "You will receive information about the job title of several job postings. For each job you will output ONLY the title of the job. "
+        + "Do not include the company name or any other information, just the job title itself.",
+        '{"job_title": "The job title"}', lambda key: {"job_title": (str, ...)})
+    return {key: {"job_title": output[key]["job_title"]} for key in items
+            if isinstance(output.get(key), dict) and isinstance(output[key].get("job_title"), str) and output[key]["job_title"].strip()}
+
+
+def pack_occupation_details(items):
+    taxonomy = get_taxonomy()
+    output = call_packed_stage("occupation_details", items,
+        "You will receive information about the experience required and employment type of several job postings. For each job you will "
+        + "A) classify the job seniority B) classify the minimum level of education required based on ISCED C) the employment type and D) the employment model. "
+        + taxonomy.isced_prompt(),
+        extraction_section_templates["occupation_details"].join(['{"occupation_details": ', '}']),
+        lambda key: {"occupation_details": job_listing_output_fields(ISCED_levels=list(taxonomy.isced))["occupation_details"]})
+    packed = {}
+    for key in items:
+        details = output.get(key, {}).get("occupation_details") if isinstance(output.get(key), dict) else None
+        if isinstance(details, dict) and isinstance(details.get("job_seniority"), str) and taxonomy.is_isced_level(details.get("minimum_level_of_education")):
+            packed[key] = {"occupation_details": details}
+    return packed
+
+
+def pack_NACE_level_II(items):
+    taxonomy = get_taxonomy()
+    matcher = get_label_matcher("NACE_divisions", taxonomy.nace_division_names())
+    output = call_packed_stage("NACE_level_II", {key: {"company_information": item["company_information"], "NACE_list": item["NACE_list"]} for key, item in items.items()},
+        "You will read the information provided for several companies and the industry each one operates in. "
+        + "For each company you will have to provide the NACE industry title, from the NACE list of that company.",
+        '{"industry": {"industry_name": "A title of the industry", "NACE_standardized_name": "The NACE title from the list of the company that matches the company industry"}}',
+        lambda key: {"industry": job_listing_output_fields(NACE_names=items[key]["NACE_list"])["industry"]})
+    packed = {}
+    for key, item in items.items():
+        industry_output = output.get(key, {}).get("industry") if isinstance(output.get(key), dict) else None
+        snap_label(industry_output, "NACE_standardized_name", matcher, within=taxonomy.nace_division_names(item["NACE_section"]))
+        if isinstance(industry_output, dict) and taxonomy.is_nace_division(industry_output.get("NACE_standardized_name"), section=item["NACE_section"]):
+            packed[key] = {"industry": industry_output}
+    return packed
+
+
+packed_stage_calls = {"job_title": pack_job_titles, "occupation_details": pack_occupation_details, "NACE_level_II": pack_NACE_level_II}
+
+
+#---------------------- One-shot extraction ----------------------#
+# The JSON template of every section of a JobListing (same keys as the pydantic model and the same instructions as the step by step prompts)
+extraction_section_templates = {
+    "industry": '{"industry_name": "A title of the industry", "NACE_standardized_name": "The NACE division title (from the NACE list) that matches the company industry"}',
+    "job_title": '"The title of the job only, without the company name or any other information"',
+    "isco_name": '"The ISCO title from the ISCO list that matches the job description"',
+    "occupation_details": '{"job_seniority": "`Internship`, `Entry` (if no experience required), `Junior` (if 1-2 years required), `Mid`, `Senior` or `Director/Executive` (Mid is the default value)", "minimum_level_of_education": "Integer. The minimum ISCED level of education required, not the level considered as an advantage", "employment_type": "[optional] `Full-time`, `Part-time` or something else, null if not mentioned", "employment_model": "[optional] `On Site`, `Remote`, `Hybrid` or another employment model, null if not mentioned"}',
+    "skills": '[{"skills_category": "Either `Soft Skill` or `Hard Skill`", "skills_name": "The name of each individual skill, 1 to 3 words. No degrees or certificates", "skills_type": "`Technical skills`, `Programming Languages`, `Software`, `Professional`, `Drivers Licence`, `Personality Trait` or other"}]',
+    "certifications": '[{"certification_name": "Name of each individual professional certification"}]',
+    "academic_degree": '[{"academic_degree_type": "The academic degree type (e.g. Bachelors, Masters, PhD, etc)", "academic_degree_field": "The field of study of the degree"}]',
+    "experience": '{"experience_required": "[boolean] If experience is required or not", "years_of_experience": "[Integer] The minimum years of experience required, null if not mentioned"}',
+    "benefits": '[{"benefit_name": "Each benefit offered by the employer, VERY brief, 1 to 4 words"}]',
+    "responsibilities": '[{"responsibility_name": "Each responsibility of the employee, VERY brief, 1 to 4 words"}]',
+}
+
+
+# The sections of the extracted data that are not valid, with the reason. Each section of the JobListing is checked on its own
+# with the pydantic model, and the NACE / ISCO titles and the ISCED level are checked against the taxonomies.
+def invalid_job_listing_sections(data, taxonomy):
+    invalid_sections = {section: "missing" for section in extraction_section_templates if section not in data}
+    try:
+        JobListing(**data)
+    except ValidationError as e:
+        for error in e.errors():
+            section = error["loc"][0] if error["loc"] else None
+            if section in extraction_section_templates:
+                invalid_sections.setdefault(section, f"{'.'.join(str(loc) for loc in error['loc'])}: {error['msg']}")
+
+    if "industry" not in invalid_sections and not taxonomy.is_nace_division(data["industry"].get("NACE_standardized_name")):
+        invalid_sections["industry"] = f"NACE_standardized_name `{data['industry'].get('NACE_standardized_name')}` is not a title of the NACE list"
+    if "occupation_details" not in invalid_sections and not taxonomy.is_isced_level(data["occupation_details"].get("minimum_level_of_education")):
+        invalid_sections["occupation_details"] = f"minimum_level_of_education `{data['occupation_details'].get('minimum_level_of_education')}` is not an ISCED level"
+    if "isco_name" not in invalid_sections and not taxonomy.is_isco_title(data["isco_name"]):
+        invalid_sections["isco_name"] = f"isco_name `{data['isco_name']}` is not a title of the ISCO list"
+    return invalid_sections
+
+
+# Extract all the sections of a JobListing with a single LLM call, instead of the ~14 calls of the step by step chain.
+# Every section is validated on its own and only the sections that failed are requested again (up to `one_shot_max_repairs` times).
+# `refresh_cache`: see `job_data_preprocessing_extraction_classification`.
+def job_data_one_shot_extraction(model, db_job_data, refresh_cache=False):
+    llm_cache_mode = "refresh" if refresh_cache else True
+    system_prompt = open_prompt_files("data/prompts/system_prompt_extract_data.txt")
+    taxonomy = get_taxonomy()
+    NACE_tree = taxonomy.nace_tree()
+    NACE_divisions_list = taxonomy.nace_division_names()
+    ISCO_titles = taxonomy.isco_names()
+    ISCED_levels = taxonomy.isced_prompt()
+
+    # Only the NACE divisions and ISCO titles nearest to the job go into the prompt (the validation still accepts any title of the full lists)
+    job_prompt_text = format_job_for_prompt(db_job_data)
+    job_text = job_prompt_text[:4000]
+    NACE_shortlist = get_label_index("NACE_divisions", NACE_divisions_list).top_k(job_text, nace_shortlist_size)
+    NACE_shortlist_tree = {section: [division for division in divisions if division in NACE_shortlist] for section, divisions in NACE_tree.items()}
+    ISCO_shortlist = get_label_index("ISCO", ISCO_titles).top_k(job_text, isco_shortlist_size)
+
+    # The industry of a company in the cache is not requested (and the NACE list is not in the prompt)
+    cached_industry = cached_company_industry(db_job_data.get("company_name"))
+    reference_lists = (("*** The NACE list (section: [division titles]) is here: *** " + json.dumps({section: divisions for section, divisions in NACE_shortlist_tree.items() if divisions}, ensure_ascii=False) + " " if cached_industry is None else "")
+    + "*** The ISCO titles are here: *** " + json.dumps(ISCO_shortlist, ensure_ascii=False)
+    + " *** The ISCED levels are here: *** " + ISCED_levels)
+
+    extracted_data = dict(cached_industry or {})
+    sections_to_request = {section: None for section in extraction_section_templates if section not in extracted_data}
+    industry_calls, industry_snapped = 0, False
+    for attempt in range(one_shot_max_repairs + 1):
+        industry_calls += "industry" in sections_to_request
+        template = "{" + ", ".join(f'"{section}": {extraction_section_templates[section]}' for section in sections_to_request) + "}"
+        corrections = "".join(f" The previous `{section}` was invalid ({reason})." for section, reason in sections_to_request.items() if reason)
+        user_prompt = ("You will read the description of a job posting and extract the job data."
+        + " Classify the industry with a NACE division title, the occupation with an ISCO title and the education with an ISCED level, from the lists below."
+        + " Lists of skills, certifications, degrees, benefits and responsibilities must have one record for each item, or be empty if none is mentioned."
+        + reference_lists
+        + " *** Here is the job description: *** " + job_prompt_text
+        + corrections
+        + " Your output must follow the JSON template: " + template
+        + " Ensure to output EXACTLY the JSON format without any additional explanations!")
+
+        try:
+            output_schema = job_listing_sections_schema("JobListing", list(sections_to_request), NACE_names=NACE_shortlist, ISCO_names=ISCO_shortlist, ISCED_levels=list(taxonomy.isced))
+            output = json.loads(call_LLM_API_JSON(provider_model_to_be_used, system_prompt, user_prompt, output_schema, stage="one_shot", cache=llm_cache_mode if attempt == 0 else "refresh"))
+        except ValueError:
+            output = {}
+        if not isinstance(output, dict):
+            output = {}
+        extracted_data.update({section: output[section] for section in sections_to_request if section in output})
+        if "industry" in sections_to_request:
+            industry_snapped = snap_label(extracted_data.get("industry"), "NACE_standardized_name", get_label_matcher("NACE_divisions", NACE_divisions_list))
+        snap_label(extracted_data, "isco_name", get_label_matcher("ISCO", ISCO_titles))
+
+        candidate = {"job_reference": db_job_data["job_reference"], "job_description": db_job_data["job_description"], **extracted_data}
+        sections_to_request = invalid_job_listing_sections(candidate, taxonomy)
+        if not sections_to_request:
+            print(f"~~ One-shot extraction of {db_job_data['job_reference']} is valid after {attempt + 1} call(s).")
+            if cached_industry is None:
+                record_company_industry(db_job_data.get("company_name"), candidate["industry"], classification_confidence(industry_calls - 1, industry_snapped), db_job_data["job_reference"])
+            return candidate
+        print(f"~~ One-shot extraction of {db_job_data['job_reference']}: invalid sections {list(sections_to_request)}. Requesting them again... (Attempt {attempt + 1}/{one_shot_max_repairs + 1})")
+        # Invalid sections are removed, so a section that is not fixed stays invalid in the final validation
+        for section in sections_to_request:
+            extracted_data.pop(section, None)
+
+    return candidate
+
+
 """ ----------------- Job Data Processing and importing to Graph Database ----------------- """
-def process_jobs_and_import_to_graphDB(driver, country):
-    # Get all the jobs that are not imported to the Graph DB
+# Extract the data of one job, validate it and import it to the Graph DB. Returns True if the job was imported.
+# With a `duplicate_index` (see helpers_near_duplicates), a job that is a near-duplicate of a job already extracted (e.g. the same
+# advert reposted under a new reference) gets a copy of its data instead of a new extraction by the LLM.
+def process_job_and_import_to_graphDB(session, job_data, extract_job_data, current_model, country, duplicate_index=None):
+    print("~~ Job Data: ",job_data, "\n")
+    signature = minhash_signature(job_data['job_description']) if duplicate_index is not None else None
+    canonical_reference, similarity = duplicate_index.query(signature, exclude=job_data['job_reference']) if signature else (None, 0.0)
+    canonical_data = get_extracted_data(canonical_reference) if canonical_reference else None
+    if canonical_data:
+        print(f"~~ Job {job_data['job_reference']} is a near-duplicate of {canonical_reference} (similarity {similarity:.2f}). Reusing its extracted data.")
+        processed_job = {**canonical_data, "job_reference": job_data['job_reference'], "job_description": job_data['job_description']}
+        save_extracted_data(job_data['job_reference'], processed_job)
+        save_duplicate_of(job_data['job_reference'], canonical_reference, similarity)
+        with graph_import_lock:
+            import_job_data_to_neo4j(session, processed_job, processed_job['job_reference'], country, processed_job['job_description'])
+        return True
+
+    max_retries = 5
+    for retry_count in range(max_retries):
+        try:
+            processed_job = extract_job_data(current_model, job_data, refresh_cache=retry_count > 0)
+            
+            if validate_job_listing(processed_job):
+                print("--------- Job data is valid! ---------\n")
+            else:
+                print("--------- Job data is invalid! ---------\n")
+                return False
+            
+            # Keep the extracted data, so the reposts of this job can reuse it
+            save_extracted_data(job_data['job_reference'], processed_job, signature)
+            if duplicate_index is not None:
+                duplicate_index.add(job_data['job_reference'], signature)
+            with graph_import_lock:
+                import_job_data_to_neo4j(session, processed_job, processed_job['job_reference'], country, processed_job['job_description'])
+            print(f"--------- Job {job_data['job_reference']} processed and imported to the Graph DB.\n\n")
+            return True
+        except Exception as e:
+            error_message = str(e)
+            print(f"Error Message: {error_message}!")
+            logging.error(f"Error processing job {job_data['job_reference']} | {error_message}")
+
+    print(f"Failed to process job {job_data['job_reference']} after {max_retries} attempts.\n\n")
+    return False
+
+
+# Process all the jobs that are not imported to the Graph DB with a pool of `workers` threads.
+# Every worker takes the next job from a shared queue and imports it with its own Neo4j session (sessions are not thread-safe),
+# one import at a time (see `graph_import_lock`).
+# On Ctrl+C the workers finish the jobs in progress, do not start new ones and close their sessions.
+def process_jobs_and_import_to_graphDB(driver, country, workers=job_workers):
+    # Get all the jobs that are not imported to the Graph DB (with their clean description, see normalize_job_descriptions)
+    ensure_description_normalization_schema()
     all_job_not_into_graphDB = get_jobs_not_imported_to_neo4j()
     
     if not all_job_not_into_graphDB:
@@ -475,34 +875,56 @@ def process_jobs_and_import_to_graphDB(driver, country):
     
     # The system prompt to be used for the LLM model
     current_model = lmstudio_model  # For Ollama or OpenAI a specific model named must be passed. for LMStudio is not necessary.
+    extract_job_data = job_data_one_shot_extraction if extraction_mode == "one_shot" else job_data_preprocessing_extraction_classification
 
-    with driver.session() as session:
-        # Loop through all the jobs that are not imported to the Graph DB and import them
-        for job_data in all_job_not_into_graphDB:
-            print("~~ Job Data: ",job_data, "\n")
-            max_retries = 5
-            for retry_count in range(max_retries):
+    ensure_duplicate_detection_schema()
+    ensure_company_industry_schema()
+    duplicate_index = load_duplicate_index() if duplicate_detection else None
+
+    jobs = queue.Queue()
+    for job_data in all_job_not_into_graphDB:
+        jobs.put(job_data)
+    stop_event = threading.Event()
+    counts, counts_lock = Counter(), threading.Lock()
+
+    def worker():
+        with driver.session() as session:
+            while not stop_event.is_set():
                 try:
-                    processed_job = job_data_preprocessing_extraction_classification(current_model, job_data)
-                    
-                    if validate_job_listing(processed_job):
-                        print("--------- Job data is valid! ---------\n")
-                    else:
-                        print("--------- Job data is invalid! ---------\n")
-                        break
-                    
-                    import_job_data_to_neo4j(session, processed_job, processed_job['job_reference'], country, processed_job['job_description'])
-                    print(f"--------- Job {job_data['job_reference']} processed and imported to the Graph DB.\n\n")
-                    # wait a bit before processing the next job
-                    time.sleep(61)
-                    break
+                    job_data = jobs.get_nowait()
+                except queue.Empty:
+                    return
+                try:
+                    imported = process_job_and_import_to_graphDB(session, job_data, extract_job_data, current_model, country, duplicate_index)
                 except Exception as e:
-                    error_message = str(e)
-                    print(f"Error Message: {error_message}!")
-                    logging.error(f"Error processing job {job_data['job_reference']} | {error_message}")
-
-            else:
-                print(f"Failed to process job {job_data['job_reference']} after {max_retries} attempts.\n\n")
+                    logging.error(f"Error processing job {job_data['job_reference']} | {e}")
+                    imported = False
+                with counts_lock:
+                    counts["imported" if imported else "failed"] += 1
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker, name=f"job-worker-{i + 1}") for i in range(max(1, min(workers, len(all_job_not_into_graphDB))))]
+    for thread in threads:
+        thread.start()
+    try:
+        # Join with a timeout, so Ctrl+C reaches the main thread
+        for thread in threads:
+            while thread.is_alive():
+                thread.join(timeout=1)
+    except KeyboardInterrupt:
+        print("~~ Stopping: the workers finish the jobs in progress and close their sessions...")
+        stop_event.set()
+        for thread in threads:
+            thread.join()
+
+    elapsed = time.perf_counter() - started
+    processed = counts["imported"] + counts["failed"]
+    print(f"~~ {counts['imported']} jobs imported and {counts['failed']} failed ({jobs.qsize()} not started) in {elapsed:.0f}s "
+          f"with {len(threads)} workers ({processed / elapsed * 60 if elapsed else 0:.1f} jobs/min).")
+    get_llm_cache().report()
+    report_company_industry_cache()
+    if micro_batching:
+        report_micro_batching()
 
 
 # ----------------- Embedding data and populating databases ----------------- #
@@ -612,8 +1034,14 @@ def job_rag_pipeline(driver):
             job_reference = record["job_reference"]
             print(f"Processing job {job_reference}...")
             
+            # A near-duplicate job reuses the embedding of the job it was copied from
+            embedding = get_canonical_embedding(job_reference)
+            if embedding is not None:
+                print(f"Reusing the embedding of the canonical job of {job_reference}.")
+
             ''' LMStudio Embeddings'''
-            embedding = create_lmstudio_embeddings_data_with_retries(record, lmstudio_embedding_model)
+            if embedding is None:
+                embedding = create_lmstudio_embeddings_data_with_retries(record, lmstudio_embedding_model)
 
             ''' Ollama Embeddings '''
             # embedding = create_ollama_embeddings_data_with_retries(record, "bge-m3:latest")
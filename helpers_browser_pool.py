@@ -0,0 +1,125 @@
+import os, queue, threading, atexit
+from contextlib import contextmanager
+from selenium import webdriver
+from selenium.common.exceptions import WebDriverException
+from selenium.webdriver.chrome.options import Options
+
+#  -----------------     Variables    ----------------- #
+# How many browsers can be open at the same time, and after how many pages a browser is replaced with a fresh one.
+browser_pool_size = int(os.getenv("BROWSER_POOL_SIZE", 3))
+browser_pages_before_recycle = int(os.getenv("BROWSER_PAGES_BEFORE_RECYCLE", 50))
+browser_headless = os.getenv("BROWSER_HEADLESS", "true").lower() == "true"
+
+
+# --------------------------------------------------------------------------
+# A bounded pool of long-lived headless Chrome (WebDriver) instances.
+# Starting Chrome is most of the cost of scraping one page, so the browsers are kept open and reused,
+# checked before every use and recycled after `pages_before_recycle` pages (to release the memory Chrome keeps growing).
+# Usage:
+#     with BrowserPool(size=3) as pool:
+#         with pool.browser() as driver:
+#             driver.get(url)
+class BrowserPool:
+    def __init__(self, size=browser_pool_size, pages_before_recycle=browser_pages_before_recycle, headless=browser_headless):
+        self.size = size
+        self.pages_before_recycle = pages_before_recycle
+        self.headless = headless
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+        self._pages = {}
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    # Borrow a browser from the pool. Blocks while all browsers are in use.
+    @contextmanager
+    def browser(self):
+        if self._closed:
+            raise RuntimeError("The browser pool is closed.")
+        self._slots.acquire()
+        driver = None
+        try:
+            driver = self._checkout()
+            yield driver
+        except WebDriverException:
+            # The browser may be broken (crashed tab, lost session), so it is not given back to the pool.
+            self._discard(driver)
+            driver = None
+            raise
+        finally:
+            if driver is not None:
+                self._checkin(driver)
+            self._slots.release()
+
+    # Quit all the idle browsers. Browsers still in use are quit when they are returned.
+    def close(self):
+        self._closed = True
+        while True:
+            try:
+                self._discard(self._idle.get_nowait())
+            except queue.Empty:
+                break
+
+    def _new_driver(self):
+        options = Options()
+        if self.headless:
+            options.add_argument("--headless")
+        driver = webdriver.Chrome(options=options)
+        with self._lock:
+            self._pages[id(driver)] = 0
+        return driver
+
+    # Take an idle browser that still responds, or start a new one.
+    def _checkout(self):
+        while True:
+            try:
+                driver = self._idle.get_nowait()
+            except queue.Empty:
+                return self._new_driver()
+            if self._is_healthy(driver):
+                return driver
+            self._discard(driver)
+
+    def _checkin(self, driver):
+        with self._lock:
+            self._pages[id(driver)] = self._pages.get(id(driver), 0) + 1
+            pages = self._pages[id(driver)]
+        if self._closed or pages >= self.pages_before_recycle:
+            self._discard(driver)
+        else:
+            self._idle.put(driver)
+
+    def _discard(self, driver):
+        if driver is None:
+            return
+        with self._lock:
+            self._pages.pop(id(driver), None)
+        try:
+            driver.quit()
+        except Exception:
+            pass
+
+    @staticmethod
+    def _is_healthy(driver):
+        try:
+            return driver.execute_script("return 1;") == 1
+        except Exception:
+            return False
+
+
+# A shared pool for the scrapers, created on first use and closed when the program exits.
+_shared_pool = None
+_shared_pool_lock = threading.Lock()
+
+def get_browser_pool():
+    global _shared_pool
+    with _shared_pool_lock:
+        if _shared_pool is None or _shared_pool._closed:
+            _shared_pool = BrowserPool()
+            atexit.register(_shared_pool.close)
+        return _shared_pool
@@ -0,0 +1,130 @@
+import os, json, time
+
+# The last line of a finished checkpoint file, so a reader following the file knows the writer is done
+checkpoint_done_marker = {"_checkpoint": "done"}
+checkpoint_done_line = (json.dumps(checkpoint_done_marker) + "\n").encode('utf-8')
+# The same line in a file written in text mode on Windows (before the files were written with "\n" line endings)
+checkpoint_done_line_crlf = (json.dumps(checkpoint_done_marker) + "\r\n").encode('utf-8')
+
+
+# --------------------------------------------------------------------------
+# Append-only JSONL checkpoint: one JSON object per line, written as soon as a record is ready.
+# Lines are flushed every `flush_every` records (visible to readers of the file) and fsync'ed every `fsync_every`
+# records (safe on disk), so the cost per record stays constant instead of rewriting the whole file.
+# The end marker is written only when the run finishes without an error. A resumed run removes the end marker of the previous run
+# and a partly written last line (e.g. after a hard kill), so its records follow the previous ones.
+class JsonlCheckpointWriter:
+    def __init__(self, path, flush_every=1, fsync_every=20):
+        self.path = path
+        self.flush_every = flush_every
+        self.fsync_every = fsync_every
+        self._pending_flush = 0
+        self._pending_fsync = 0
+        _prepare_for_append(path)
+        # "\n" line endings on every OS, so the end of the file can be checked byte by byte (see `_prepare_for_append`)
+        self._file = open(path, 'a', encoding='utf-8', newline='\n')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close(done=exc_type is None)
+
+    def write(self, record):
+        self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._pending_flush += 1
+        self._pending_fsync += 1
+        if self._pending_flush >= self.flush_every:
+            self._file.flush()
+            self._pending_flush = 0
+        if self._pending_fsync >= self.fsync_every:
+            os.fsync(self._file.fileno())
+            self._pending_fsync = 0
+
+    # Write the end marker (only if the run is `done`) and make sure everything is on disk
+    def close(self, done=True):
+        if self._file.closed:
+            return
+        if done:
+            self._file.write(json.dumps(checkpoint_done_marker) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+
+
+# Cut the end of an existing checkpoint file before a new run appends to it: a partly written last line and the end markers after the last record
+def _prepare_for_append(path):
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return
+    with open(path, 'r+b') as f:
+        content = f.read()
+        end = len(content)
+        if not content.endswith(b"\n"):
+            end = content.rfind(b"\n") + 1
+        while True:
+            done_line = next((line for line in (checkpoint_done_line, checkpoint_done_line_crlf) if content[:end].endswith(line)), None)
+            if done_line is None:
+                break
+            end -= len(done_line)
+        if end < len(content):
+            f.truncate(end)
+
+
+# --------------------------------------------------------------------------
+# Read all the records of a checkpoint file (end markers and a partly written last line are skipped)
+def read_jsonl(path):
+    records = []
+    if not os.path.exists(path):
+        return records
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            record = _parse_line(line)
+            if record is not None:
+                records.append(record)
+    return records
+
+
+# Follow a checkpoint file while it is being written (like `tail -f`) and yield each record.
+# Stops at the end marker of the writer at the end of the file (a marker followed by more lines is from an earlier run that was resumed),
+# or after `idle_timeout` seconds without new lines (e.g. the writer crashed).
+def follow_jsonl(path, poll_interval=0.5, idle_timeout=600):
+    # Wait for the writer to create the file
+    waited = 0
+    while not os.path.exists(path):
+        if waited >= idle_timeout:
+            return
+        time.sleep(poll_interval)
+        waited += poll_interval
+
+    with open(path, 'r', encoding='utf-8') as f:
+        buffer, waited = '', 0
+        while True:
+            line = f.readline()
+            if not line:
+                if waited >= idle_timeout:
+                    return
+                time.sleep(poll_interval)
+                waited += poll_interval
+                continue
+            # A line is complete only when its newline has been written
+            buffer += line
+            if not buffer.endswith("\n"):
+                continue
+            line, buffer, waited = buffer, '', 0
+            if line.strip() == json.dumps(checkpoint_done_marker):
+                if f.tell() >= os.fstat(f.fileno()).st_size:
+                    return
+                continue
+            record = _parse_line(line)
+            if record is not None:
+                yield record
+
+
+def _parse_line(line):
+    try:
+        record = json.loads(line)
+    except ValueError:
+        return None
+    if record == checkpoint_done_marker:
+        return None
+    return record
@@ -0,0 +1,81 @@
+import os, threading
+from collections import Counter
+from helpers_sqldb import get_company_industry, save_company_industry
+from helpers_taxonomy import get_taxonomy
+
+#  -----------------     Variables    ----------------- #
+# The industry of a job is the industry of its company, so the NACE classification of a company is kept in the
+# `company_industry_cache` table and reused for the next postings of the company (no summary and NACE calls to the LLM).
+# A classification is reused only if at least `company_industry_min_agreements` classifications of the company agree on the NACE division
+# and its confidence is at least `company_industry_min_confidence`, otherwise the company is classified again and the results are combined.
+# A company whose classifications disagreed `company_industry_max_disagreements` times (e.g. a recruitment agency or an anonymous
+# poster like "Confidential", with jobs of many industries) is never reused.
+company_industry_cache_enabled = os.getenv("COMPANY_INDUSTRY_CACHE", "true").lower() == "true"
+company_industry_min_confidence = float(os.getenv("COMPANY_INDUSTRY_MIN_CONFIDENCE", 0.6))
+company_industry_min_agreements = int(os.getenv("COMPANY_INDUSTRY_MIN_AGREEMENTS", 2))
+company_industry_max_disagreements = int(os.getenv("COMPANY_INDUSTRY_MAX_DISAGREEMENTS", 2))
+# The confidence of a classification is 1 for a valid answer at the first call, less for each call the LLM needed and for a snapped answer
+retry_confidence_penalty = 0.25
+snap_confidence_penalty = 0.15
+
+_company_industry_stats = Counter()
+_company_industry_stats_lock = threading.Lock()
+
+
+# The key of a company in the cache: lower case with single spaces ("ACME  Ltd" and "acme ltd" are the same company)
+def company_key(company_name):
+    return " ".join(str(company_name or "").lower().split()) or None
+
+
+def classification_confidence(attempt, snapped=False):
+    return max(0.1, 1.0 - retry_confidence_penalty * attempt - (snap_confidence_penalty if snapped else 0.0))
+
+
+def _count(event):
+    with _company_industry_stats_lock:
+        _company_industry_stats[event] += 1
+
+
+# The cached industry of a company ({"industry": {"industry_name", "NACE_standardized_name"}}, like the NACE stages of the extraction),
+# or None if the company has to be classified. A manual override is always used, and an override without a NACE title
+# (e.g. for a recruitment agency that posts jobs of many industries) means that the company is never cached.
+def cached_company_industry(company_name):
+    key = company_key(company_name)
+    if not company_industry_cache_enabled or key is None:
+        return None
+    row = get_company_industry(key)
+    usable = (row is not None and get_taxonomy().is_nace_division(row["nace_standardized_name"])
+              and (row["manual_override"] or (row["confidence"] >= company_industry_min_confidence and row["agreements"] >= company_industry_min_agreements
+                                              and row["disagreements"] < company_industry_max_disagreements)))
+    _count("hits" if usable else "misses")
+    if not usable:
+        return None
+    return {"industry": {"industry_name": row["industry_name"], "NACE_standardized_name": row["nace_standardized_name"]}}
+
+
+# Save the industry classified for a company. If the cache already has the same NACE division, the two confidences are combined
+# (two independent classifications that agree), otherwise the new classification replaces the old one and the disagreement is counted.
+# Manual overrides are not changed.
+def record_company_industry(company_name, industry, confidence, job_reference):
+    key = company_key(company_name)
+    taxonomy = get_taxonomy()
+    if not company_industry_cache_enabled or key is None or not isinstance(industry, dict) or not taxonomy.is_nace_division(industry.get("NACE_standardized_name")):
+        return
+    row = get_company_industry(key)
+    if row is not None and row["manual_override"]:
+        return
+    agreements, disagreements = 1, 0
+    if row is not None and row["nace_standardized_name"] == industry["NACE_standardized_name"]:
+        confidence = 1 - (1 - row["confidence"]) * (1 - confidence)
+        agreements, disagreements = row["agreements"] + 1, row["disagreements"]
+    elif row is not None:
+        disagreements = row["disagreements"] + 1
+    save_company_industry(key, company_name, industry.get("industry_name"), industry["NACE_standardized_name"],
+                          taxonomy.nace_code(industry["NACE_standardized_name"]), confidence, agreements, disagreements, job_reference)
+
+
+def report_company_industry_cache():
+    with _company_industry_stats_lock:
+        hits, misses = _company_industry_stats["hits"], _company_industry_stats["misses"]
+    total = hits + misses
+    print(f"Company industry cache --> hits: {hits}, misses: {misses}, hit rate: {hits / total if total else 0.0:.0%}")
@@ -0,0 +1,175 @@
+import os, re, json, hashlib, threading
+from collections import Counter
+from helpers_near_duplicates import normalize_description
+from helpers_sqldb import ensure_description_normalization_schema, get_job_descriptions_for_normalization, save_clean_job_descriptions
+from helpers_company_industry import company_key
+
+#  -----------------     Variables    ----------------- #
+# The boilerplate lines are learned per company (or agency): a line (of at least `boilerplate_min_words` words) is boilerplate for a company
+# if it is found in at least `boilerplate_min_company_jobs` of its descriptions and in at least `boilerplate_min_company_share` of them
+# (e.g. the footer, contact block and GDPR notice that a company repeats in every job post). A line is boilerplate for every company
+# only if it is found in at least `boilerplate_min_jobs` descriptions and in at least `boilerplate_min_share` of all of them.
+# The learned lines are removed only from the footer of a description (the lines at its end), so the requirements that many jobs
+# share (e.g. "Very good knowledge of English") stay in the text of the prompts.
+boilerplate_min_company_jobs = int(os.getenv("BOILERPLATE_MIN_COMPANY_JOBS", 3))
+boilerplate_min_company_share = float(os.getenv("BOILERPLATE_MIN_COMPANY_SHARE", 0.5))
+boilerplate_min_jobs = int(os.getenv("BOILERPLATE_MIN_JOBS", 50))
+boilerplate_min_share = float(os.getenv("BOILERPLATE_MIN_SHARE", 0.05))
+boilerplate_min_words = 3
+boilerplate_path = os.getenv("BOILERPLATE_PATH", os.path.join("data", "cache", "description_boilerplate.json"))
+
+# The text that a LLM adds before its answer (e.g. "Here is the translation:"), at the start of a description
+llm_preamble_pattern = re.compile(r"^\s*(?:(?:sure|certainly|of course)\b[^\n]{0,40}?[,!.]\s*)?(?:(?:here\s+is|here's|below\s+is)\b[^\n]{0,100}?(?:translat|text|description)[^\n]{0,60}?:|translation:)[ \t]*\n?", re.IGNORECASE)
+# Lines that are always boilerplate (anywhere in the description), even if they are not frequent: only a contact (e-mail, URL or phone number), or a data protection
+# notice about the applications (a line with a privacy term and an application term, so a GDPR responsibility of the job is kept)
+contact_line_pattern = re.compile(r"[\s\W]*(?:(?:e-?mail|tel|phone|mobile|fax|website|web)\s*[:.]?\s*)?(?:\S+@\S+\.\w+|https?://\S+|www\.\S+|\+?\d[\d\s\-/().]{7,}\d)[\s\W]*", re.IGNORECASE)
+privacy_line_pattern = re.compile(r"\b(?:gdpr|general data protection regulation|data protection (?:law|legislation|regulation|policy)|privacy (?:policy|notice|statement)|personal data|(?:treated|handled|kept) (?:with )?(?:strict(?:est)? )?confidential\w*)\b", re.IGNORECASE)
+application_line_pattern = re.compile(r"\b(?:cvs?|curriculum vitae|resumes?|applications?|applicants?|candidates?)\b", re.IGNORECASE)
+
+
+# A rough token count of a text (words and punctuation marks)
+def count_tokens(text):
+    return len(re.findall(r"\w+|[^\w\s]", text or ""))
+
+
+# Remove the text that a LLM added before the description (e.g. "Here is the translation:")
+def strip_llm_preamble(text):
+    return llm_preamble_pattern.sub("", text or "", count=1)
+
+
+# The key of a line for the boilerplate set (see `normalize_description`), or None for a line too short to be boilerplate
+def boilerplate_key(line):
+    key = normalize_description(line)
+    return key if len(key.split()) >= boilerplate_min_words else None
+
+
+# The hash of a description, to find the descriptions that changed since they were normalized
+def description_hash(text):
+    return hashlib.sha256((text or "").encode('utf-8')).hexdigest()
+
+
+# Learn the boilerplate from the descriptions of the jobs ([(company name, description)]). Each line is counted once per description,
+# and the reposts of the same description by a company are counted once (otherwise every line of a reposted job would be boilerplate).
+# Returns {"lines": keys of the lines of every company, "companies": {company key: keys of the lines of the company}}
+def learn_boilerplate_lines(jobs):
+    line_counts, company_line_counts, company_jobs = Counter(), {}, Counter()
+    seen_descriptions = set()
+    for company_name, description in jobs:
+        keys = {key for key in (boilerplate_key(line) for line in (description or "").splitlines()) if key}
+        line_counts.update(keys)
+        company = company_key(company_name)
+        if company is not None and (company, normalize_description(description)) not in seen_descriptions:
+            seen_descriptions.add((company, normalize_description(description)))
+            company_jobs[company] += 1
+            company_line_counts.setdefault(company, Counter()).update(keys)
+
+    min_jobs = max(boilerplate_min_jobs, boilerplate_min_share * len(jobs))
+    companies = {}
+    for company, counts in company_line_counts.items():
+        min_company_jobs = max(boilerplate_min_company_jobs, boilerplate_min_company_share * company_jobs[company])
+        lines = {key for key, count in counts.items() if count >= min_company_jobs}
+        if lines:
+            companies[company] = lines
+    return {"lines": {key for key, count in line_counts.items() if count >= min_jobs}, "companies": companies}
+
+
+# The keys of the boilerplate lines of a company (its own lines and the lines of every company)
+def company_boilerplate_lines(boilerplate, company_name):
+    return boilerplate["lines"] | boilerplate["companies"].get(company_key(company_name), set())
+
+
+def is_contact_or_privacy_line(line):
+    return bool(contact_line_pattern.fullmatch(line) or (privacy_line_pattern.search(line) and application_line_pattern.search(line)))
+
+
+def is_boilerplate_line(line, boilerplate_lines):
+    if is_contact_or_privacy_line(line):
+        return True
+    key = boilerplate_key(line)
+    return key is not None and key in boilerplate_lines
+
+
+# The description without the LLM preamble and the boilerplate, with single spaces and at most one empty line between paragraphs.
+# The contact and data protection lines are removed everywhere, the learned lines (`boilerplate_lines`) only from the footer.
+# A description that is only learned lines keeps them. If nothing is left, the description with the whitespace collapsed is returned.
+def normalize_job_description(text, boilerplate_lines):
+    lines = [re.sub(r"[^\S\n]+", " ", line).strip() for line in strip_llm_preamble(text).splitlines()]
+    kept = [line for line in lines if not line or not is_contact_or_privacy_line(line)]
+    footer_start = len(kept)
+    while footer_start > 0 and (not kept[footer_start - 1] or is_boilerplate_line(kept[footer_start - 1], boilerplate_lines)):
+        footer_start -= 1
+    if footer_start > 0:
+        kept = kept[:footer_start]
+    clean = re.sub(r"\n{3,}", "\n\n", "\n".join(kept)).strip()
+    return clean or re.sub(r"\s+", " ", text or "").strip()
+
+
+# The learned boilerplate ({"lines", "companies"}, see `learn_boilerplate_lines`), saved by the last `normalize_job_descriptions`
+_boilerplate = None
+_boilerplate_lock = threading.Lock()
+
+def get_boilerplate():
+    global _boilerplate
+    with _boilerplate_lock:
+        if _boilerplate is None:
+            _boilerplate = {"lines": set(), "companies": {}}
+            if os.path.exists(boilerplate_path):
+                with open(boilerplate_path, 'r', encoding='utf-8') as f:
+                    stored = json.load(f)
+                _boilerplate = {"lines": set(stored["lines"]), "companies": {company: set(lines) for company, lines in stored.get("companies", {}).items()}}
+        return _boilerplate
+
+
+def save_boilerplate(boilerplate):
+    global _boilerplate
+    os.makedirs(os.path.dirname(boilerplate_path) or '.', exist_ok=True)
+    tmp_path = f"{boilerplate_path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({"lines": sorted(boilerplate["lines"]), "companies": {company: sorted(lines) for company, lines in sorted(boilerplate["companies"].items())}},
+                  f, ensure_ascii=False, indent=1)
+    os.replace(tmp_path, boilerplate_path)
+    with _boilerplate_lock:
+        _boilerplate = boilerplate
+
+
+# The normalization stage: learn the boilerplate from all the descriptions in the DB and save the clean description
+# (`job_description_clean`), the hash of the description and the token counts of the raw and the clean description of the jobs.
+# Only the new (or changed) descriptions are normalized, and the descriptions of the companies whose learned boilerplate changed
+# (all of them if the boilerplate of every company changed, so they use the same set).
+def normalize_job_descriptions():
+    ensure_description_normalization_schema()
+    rows = get_job_descriptions_for_normalization()
+    if not rows:
+        print("No job descriptions to normalize.")
+        return
+
+    boilerplate = learn_boilerplate_lines([(company_name, job_description) for _, company_name, job_description, _ in rows])
+    previous_boilerplate = get_boilerplate()
+    lines_changed = boilerplate["lines"] != previous_boilerplate["lines"]
+    if lines_changed or boilerplate["companies"] != previous_boilerplate["companies"]:
+        save_boilerplate(boilerplate)
+
+    cleaned = []
+    for reference, company_name, job_description, job_description_hash in rows:
+        company = company_key(company_name)
+        boilerplate_changed = lines_changed or boilerplate["companies"].get(company) != previous_boilerplate["companies"].get(company)
+        text_hash = description_hash(job_description)
+        if job_description_hash == text_hash and not boilerplate_changed:
+            continue
+        clean = normalize_job_description(job_description, company_boilerplate_lines(boilerplate, company_name))
+        cleaned.append((reference, clean, text_hash, count_tokens(job_description), count_tokens(clean)))
+    if cleaned:
+        save_clean_job_descriptions(cleaned)
+
+    raw_tokens = sum(row[3] for row in cleaned)
+    clean_tokens = sum(row[4] for row in cleaned)
+    print(f"~~ Normalized {len(cleaned)} job descriptions ({len(boilerplate['lines'])} boilerplate lines of every company and "
+          f"{sum(len(lines) for lines in boilerplate['companies'].values())} of {len(boilerplate['companies'])} companies learned): "
+          f"{raw_tokens} --> {clean_tokens} tokens ({1 - clean_tokens / raw_tokens if raw_tokens else 0:.0%} less).")
+
+
+# The job as text for the prompts: the title and the clean description (normalized now, if the stage did not run for this job)
+def format_job_for_prompt(db_job_data):
+    description = db_job_data.get("job_description_clean") or normalize_job_description(
+        db_job_data.get("job_description"), company_boilerplate_lines(get_boilerplate(), db_job_data.get("company_name")))
+    return f"Job title: {db_job_data.get('job_title')}\nJob description:\n{description}"
@@ -0,0 +1,84 @@
+import os, json, datetime, hashlib
+from helpers_sqldb import get_ref_ids_created_since
+
+#  -----------------     Variables    ----------------- #
+# Local snapshot of the references already in the `job_listings` table, so a run only pulls the rows added since the last one.
+known_refs_snapshot_path = os.getenv("KNOWN_REFS_SNAPSHOT", "data/cache/known_references.json")
+
+
+# --------------------------------------------------------------------------
+# An in-memory index (hash set) of the job references that are already stored in PostgreSQL.
+# It is loaded once per run and refreshed incrementally by `created_date` (high-water mark), so checking a scraped card is O(1)
+# and a scrape costs at most one database round trip.
+class KnownReferenceIndex:
+    def __init__(self, snapshot_path=known_refs_snapshot_path):
+        self.snapshot_path = snapshot_path
+        self.references = set()
+        self.high_water_mark = None
+
+    def __contains__(self, reference):
+        return reference in self.references
+
+    def __len__(self):
+        return len(self.references)
+
+    # Add a reference found during the run (e.g. a new job), so duplicates within the same scrape are also skipped.
+    def add(self, reference):
+        self.references.add(reference)
+
+    # Load the local snapshot (if any) and then pull only the newer references from PostgreSQL.
+    @classmethod
+    def load(cls, snapshot_path=known_refs_snapshot_path):
+        index = cls(snapshot_path)
+        index._read_snapshot()
+        index.refresh()
+        return index
+
+    # Pull the references created after the high-water mark with one query and update the snapshot.
+    def refresh(self):
+        total_rows, checksum, rows = get_ref_ids_created_since(self.high_water_mark)
+        self._merge(rows)
+        # The index does not have the same references as the table (e.g. rows deleted by `delete_empty_job_listings`, even if
+        # new rows were added since), so the snapshot is stale and the index is rebuilt.
+        if len(self.references) != total_rows or self.checksum() != checksum:
+            self.references, self.high_water_mark = set(), None
+            total_rows, checksum, rows = get_ref_ids_created_since(None)
+            self._merge(rows)
+        self._write_snapshot()
+        return len(rows)
+
+    # The sum of the first 32 bits of the MD5 of each reference (the same as the checksum computed by `get_ref_ids_created_since`)
+    def checksum(self):
+        return sum(int(hashlib.md5(str(reference).encode('utf-8')).hexdigest()[:8], 16) for reference in self.references)
+
+    def _merge(self, rows):
+        for reference, created_date in rows:
+            self.references.add(reference)
+            if created_date is not None and (self.high_water_mark is None or created_date > self.high_water_mark):
+                self.high_water_mark = created_date
+
+    def _read_snapshot(self):
+        if not os.path.exists(self.snapshot_path):
+            return
+        try:
+            with open(self.snapshot_path, 'r', encoding='utf-8') as f:
+                snapshot = json.load(f)
+            self.references = set(snapshot.get("references", []))
+            high_water_mark = snapshot.get("high_water_mark")
+            self.high_water_mark = datetime.datetime.fromisoformat(high_water_mark) if high_water_mark else None
+        except (OSError, ValueError) as e:
+            # A broken snapshot is not fatal, the index is rebuilt from the database.
+            print(f"Could not read the known references snapshot ({e}). Rebuilding from the database.")
+            self.references, self.high_water_mark = set(), None
+
+    def _write_snapshot(self):
+        os.makedirs(os.path.dirname(self.snapshot_path) or '.', exist_ok=True)
+        snapshot = {
+            "high_water_mark": self.high_water_mark.isoformat() if self.high_water_mark else None,
+            "references": sorted(self.references),
+        }
+        # Write to a temporary file first, so a crash never leaves a half-written snapshot behind.
+        tmp_path = f"{self.snapshot_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(snapshot, f, ensure_ascii=False)
+        os.replace(tmp_path, self.snapshot_path)
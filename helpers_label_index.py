@@ -0,0 +1,99 @@
+import os, json, math, hashlib, threading, requests
+from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+
+load_dotenv(override=True)
+
+#  -----------------     Variables    ----------------- #
+# The embedding endpoint (Ollama `/api/embed`) and model used for the taxonomy labels and the job summaries
+ollama_embed_url = os.getenv("OLLAMA_EMBEDD_URL")
+label_embedding_model = os.getenv("LABEL_EMBEDDING_MODEL", "bge-m3")
+# Where the label vectors are kept, and how many labels are embedded per request
+label_index_dir = os.getenv("LABEL_INDEX_DIR", "data/cache")
+label_embedding_batch_size = int(os.getenv("LABEL_EMBEDDING_BATCH_SIZE", 64))
+
+embedding_session = requests.Session()
+embedding_session.mount("http://", HTTPAdapter(pool_connections=2, pool_maxsize=16))
+embedding_session.mount("https://", HTTPAdapter(pool_connections=2, pool_maxsize=16))
+
+
+# Embed a list of texts with the Ollama endpoint. Returns one vector per text.
+def embed_texts(texts, model=label_embedding_model):
+    response = embedding_session.post(ollama_embed_url, json={"input": texts, "model": model}, timeout=120)
+    response.raise_for_status()
+    return response.json()['embeddings']
+
+
+def normalize_vector(vector):
+    norm = math.sqrt(sum(value * value for value in vector)) or 1.0
+    return [value / norm for value in vector]
+
+
+# --------------------------------------------------------------------------
+# A small local vector index of the labels of a taxonomy (ISCO titles, NACE sections or divisions).
+# The labels are embedded once and saved in `<label_index_dir>/label_index_<name>.json`, together with a hash of the labels
+# and the model, so the file is rebuilt only when the list or the model changes.
+# `top_k` embeds a text (e.g. a job summary) and returns the nearest labels, so only a shortlist goes into the prompts.
+# If the embedding endpoint is not available, `top_k` returns all the labels (the prompts fall back to the full list).
+class LabelIndex:
+    def __init__(self, name, labels, model=label_embedding_model, directory=label_index_dir):
+        self.name = name
+        self.labels = list(labels)
+        self.model = model
+        self.path = os.path.join(directory, f"label_index_{name}.json")
+        self.labels_hash = hashlib.sha256("\x1f".join([model] + self.labels).encode('utf-8')).hexdigest()
+        self.vectors = None
+        self._lock = threading.Lock()
+
+    # The `k` labels nearest to the text (in order of similarity). `within` limits the candidates to a subset of the labels.
+    def top_k(self, text, k, within=None):
+        candidates = [label for label in self.labels if within is None or label in within]
+        if k >= len(candidates):
+            return candidates
+        try:
+            self._ensure_vectors()
+            query = normalize_vector(embed_texts([str(text)], self.model)[0])
+        except (requests.RequestException, KeyError, IndexError, ValueError) as e:
+            print(f"Label index {self.name}: embeddings are not available ({e}). Using the full list of {len(candidates)} labels.")
+            return candidates
+        scores = {label: sum(a * b for a, b in zip(query, self.vectors[label])) for label in candidates}
+        return sorted(candidates, key=scores.get, reverse=True)[:k]
+
+    def _ensure_vectors(self):
+        with self._lock:
+            if self.vectors is not None:
+                return
+            if os.path.exists(self.path):
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    stored = json.load(f)
+                if stored.get("labels_hash") == self.labels_hash:
+                    self.vectors = stored["vectors"]
+                    return
+            print(f"Label index {self.name}: embedding {len(self.labels)} labels with {self.model}...")
+            vectors = {}
+            for start in range(0, len(self.labels), label_embedding_batch_size):
+                batch = self.labels[start:start + label_embedding_batch_size]
+                for label, vector in zip(batch, embed_texts(batch, self.model)):
+                    vectors[label] = normalize_vector(vector)
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({"model": self.model, "labels_hash": self.labels_hash, "vectors": vectors}, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+            self.vectors = vectors
+
+
+# The shared index of a taxonomy, created on first use. There is one index (and one file) per name, so the chain and the one-shot
+# extraction use the same name for the same list (e.g. "ISCO"). A name asked with other labels gets a new index instead of a wrong shortlist.
+_label_indexes = {}
+_label_indexes_lock = threading.Lock()
+
+def get_label_index(name, labels):
+    labels = list(labels)
+    with _label_indexes_lock:
+        index = _label_indexes.get(name)
+        if index is None or index.labels != labels:
+            if index is not None:
+                print(f"Label index {name}: asked with other labels. Rebuilding the index.")
+            _label_indexes[name] = LabelIndex(name, labels)
+        return _label_indexes[name]
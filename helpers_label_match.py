@@ -0,0 +1,89 @@
+import os, re, threading, unicodedata
+
+#  -----------------     Variables    ----------------- #
+# The minimum score (0 to 1) to snap an answer of the LLM to a label. Below it the answer is rejected (and the LLM is asked again).
+label_snap_threshold = float(os.getenv("LABEL_SNAP_THRESHOLD", 0.8))
+# A truncated answer (a prefix of a single label) of at least this many characters is snapped with the `truncation_score`
+min_truncation_length = 12
+truncation_score = 0.9
+
+
+# Lower case, no accents, "&" as "and", singular words (a final "s" is dropped) and only letters and digits separated by single spaces
+def normalize_label(text):
+    text = unicodedata.normalize("NFKD", str(text)).encode('ascii', 'ignore').decode('ascii').lower()
+    text = text.replace("&", " and ")
+    words = re.sub(r"[^a-z0-9]+", " ", text).split()
+    return " ".join(word[:-1] if len(word) > 3 and word.endswith("s") else word for word in words)
+
+
+def trigrams(normalized_text):
+    padded = f"  {normalized_text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+# --------------------------------------------------------------------------
+# A fuzzy-match index over the labels of a taxonomy (ISCO titles, NACE sections or divisions), built once.
+# `match` scores an answer of the LLM against the labels with the Dice coefficient of their character trigrams (after
+# `normalize_label`), so case, punctuation, accents, small typos and truncated answers map to the canonical label locally,
+# without a new LLM call. Only the labels that share a trigram with the answer are scored.
+class LabelMatcher:
+    def __init__(self, labels):
+        self.labels = list(dict.fromkeys(labels))
+        self._normalized = {label: normalize_label(label) for label in self.labels}
+        self._exact = {}
+        for label, normalized in self._normalized.items():
+            self._exact.setdefault(normalized, label)
+        self._trigrams = {label: trigrams(normalized) for label, normalized in self._normalized.items()}
+        self._postings = {}
+        for label, label_trigrams in self._trigrams.items():
+            for trigram in label_trigrams:
+                self._postings.setdefault(trigram, []).append(label)
+
+    # The best label for an answer and its score (0 to 1). `within` limits the candidates to a subset of the labels.
+    def match(self, answer, within=None):
+        normalized = normalize_label(answer)
+        if not normalized:
+            return None, 0.0
+        exact = self._exact.get(normalized)
+        if exact is not None and (within is None or exact in within):
+            return exact, 1.0
+
+        answer_trigrams = trigrams(normalized)
+        shared = {}
+        for trigram in answer_trigrams:
+            for label in self._postings.get(trigram, ()):
+                shared[label] = shared.get(label, 0) + 1
+
+        best_label, best_score = None, 0.0
+        for label, count in shared.items():
+            if within is not None and label not in within:
+                continue
+            score = 2 * count / (len(answer_trigrams) + len(self._trigrams[label]))
+            if score > best_score:
+                best_label, best_score = label, score
+
+        # A truncated answer: the beginning of exactly one label
+        if len(normalized) >= min_truncation_length and best_score < truncation_score:
+            prefixed = [label for label, label_normalized in self._normalized.items()
+                        if label_normalized.startswith(normalized) and (within is None or label in within)]
+            if len(prefixed) == 1:
+                best_label, best_score = prefixed[0], truncation_score
+        return best_label, best_score
+
+    # The canonical label for an answer, or None if the best match is below the threshold
+    def snap(self, answer, within=None, threshold=None):
+        label, score = self.match(answer, within)
+        if label is None or score < (label_snap_threshold if threshold is None else threshold):
+            return None
+        return label
+
+
+# The shared matcher of a taxonomy, built on first use.
+_label_matchers = {}
+_label_matchers_lock = threading.Lock()
+
+def get_label_matcher(name, labels):
+    with _label_matchers_lock:
+        if name not in _label_matchers:
+            _label_matchers[name] = LabelMatcher(labels)
+        return _label_matchers[name]
@@ -0,0 +1,112 @@
+import os, json, time, sqlite3, hashlib, threading
+
+#  -----------------     Variables    ----------------- #
+# The on-disk cache of the LLM responses and its maximum size (the least recently used responses are evicted first)
+llm_cache_path = os.getenv("LLM_CACHE_PATH", "data/cache/llm_cache.sqlite3")
+llm_cache_max_mb = float(os.getenv("LLM_CACHE_MAX_MB", 500))
+# "use" (read and write the cache), "refresh" (do not read, overwrite with the new responses) or "bypass" (do not read or write)
+llm_cache_mode = os.getenv("LLM_CACHE_MODE", "use")
+
+
+# --------------------------------------------------------------------------
+# A persistent cache of the LLM responses, keyed by the provider and a hash of the whole request body (model, system and
+# user prompts, temperature, max tokens, JSON mode...). Only deterministic requests (temperature 0) are cached, so
+# re-running the extraction on unchanged jobs (e.g. after a crash or a reset of the Graph DB) costs no inference.
+# When the cache grows over `max_mb`, the least recently used responses are deleted down to 90% of it.
+class LLMResponseCache:
+    def __init__(self, path=llm_cache_path, max_mb=llm_cache_max_mb, mode=llm_cache_mode):
+        if mode not in ("use", "refresh", "bypass"):
+            raise ValueError(f"Unknown LLM cache mode {mode} (use, refresh or bypass)")
+        self.mode = mode
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS llm_cache (
+                key TEXT PRIMARY KEY,
+                provider TEXT NOT NULL,
+                model TEXT,
+                response TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                last_used REAL NOT NULL
+            )
+        """)
+        self._db.execute("CREATE INDEX IF NOT EXISTS llm_cache_last_used ON llm_cache (last_used)")
+        self._db.commit()
+        self._total_bytes = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM llm_cache").fetchone()[0]
+
+    @staticmethod
+    def key(provider, payload):
+        return hashlib.sha256(json.dumps({"provider": provider, "payload": payload}, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def is_cacheable(payload):
+        temperature = payload.get("temperature", payload.get("options", {}).get("temperature"))
+        return temperature == 0
+
+    # The cached response, or None
+    def get(self, key):
+        if self.mode != "use":
+            return None
+        with self._lock:
+            row = self._db.execute("SELECT response FROM llm_cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._db.execute("UPDATE llm_cache SET last_used = ? WHERE key = ?", (time.time(), key))
+            self._db.commit()
+            return row[0]
+
+    def put(self, key, provider, model, response):
+        if self.mode == "bypass":
+            return
+        size = len(key) + len(response.encode('utf-8'))
+        now = time.time()
+        with self._lock:
+            previous = self._db.execute("SELECT size FROM llm_cache WHERE key = ?", (key,)).fetchone()
+            self._db.execute("""
+                INSERT OR REPLACE INTO llm_cache (key, provider, model, response, size, created_at, last_used)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, (key, provider, model, response, size, now, now))
+            self._total_bytes += size - (previous[0] if previous else 0)
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+            self._db.commit()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / total if total else 0.0, "size_mb": self._total_bytes / 1024 / 1024}
+
+    def report(self):
+        stats = self.stats()
+        print(f"LLM response cache ({self.mode}) --> hits: {stats['hits']}, misses: {stats['misses']}, hit rate: {stats['hit_rate']:.0%}, size: {stats['size_mb']:.1f} MB")
+        return stats
+
+    # Delete the least recently used responses down to 90% of the maximum size
+    def _evict(self):
+        target = self.max_bytes * 0.9
+        to_delete = []
+        for key, size in self._db.execute("SELECT key, size FROM llm_cache ORDER BY last_used"):
+            if self._total_bytes <= target:
+                break
+            to_delete.append((key,))
+            self._total_bytes -= size
+        self._db.executemany("DELETE FROM llm_cache WHERE key = ?", to_delete)
+
+
+# The shared cache of the LLM clients, opened on first use.
+_shared_cache = None
+_shared_cache_lock = threading.Lock()
+
+def get_llm_cache():
+    global _shared_cache
+    with _shared_cache_lock:
+        if _shared_cache is None:
+            _shared_cache = LLMResponseCache()
+        return _shared_cache
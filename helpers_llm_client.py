@@ -0,0 +1,254 @@
+import os, re, json, time, random, threading, contextlib, email.utils, requests
+from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+from helpers_rate_limit import TokenBucket
+from helpers_llm_cache import get_llm_cache
+
+load_dotenv(override=True)
+
+#  -----------------     Variables    ----------------- #
+# The LLM providers used by the project. `style` is the request/response format ("openai" compatible chat completions or "ollama").
+# `rpm` / `tpm` are the request and token budgets per minute (None = no limit, e.g. the local servers run at full speed).
+# `max_concurrency` is how many requests can be in flight at the same time (None = no limit), so the local servers get
+# as many parallel requests as they can serve and the rest wait in the client.
+# Every budget can be changed with the environment variables <PROVIDER>_RPM, <PROVIDER>_TPM and <PROVIDER>_MAX_CONCURRENCY (e.g. GROQ_TPM=6000).
+# `json_object` is False for the servers that reject `response_format: {"type": "json_object"}` (some LM Studio versions only accept
+# `json_schema`), so their JSON mode requests are sent without a `response_format` and only the prompt asks for JSON.
+llm_providers = {
+    "openrouter": {"url": os.getenv("OPENROUTER_COMPLETIONS_URL"), "api_key": os.getenv("OPENROUTER_API_KEY"), "style": "openai", "rpm": 20, "tpm": None, "max_concurrency": None, "json_object": True},
+    "groq": {"url": os.getenv("GROQ_COMPLETIONS_URL", "https://api.groq.com/openai/v1/chat/completions"), "api_key": os.getenv("GROQ_API_KEY"), "style": "openai", "rpm": 30, "tpm": None, "max_concurrency": None, "json_object": True},
+    "lmstudio": {"url": os.getenv("LM_STUDIO_COMPLETIONS_URL"), "api_key": None, "style": "openai", "rpm": None, "tpm": None, "max_concurrency": 4, "json_object": False},
+    "ollama": {"url": os.getenv("OLLAMA_CHAT_COMPLETIONS_URL"), "api_key": None, "style": "ollama", "rpm": None, "tpm": None, "max_concurrency": 4, "json_object": True},
+}
+
+# Retry settings: the HTTP status codes worth retrying, how many times, and the backoff (seconds) before the jitter.
+retry_status_codes = {408, 409, 425, 429, 500, 502, 503, 504}
+llm_max_retries = int(os.getenv("LLM_MAX_RETRIES", 6))
+llm_backoff_base = float(os.getenv("LLM_BACKOFF_BASE", 2))
+llm_backoff_max = float(os.getenv("LLM_BACKOFF_MAX", 120))
+llm_timeout = float(os.getenv("LLM_TIMEOUT", 600))
+
+
+class LLMRequestError(Exception):
+    pass
+
+
+# --------------------------------------------------------------------------
+# One client per LLM provider, shared by all the LLM calls of the project.
+# - A keep-alive session with a connection pool (no new connection for every call).
+# - Retries with exponential backoff and jitter for connection errors, timeouts, 429 and 5xx responses.
+# - Pacing from the provider: `retry-after` and the `x-ratelimit-*` headers pause the client until the reset time,
+#   and the configured RPM/TPM budgets are enforced with token buckets (instead of fixed sleeps before each call).
+# - A limit of requests in flight at the same time (`max_concurrency`).
+# - The deterministic requests (temperature 0) are answered from the persistent response cache when possible (see helpers_llm_cache).
+# It is thread-safe, so concurrent stages and workers share the same budget.
+class LLMClient:
+    def __init__(self, name, url, api_key=None, style="openai", rpm=None, tpm=None, max_concurrency=None, max_retries=llm_max_retries, timeout=llm_timeout, json_object=True):
+        self.name = name
+        self.url = url
+        self.style = style
+        self.json_object = json_object
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=32))
+        self.session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=32))
+        self.session.headers.update({"Content-Type": "application/json"})
+        if api_key:
+            self.session.headers.update({"Authorization": f"Bearer {api_key}"})
+        self.request_bucket = TokenBucket(rpm / 60, capacity=max(1, rpm // 10)) if rpm else None
+        self.token_bucket = TokenBucket(tpm / 60, capacity=tpm) if tpm else None
+        self._in_flight = threading.BoundedSemaphore(max_concurrency) if max_concurrency else contextlib.nullcontext()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    # Send a chat completion and return the content of the answer.
+    # `json_schema` constrains the answer to a JSON Schema (structured outputs), `json_mode` only to valid JSON.
+    # `extra_payload` is merged into the request body (e.g. provider specific options). `cache=False` skips the response cache,
+    # `cache="refresh"` does not read it but saves the new answer (for the retries of a prompt whose cached answer was not valid).
+    def chat(self, model, messages, temperature=0, max_tokens=None, json_mode=False, extra_payload=None, cache=True, json_schema=None):
+        return self.chat_with_usage(model, messages, temperature, max_tokens, json_mode, extra_payload, cache, json_schema)[0]
+
+    # Same as `chat`, and also returns the usage of the request: {"provider", "model", "prompt_tokens", "completion_tokens", "latency", "cached"}
+    # (`latency` is the time of the successful request in seconds, without the waits for the rate limits; the tokens are None if the server does not report them)
+    def chat_with_usage(self, model, messages, temperature=0, max_tokens=None, json_mode=False, extra_payload=None, cache=True, json_schema=None):
+        payload = self._payload(model, messages, temperature, max_tokens, json_mode, extra_payload, json_schema)
+        usage = {"provider": self.name, "model": model, "prompt_tokens": None, "completion_tokens": None, "latency": 0.0, "cached": False}
+        response_cache = get_llm_cache() if cache and get_llm_cache().is_cacheable(payload) else None
+        cache_key = response_cache.key(self.name, payload) if response_cache else None
+        if response_cache and cache != "refresh":
+            cached_content = response_cache.get(cache_key)
+            if cached_content is not None:
+                return cached_content, {**usage, "cached": True}
+        estimated_tokens = sum(len(str(message["content"])) for message in messages) // 4 + (max_tokens or 1024)
+
+        for attempt in range(self.max_retries + 1):
+            self._wait_for_budget(estimated_tokens)
+            try:
+                with self._in_flight:
+                    started = time.perf_counter()
+                    response = self.session.post(self.url, json=payload, timeout=self.timeout)
+                    latency = time.perf_counter() - started
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error, retry_after = e, None
+            else:
+                self._update_limits(response)
+                if response.ok:
+                    response_json = response.json()
+                    content = self._content(response_json)
+                    if response_cache and isinstance(content, str) and (not (json_mode or json_schema) or is_json(content)):
+                        response_cache.put(cache_key, self.name, model, content)
+                    return content, {**usage, **self._usage(response_json), "latency": latency}
+                if response.status_code not in retry_status_codes:
+                    raise LLMRequestError(f"{self.name} API error {response.status_code}: {response.text[:500]}")
+                error, retry_after = f"{response.status_code}: {response.text[:200]}", self._retry_after(response)
+
+            if attempt == self.max_retries:
+                break
+            delay = retry_after if retry_after is not None else self._backoff(attempt)
+            print(f"{self.name} API call failed ({error}). Retrying in {delay:.1f}s (attempt {attempt + 1}/{self.max_retries}).")
+            self._pause(delay)
+        raise LLMRequestError(f"{self.name} API call failed after {self.max_retries} retries: {error}")
+
+    # Ollama takes the JSON Schema in `format`, the OpenAI compatible servers (LM Studio, OpenRouter, Groq...) in `response_format`
+    def _payload(self, model, messages, temperature, max_tokens, json_mode, extra_payload, json_schema=None):
+        if self.style == "ollama":
+            payload = {"model": model, "messages": messages, "stream": False, "options": {"temperature": temperature}}
+            if json_schema:
+                payload["format"] = json_schema
+            elif json_mode:
+                payload["format"] = "json"
+            if max_tokens:
+                payload["options"]["num_predict"] = max_tokens
+        else:
+            payload = {"model": model, "messages": messages, "temperature": temperature}
+            if json_schema:
+                payload["response_format"] = {"type": "json_schema", "json_schema": {"name": json_schema.get("title", "output"), "schema": json_schema}}
+            elif json_mode and self.json_object:
+                payload["response_format"] = {"type": "json_object"}
+            if max_tokens:
+                payload["max_tokens"] = max_tokens
+        payload.update(extra_payload or {})
+        return payload
+
+    def _content(self, response_json):
+        if self.style == "ollama":
+            return response_json["message"]["content"]
+        return response_json["choices"][0]["message"]["content"]
+
+    # The tokens of the prompt and of the answer, as reported by the server
+    def _usage(self, response_json):
+        if self.style == "ollama":
+            return {"prompt_tokens": response_json.get("prompt_eval_count"), "completion_tokens": response_json.get("eval_count")}
+        usage = response_json.get("usage") or {}
+        return {"prompt_tokens": usage.get("prompt_tokens"), "completion_tokens": usage.get("completion_tokens")}
+
+    # Wait for the provider pause (if any) and for the RPM/TPM budgets
+    def _wait_for_budget(self, estimated_tokens):
+        with self._lock:
+            wait = self._paused_until - time.monotonic()
+        if wait > 0:
+            time.sleep(wait)
+        if self.request_bucket:
+            self.request_bucket.acquire()
+        if self.token_bucket:
+            self.token_bucket.acquire(min(estimated_tokens, self.token_bucket.capacity))
+
+    # Pause every caller of this client (not only the current one) for `seconds`
+    def _pause(self, seconds):
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        time.sleep(seconds)
+
+    @staticmethod
+    def _backoff(attempt):
+        # Exponential backoff with "full jitter"
+        return random.uniform(0, min(llm_backoff_max, llm_backoff_base * 2 ** attempt)) + 0.5
+
+    # Seconds from a `retry-after` header (seconds or an HTTP date), or None
+    @staticmethod
+    def _retry_after(response):
+        value = response.headers.get("retry-after")
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+    # When the provider says that no requests or tokens are left, pause until the reset time it reports.
+    # Groq/OpenAI send `x-ratelimit-remaining-requests|tokens` with `x-ratelimit-reset-requests|tokens` (e.g. "2m59.56s"),
+    # OpenRouter sends `x-ratelimit-remaining` with `x-ratelimit-reset` (a timestamp in milliseconds).
+    def _update_limits(self, response):
+        headers = response.headers
+        pause = 0.0
+        for suffix in ("-requests", "-tokens", ""):
+            remaining = headers.get(f"x-ratelimit-remaining{suffix}")
+            reset = headers.get(f"x-ratelimit-reset{suffix}")
+            if remaining is None or reset is None:
+                continue
+            try:
+                if float(remaining) > 0:
+                    continue
+            except ValueError:
+                continue
+            pause = max(pause, parse_reset_seconds(reset))
+        if pause > 0:
+            with self._lock:
+                self._paused_until = max(self._paused_until, time.monotonic() + pause)
+
+
+# Is the answer valid JSON? (an answer in JSON mode that is not, is not cached)
+def is_json(content):
+    try:
+        json.loads(content)
+        return True
+    except ValueError:
+        return False
+
+
+# Seconds until a rate limit reset: durations like "1m30.5s", "7.66s", "250ms" or an epoch timestamp (seconds or milliseconds)
+def parse_reset_seconds(value):
+    value = value.strip()
+    try:
+        number = float(value)
+    except ValueError:
+        number = None
+    if number is not None:
+        if number > 1e11:
+            return max(0.0, number / 1000 - time.time())
+        if number > 1e9:
+            return max(0.0, number - time.time())
+        return number
+    seconds = 0.0
+    for amount, unit in re.findall(r"([\d.]+)(ms|h|m|s)", value):
+        seconds += float(amount) * {"ms": 0.001, "s": 1, "m": 60, "h": 3600}[unit]
+    return seconds
+
+
+# The shared client of a provider (see `llm_providers`), created on first use.
+_clients = {}
+_clients_lock = threading.Lock()
+
+def get_llm_client(provider):
+    with _clients_lock:
+        if provider not in _clients:
+            config = llm_providers[provider]
+            rpm = os.getenv(f"{provider.upper()}_RPM")
+            tpm = os.getenv(f"{provider.upper()}_TPM")
+            max_concurrency = os.getenv(f"{provider.upper()}_MAX_CONCURRENCY")
+            _clients[provider] = LLMClient(
+                provider,
+                config["url"],
+                api_key=config["api_key"],
+                style=config["style"],
+                rpm=int(rpm) if rpm else config["rpm"],
+                tpm=int(tpm) if tpm else config["tpm"],
+                max_concurrency=int(max_concurrency) if max_concurrency else config["max_concurrency"],
+                json_object=config["json_object"],
+            )
+        return _clients[provider]
@@ -0,0 +1,102 @@
+import os, threading
+from collections import Counter
+from concurrent.futures import Future
+
+#  -----------------     Variables    ----------------- #
+# Multi-job packing of the small extraction stages: the inputs of the jobs that reach the same stage at about the same time
+# (in the job worker pool) are sent in one request, with one key per job. A batch is sent when it has `micro_batch_size` jobs,
+# or `micro_batch_wait` seconds after its first job. It helps when the number of requests is the limit (e.g. the RPM of the cloud APIs),
+# so the batches are larger with more job workers (JOB_WORKERS).
+micro_batching = os.getenv("MICRO_BATCHING", "false").lower() == "true"
+micro_batch_size = int(os.getenv("MICRO_BATCH_SIZE", 8))
+micro_batch_wait = float(os.getenv("MICRO_BATCH_WAIT", 1.0))
+
+
+# --------------------------------------------------------------------------
+# Packs the items submitted by concurrent threads into batches for `batch_call({key: item}) -> {key: output}`.
+# `submit` blocks until the output of its item is ready. An item whose key is missing from the batch output (or a whole batch
+# that failed) is requested on its own with the `single_call` given to `submit`, in the thread of the caller.
+# A batch of one item is always a single request (the original prompt).
+class MicroBatcher:
+    def __init__(self, name, batch_call, max_size=micro_batch_size, max_wait=micro_batch_wait):
+        self.name = name
+        self.batch_call = batch_call
+        self.max_size = max_size
+        self.max_wait = max_wait
+        self.stats = Counter()
+        self._pending = []
+        self._timer = None
+        self._lock = threading.Lock()
+
+    def submit(self, item, single_call):
+        future = Future()
+        batch = None
+        with self._lock:
+            self._pending.append((item, future))
+            if len(self._pending) >= self.max_size:
+                batch = self._take_pending()
+            elif len(self._pending) == 1:
+                self._timer = threading.Timer(self.max_wait, self._flush)
+                self._timer.daemon = True
+                self._timer.start()
+        if batch:
+            self._run(batch)
+
+        packed, output = future.result()
+        if packed:
+            return output
+        with self._lock:
+            self.stats["single requests"] += 1
+        return single_call()
+
+    def _take_pending(self):
+        batch, self._pending = self._pending, []
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        return batch
+
+    def _flush(self):
+        with self._lock:
+            batch = self._take_pending()
+        if batch:
+            self._run(batch)
+
+    # Send the batch and give each item its output, or (False, None) for the items to request on their own
+    def _run(self, batch):
+        if len(batch) == 1:
+            batch[0][1].set_result((False, None))
+            return
+        keys = [f"job_{number}" for number in range(1, len(batch) + 1)]
+        try:
+            outputs = self.batch_call({key: item for key, (item, _) in zip(keys, batch)}) or {}
+        except Exception as e:
+            print(f"~~ Packed request of {self.name} for {len(batch)} jobs failed ({type(e).__name__}: {e}). Requesting them one by one.")
+            outputs = {}
+        missing = [key for key in keys if key not in outputs]
+        if missing:
+            print(f"~~ Packed request of {self.name}: {len(missing)}/{len(batch)} jobs missing or invalid. Requesting them one by one.")
+        with self._lock:
+            self.stats["packed requests"] += 1
+            self.stats["packed jobs"] += len(batch) - len(missing)
+        for key, (_, future) in zip(keys, batch):
+            future.set_result((True, outputs[key]) if key in outputs else (False, None))
+
+
+# The shared batcher of each stage, created on first use.
+_micro_batchers = {}
+_micro_batchers_lock = threading.Lock()
+
+def get_micro_batcher(name, batch_call):
+    with _micro_batchers_lock:
+        if name not in _micro_batchers:
+            _micro_batchers[name] = MicroBatcher(name, batch_call)
+        return _micro_batchers[name]
+
+
+def report_micro_batching():
+    with _micro_batchers_lock:
+        batchers = list(_micro_batchers.values())
+    for batcher in batchers:
+        stats = batcher.stats
+        print(f"Micro-batching of {batcher.name} --> packed requests: {stats['packed requests']} for {stats['packed jobs']} jobs, single requests: {stats['single requests']}")
@@ -0,0 +1,90 @@
+import os, json, threading, contextlib
+from helpers_llm_client import llm_providers
+
+#  -----------------     Variables    ----------------- #
+# The provider and model of each extraction stage. The routing is read from the MODEL_ROUTING environment variable (JSON)
+# or from the `model_routing_path` file, e.g. (see data/model_routing.example.json):
+# {"default": {"provider": "openrouter", "model": "meta-llama/llama-3.1-70b-instruct:free"},
+#  "stages": {"job_title": {"provider": "ollama", "model": "llama3.2:3b-instruct-fp16"}, "ISCO": {"provider": "lmstudio", "model": "qwen2.5-14b-instruct"}}}
+# The stages are the stages of the chain extraction (e.g. "industry_summarization", "NACE_level_I", "ISCO", "skills") and "one_shot".
+# A stage without a route uses the "default" route, and without a "default" the provider and model set in helper_llm_main.
+model_routing_path = os.getenv("MODEL_ROUTING_PATH", os.path.join("data", "model_routing.json"))
+
+
+# --------------------------------------------------------------------------
+# The routes of the stages: {stage: (provider, model)}, and an optional default route
+class ModelRouter:
+    def __init__(self, routes=None, default=None):
+        self.routes = dict(routes or {})
+        self.default = default
+        for route in list(self.routes.values()) + ([default] if default else []):
+            if route[0] not in llm_providers:
+                raise ValueError(f"Unknown LLM provider {route[0]} in the model routing (one of {list(llm_providers)})")
+
+    @classmethod
+    def from_config(cls, config):
+        def route(entry):
+            return (entry["provider"], entry["model"]) if entry else None
+        return cls({stage: route(entry) for stage, entry in config.get("stages", {}).items()}, route(config.get("default")))
+
+    # Read the routing from MODEL_ROUTING or from the file (no routing if neither is set)
+    @classmethod
+    def load(cls, path=model_routing_path):
+        if os.getenv("MODEL_ROUTING"):
+            return cls.from_config(json.loads(os.getenv("MODEL_ROUTING")))
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                return cls.from_config(json.load(f))
+        return cls()
+
+    # The (provider, model) of a stage
+    def route(self, stage, default):
+        return self.routes.get(stage) or self.default or default
+
+    def to_config(self):
+        entry = lambda route: {"provider": route[0], "model": route[1]}
+        config = {"stages": {stage: entry(route) for stage, route in self.routes.items()}}
+        if self.default:
+            config["default"] = entry(self.default)
+        return config
+
+
+# The shared router, loaded on first use. `set_model_router` replaces it (e.g. the benchmark routes every stage to each candidate model).
+_model_router = None
+_model_router_lock = threading.Lock()
+
+def get_model_router():
+    global _model_router
+    with _model_router_lock:
+        if _model_router is None:
+            _model_router = ModelRouter.load()
+        return _model_router
+
+
+def set_model_router(router):
+    global _model_router
+    with _model_router_lock:
+        _model_router = router
+
+
+# The usage of the LLM calls of each stage (see `LLMClient.chat_with_usage`), recorded only inside `recording_llm_usage()`
+_usage_records = None
+_usage_records_lock = threading.Lock()
+
+def record_llm_usage(stage, usage):
+    with _usage_records_lock:
+        if _usage_records is not None:
+            _usage_records.append({**usage, "stage": stage})
+
+
+@contextlib.contextmanager
+def recording_llm_usage():
+    global _usage_records
+    records = []
+    with _usage_records_lock:
+        _usage_records = records
+    try:
+        yield records
+    finally:
+        with _usage_records_lock:
+            _usage_records = None
@@ -0,0 +1,104 @@
+import os, re, random, hashlib, threading, unicodedata
+from helpers_sqldb import get_extracted_job_signatures, save_job_minhash_signatures
+
+#  -----------------     Variables    ----------------- #
+# Near-duplicate detection of the job descriptions with MinHash and LSH:
+# `duplicate_num_perm` hash functions per signature, split in `duplicate_bands` bands for the LSH buckets,
+# word shingles of `duplicate_shingle_size` words, and the minimum estimated Jaccard similarity to call two descriptions duplicates.
+duplicate_detection = os.getenv("DUPLICATE_DETECTION", "true").lower() == "true"
+duplicate_num_perm = 128
+duplicate_bands = 32
+duplicate_shingle_size = 5
+duplicate_similarity_threshold = float(os.getenv("DUPLICATE_SIMILARITY_THRESHOLD", 0.85))
+
+# The permutations of the MinHash: (a * hash + b) mod a Mersenne prime, with a fixed seed so the signatures stored in the DB stay valid
+_mersenne_prime = (1 << 61) - 1
+_permutation_random = random.Random(20240901)
+_permutations = [(_permutation_random.randrange(1, _mersenne_prime), _permutation_random.randrange(0, _mersenne_prime)) for _ in range(duplicate_num_perm)]
+
+
+# Lower case, digits as 0 (dates, phone numbers and reference numbers change between reposts), no punctuation and single spaces
+def normalize_description(text):
+    text = unicodedata.normalize("NFKC", text or "").lower()
+    text = re.sub(r"\d", "0", text)
+    return " ".join(re.findall(r"\w+", text))
+
+
+def description_shingles(text):
+    words = normalize_description(text).split()
+    if len(words) <= duplicate_shingle_size:
+        return {" ".join(words)} if words else set()
+    return {" ".join(words[i:i + duplicate_shingle_size]) for i in range(len(words) - duplicate_shingle_size + 1)}
+
+
+# The MinHash signature of a description (a list of `duplicate_num_perm` integers), or None for an empty description
+def minhash_signature(text):
+    hashes = [int.from_bytes(hashlib.blake2b(shingle.encode('utf-8'), digest_size=8).digest(), 'big') for shingle in description_shingles(text)]
+    if not hashes:
+        return None
+    return [min((a * value + b) % _mersenne_prime for value in hashes) for a, b in _permutations]
+
+
+# The share of equal positions of two signatures, an estimate of the Jaccard similarity of the two descriptions
+def estimate_similarity(signature, other_signature):
+    return sum(1 for x, y in zip(signature, other_signature) if x == y) / len(signature)
+
+
+# --------------------------------------------------------------------------
+# An in-memory LSH index of the MinHash signatures of the jobs whose data was extracted by the LLM.
+# Each signature is split in bands and every band is a bucket key, so `query` compares a new description only with the
+# jobs that share at least one bucket (instead of all of them). Thread-safe, the workers add the jobs they extract.
+class NearDuplicateIndex:
+    def __init__(self, bands=duplicate_bands, threshold=duplicate_similarity_threshold):
+        self.bands = bands
+        self.rows = duplicate_num_perm // bands
+        self.threshold = threshold
+        self._signatures = {}
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._signatures)
+
+    def _band_keys(self, signature):
+        return [(band, tuple(signature[band * self.rows:(band + 1) * self.rows])) for band in range(self.bands)]
+
+    def add(self, reference, signature):
+        if not signature:
+            return
+        with self._lock:
+            self._signatures[reference] = signature
+            for key in self._band_keys(signature):
+                self._buckets.setdefault(key, set()).add(reference)
+
+    # The most similar indexed job and its estimated similarity, or (None, 0.0) if none reaches the threshold
+    def query(self, signature, exclude=None):
+        if not signature:
+            return None, 0.0
+        with self._lock:
+            candidates = set()
+            for key in self._band_keys(signature):
+                candidates |= self._buckets.get(key, set())
+            candidates.discard(exclude)
+            scored = [(estimate_similarity(signature, self._signatures[reference]), reference) for reference in candidates]
+        if not scored:
+            return None, 0.0
+        similarity, reference = max(scored)
+        return (reference, similarity) if similarity >= self.threshold else (None, 0.0)
+
+
+# Build the index from the extracted jobs in the DB. The signatures that are missing are computed and saved in the DB.
+def load_duplicate_index():
+    index = NearDuplicateIndex()
+    missing_signatures = []
+    for reference, signature, job_description in get_extracted_job_signatures():
+        if signature is None:
+            signature = minhash_signature(job_description)
+            if signature is None:
+                continue
+            missing_signatures.append((reference, signature))
+        index.add(reference, signature)
+    if missing_signatures:
+        save_job_minhash_signatures(missing_signatures)
+    print(f"~~ Near-duplicate index: {len(index)} extracted jobs ({len(missing_signatures)} new signatures).")
+    return index
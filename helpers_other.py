@@ -1,7 +1,10 @@
-import json, time, random, datetime, os, time
+import json, time, random, datetime, os, time, asyncio
+from concurrent.futures import ThreadPoolExecutor
 from helpers_sqldb import connect_pg_conn
+from helpers_description_normalizer import strip_llm_preamble
 from helpers_translation_ai import translate_job_description
-from helpers_scrape import scrape_job_description
+from helpers_scrape import fetch_job_description, report_fetch_path_stats
+from helpers_browser_pool import get_browser_pool
 from neo4j import GraphDatabase
 from dotenv import load_dotenv
 
@@ -23,6 +26,102 @@ database = os.getenv("POSTGRES_DB")
 username = os.getenv("POSTGRES_USER")
 password = os.getenv("POSTGRES_PASS")
 
+# Concurrency of each stage of the job description pipeline (fetch, translate, write to the database)
+fetch_workers = int(os.getenv("DESCRIPTION_FETCH_WORKERS", 3))
+translate_workers = int(os.getenv("DESCRIPTION_TRANSLATE_WORKERS", 2))
+write_workers = int(os.getenv("DESCRIPTION_WRITE_WORKERS", 1))
+
+
+# Translate a job description. The LLM client already retries with backoff in case of an API error (e.g. a limits issue),
+# so a failure here means the translation is given up for this run.
+def translate_job_description_with_retries(job_description):
+    try:
+        return translate_job_description(job_description)
+    except Exception as e:
+        print(f"Translation API call failed after maximum retries: {e}\n \n---------------------\nFor Job description:\n{job_description}")
+        return None
+
+
+# Fetch -> translate -> write pipeline for the job descriptions.
+# Each stage has its own workers and bounded queues between them, so a slow stage does not hold up the others
+# (e.g. fetching continues while the translation API is slow). Fetching is paced by the per-host token bucket of the scraper.
+async def description_pipeline(list_of_listing_urls, fetch_workers=fetch_workers, translate_workers=translate_workers, write_workers=write_workers):
+    pool = get_browser_pool()
+    # Enough threads for the blocking calls (browser, HTTP, translation API, database) of all the workers
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=fetch_workers + translate_workers + write_workers))
+    fetch_queue = asyncio.Queue()
+    translate_queue = asyncio.Queue(maxsize=fetch_workers * 2)
+    write_queue = asyncio.Queue(maxsize=translate_workers * 2)
+    for listing_url in list_of_listing_urls:
+        fetch_queue.put_nowait(listing_url)
+
+    async def fetch_worker():
+        while True:
+            listing_url = await fetch_queue.get()
+            try:
+                print(f"Parsing job with URL ---> {listing_url}")
+                job_description = await asyncio.to_thread(fetch_job_description, listing_url, pool)
+                await translate_queue.put((listing_url, job_description))
+            except Exception as e:
+                print(f"Fetching failed for {listing_url}: {e}")
+            finally:
+                fetch_queue.task_done()
+
+    async def translate_worker():
+        while True:
+            listing_url, job_description = await translate_queue.get()
+            try:
+                translated_job_description = await asyncio.to_thread(translate_job_description_with_retries, job_description)
+                await write_queue.put((listing_url, translated_job_description))
+            except Exception as e:
+                print(f"Translation failed for {listing_url}: {e}")
+            finally:
+                translate_queue.task_done()
+
+    # Each writer keeps one database connection open for the whole run (opened on the first job, reopened after a failure)
+    async def write_worker():
+        cur, conn = None, None
+        try:
+            while True:
+                listing_url, translated_job_description = await write_queue.get()
+                try:
+                    if conn is None:
+                        cur, conn = await asyncio.to_thread(connect_pg_conn, host, database, username, password)
+                    await asyncio.to_thread(update_job_description_by_url, cur, conn, translated_job_description, listing_url)
+                except Exception as e:
+                    print(f"Database update failed for {listing_url}: {e}")
+                    if conn is not None:
+                        conn.close()
+                    cur, conn = None, None
+                finally:
+                    write_queue.task_done()
+        finally:
+            if conn is not None:
+                cur.close()
+                conn.close()
+
+    workers = ([asyncio.create_task(fetch_worker()) for _ in range(fetch_workers)]
+               + [asyncio.create_task(translate_worker()) for _ in range(translate_workers)]
+               + [asyncio.create_task(write_worker()) for _ in range(write_workers)])
+
+    # Wait for every stage to drain (in order), then stop the workers
+    await fetch_queue.join()
+    await translate_queue.join()
+    await write_queue.join()
+    for worker in workers:
+        worker.cancel()
+    await asyncio.gather(*workers, return_exceptions=True)
+
+
+# Update job_listings table with the Job Description, using an open connection
+def update_job_description_by_url(cur, conn, job_description, listing_url):
+    cur.execute("""
+        UPDATE job_listings
+        SET job_description = %s
+        WHERE listing_url = %s
+    """, (job_description, listing_url))
+    conn.commit()
+
 
 # Get the list of all listing urls from the database in a list where the job description is empty
 # Then scrape the job description for each listing url and update the database with the job description
@@ -34,49 +133,9 @@ def get_jobs_without_description_scrape_and_translate():
     list_of_listing_urls = [row[0] for row in cur.fetchall()]
     conn.close()
 
-    for listing_url in list_of_listing_urls:
-        # print(listing_url)
-        print(f" <-------------------------------------------->")
-        print(f"Parsing job with URL ---> {listing_url}\n \n")
-        print(f" <-------------------------------------------->\n \n")
-        job_description = scrape_job_description(listing_url)
-        # print(job_description)
-        #  Translate the job description if in Greek in a try statement.
-        # Try method for job listings that are not accessible anymore or the there was and API error (e.g. a limits issue)
-        try:
-            translated_job_description = translate_job_description(job_description)
-        except Exception as e:
-            print(f"Translation API call failed: {e}")
-            for _ in range(5):
-                time.sleep(30)
-                try:
-                    translated_job_description = translate_job_description(job_description)
-                    break
-                except Exception as e:
-                    print(f"Translation API call failed: {e}")
-            else:
-                print(f"Translation API call failed after maximum retries.\n \n---------------------\nFor Job description:\n{job_description}")
-                translated_job_description = None
-        # print(translated_job_description)
-        
-        # Update job_listings table with Job Description
-        cur, conn = connect_pg_conn(host, database, username, password)
-        cur.execute("""
-            UPDATE job_listings
-            SET job_description = %s
-            WHERE listing_url = %s
-        """, (translated_job_description, listing_url))
-
-        # Commit changes
-        conn.commit()
-        # Close cursor and connection
-        cur.close()
-        conn.close()
-        
-        # print(f"\rJob description has been updated. URL ---> {listing_url}.\n \n")
-        # Wait a while before scraping the next job description
-        time.sleep(random_number-2.9)
+    asyncio.run(description_pipeline(list_of_listing_urls))
     print("All job descriptions have been updated.")
+    report_fetch_path_stats()
     return
 
 ### Nuke Neo4j database
@@ -104,25 +163,25 @@ def nuke_neo4j_db(session):
     return
 
 
-# A function to clear the job descriptions that start with a specific text, that usually comes from a LLM output. E.g. "Here is the translation:"
-no_relevant_text = "Here is the translation:"
+# A function to clear the job descriptions that start with a text that usually comes from a LLM output. E.g. "Here is the translation:"
+# (see `strip_llm_preamble`). The normalization stage removes it from the clean descriptions too, this fixes the raw descriptions.
 def get_jobdescriptions_with_no_relevant_text_and_clean():    
     # Query all job descriptions from the database
     cur, conn = connect_pg_conn(host, database, username, password)
     cur.execute("""
-        SELECT job_description, reference FROM job_listings
+        SELECT job_description, reference FROM job_listings WHERE job_description IS NOT NULL
     """)
-    job_descriptions = [row for row in cur.fetchall()][:1]
-    print(job_descriptions)
-
-    for job_description in job_descriptions[0]:
-        # Check if the description starts with "no_relevant_text"
-        if job_description.startswith(no_relevant_text):
-            # Remove the line "no_relevant_text"
-            new_description = job_description.replace(no_relevant_text, "")
-            print(f" New cleaned job description -->\n{new_description}\n Reference: {job_descriptions[1]}")
-            # Update the description in the database
-            # update_job_description_data(new_description, job_descriptions[1])
+    job_descriptions = cur.fetchall()
+
+    cleaned = 0
+    for job_description, reference in job_descriptions:
+        new_description = strip_llm_preamble(job_description).strip()
+        if new_description and new_description != job_description.strip():
+            print(f" New cleaned job description -->\n{new_description[:200]}...\n Reference: {reference}")
+            # Update the description in the database (the created date is kept)
+            cur.execute("UPDATE job_listings SET job_description = %s WHERE reference = %s", (new_description, reference))
+            cleaned += 1
+    print(f"{cleaned} job descriptions cleaned.")
     # Commit the changes
     conn.commit()
     # Close the connection
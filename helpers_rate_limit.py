@@ -0,0 +1,52 @@
+import time, threading
+from urllib.parse import urlparse
+
+
+# --------------------------------------------------------------------------
+# A thread-safe token bucket: `rate` tokens are added per second, up to `capacity` (the allowed burst).
+# `acquire()` blocks until the requested tokens are available, so requests are spread evenly at the chosen rate
+# instead of waiting a fixed (random) time after each one.
+class TokenBucket:
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    # Reserve the tokens and return how long the caller has to wait before using them.
+    def reserve(self, tokens=1):
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= tokens
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+    def acquire(self, tokens=1):
+        wait = self.reserve(tokens)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+
+# --------------------------------------------------------------------------
+# One token bucket per host name, so each website is paced at its own politeness rate.
+class HostRateLimiter:
+    def __init__(self, requests_per_second, burst=1):
+        self.requests_per_second = requests_per_second
+        self.burst = burst
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def bucket(self, url):
+        host = urlparse(url).netloc or url
+        with self._lock:
+            if host not in self._buckets:
+                self._buckets[host] = TokenBucket(self.requests_per_second, self.burst)
+            return self._buckets[host]
+
+    def acquire(self, url):
+        return self.bucket(url).acquire()
@@ -1,62 +1,98 @@
-import json, time, random, datetime
+import time, random, datetime, os, threading, requests, importlib.util
+from collections import Counter
 from bs4 import BeautifulSoup
-from selenium import webdriver
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.common.exceptions import StaleElementReferenceException
-from selenium.webdriver.chrome.options import Options
-from helpers_sqldb import get_list_with_ref_id, update_job_description_data
+from helpers_sqldb import update_job_description_data
+from helpers_known_refs import KnownReferenceIndex
+from helpers_browser_pool import get_browser_pool
+from helpers_rate_limit import HostRateLimiter
+from helpers_snapshot_store import get_snapshot_store
+from helpers_checkpoint import JsonlCheckpointWriter, read_jsonl
 from helpers_translation_ai import translate_job_description, translate_job_listings
 
 # A random number to have as time before actions, between x and y seconds.
 random_number = random.uniform(3, 6)
 
-# --------------------------------------------------------------------------
-# This function get the URL of a website and scrapes for the available jobs, the title and the URL for each job
-def scrape_for_new_jobs(url):
-    # How many times robot will click the button for more jobs
-    num_clicks = 100
+# Scraping mode for new jobs: "incremental" (daily runs, stops at the jobs already in the database) or "backfill" (loads all pages).
+scrape_mode = os.getenv("SCRAPE_MODE", "incremental")
+# How many known jobs in a row mean that the rest of the listing is already in the database.
+stop_after_known_cards = int(os.getenv("SCRAPE_STOP_AFTER_KNOWN", 20))
 
-    # Set the condition to stop scraping
-    stop_condition = False
+# JavaScript to read the job cards of the listing page: the HTML of the cards after the first `arguments[0]`, and the number of cards.
+new_cards_script = "return Array.from(document.querySelectorAll('article.search-result-card')).slice(arguments[0]).map(card => card.outerHTML);"
+count_cards_script = "return document.querySelectorAll('article.search-result-card').length;"
 
-    # Initialize the data storage
-    job_listings = []
-    
-    # Set up the browser
-    # options = Options()
-    # options.add_argument("--headless")
-    # driver = webdriver.Chrome(options=options)
-    driver = webdriver.Chrome()
+# The website of the job details pages (can point to a local server with saved pages for testing).
+job_site_base_url = os.getenv("JOB_SITE_BASE_URL", "https://www.ergodotisi.com/")
 
-    # Navigate to the page
-    driver.get(url)  # Replace with the URL of the page
+# A keep-alive HTTP session for the job details pages, with a connection pool big enough for the concurrent fetches.
+http_session = requests.Session()
+http_session.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=16))
+http_session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=16))
+http_session.headers.update({
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/129.0 Safari/537.36",
+    "Accept-Language": "el-GR,el;q=0.9,en;q=0.8",
+})
+http_timeout = 20
 
-    # Get the HTML content
-    html = driver.page_source
-    soup = BeautifulSoup(html, 'html.parser')
+# Politeness rate for the job details pages: requests per second per host (token bucket), instead of fixed random sleeps.
+host_rate_limiter = HostRateLimiter(float(os.getenv("SCRAPE_REQUESTS_PER_SECOND", 1)), burst=int(os.getenv("SCRAPE_BURST", 2)))
 
-    # Wait for the cookie popup to appear and click on it
-    try:
-        cookie_popup = WebDriverWait(driver, 2).until(
-            EC.element_to_be_clickable((By.CSS_SELECTOR, ".css-10d0ll5"))
-        )
-        # Click the "ΣΥΜΦΩΝΩ" button to accept the cookie policy
-        cookie_popup.click()
-    except:
-        pass
+# The HTML parser of the job pages: lxml (faster) if it is installed, otherwise the parser of the standard library.
+html_parser = 'lxml' if importlib.util.find_spec('lxml') else 'html.parser'
+
+# How many descriptions came from the HTTP fast path and how many needed the browser.
+fetch_path_stats = Counter()
+fetch_path_stats_lock = threading.Lock()
+
+# --------------------------------------------------------------------------
+# Read the data of one job card (an `article.search-result-card` element) of the listing page.
+def parse_job_card(article):
+    job_listing_title = article.h2.a.text.strip()
+    job_listing_details_Reference = article.find('a', class_='text-orane ref-number font-weight-bold').text.strip()
+    job_listing_details_company_name = article.find("div", class_="card-contact-block").find_all("p")[1].text.strip()
+    listing_url = article.h2.a['href']
+
+    # Add the data into a JSON object
+    return {
+        "Job Listing Title": job_listing_title,
+        "Job Listing Details Reference": job_listing_details_Reference,
+        "Job Listing Company Name": job_listing_details_company_name,
+        "Listing URL": listing_url
+    }
+
+
+# --------------------------------------------------------------------------
+# Click for more jobs and yield the job cards as they arrive.
+# Only the cards added since the last click are read (through JavaScript, on `article.search-result-card`),
+# so the page source is never copied and memory and parse time stay flat however many pages are loaded.
+# The consumer can stop the paging at any time by not asking for more cards (e.g. `break`).
+def iter_listing_cards(driver, num_clicks=100):
+    cards_seen = 0
+    listing_url = driver.current_url
+
+    # Read the cards added after the first `cards_seen` cards (and keep their HTML in the snapshot store)
+    def new_cards():
+        nonlocal cards_seen
+        cards_html = driver.execute_script(new_cards_script, cards_seen)
+        if cards_html:
+            get_snapshot_store().save(f"{listing_url}#cards={cards_seen}", "\n".join(cards_html), "listing")
+        cards_seen += len(cards_html)
+        for card_html in cards_html:
+            yield parse_job_card(BeautifulSoup(card_html, 'html.parser').article)
 
-    # Wait for the page to load
-    time.sleep(random_number)
+    # The cards of the first page
+    yield from new_cards()
 
     # Get more job listing by clicking for more....
     for i in range(num_clicks):
         # Make a try condition, in case something goes wrong, then the process will finish with the data collected up until that time
         try:
-            # Scroll to the bottom of the page
-            # driver.execute_script("window.scrollTo(0, document.body.scrollHeight);")
-            
             # Find the element and click
             while True:
                 try:
@@ -67,121 +103,242 @@ def scrape_for_new_jobs(url):
                     break
                 except StaleElementReferenceException:
                     pass
-                
+
             # Scroll to the bottom of the page after geting more job listings.
             driver.execute_script("window.scrollTo(0, document.body.scrollHeight);")
 
-            # Update the HTML content
-            html = driver.page_source
-                
-            # Wait for a few seconds and print the progress.
-            time.sleep(random_number)
-            print(f"\rPage: {i} --> Progress: [{'#' * int((i / num_clicks) * 20)}{' ' * (20 - int((i / num_clicks) * 20))}] --> {int(i / num_clicks * 100)}%", end='')
-            # Check the stop condition
-            if stop_condition:
-                break
-            
+            # Wait until the new cards are in the page (instead of a fixed sleep)
+            WebDriverWait(driver, random_number * 2).until(
+                lambda d: d.execute_script(count_cards_script) > cards_seen
+            )
         except Exception as e:
             print(f"Error occurred at page {i}: {str(e)}")
-            stop_condition = True
-            break
-
-    # Parse the HTML and get all Job listings of the front page
-    soup = BeautifulSoup(html, 'html.parser')
-    articles = soup.find_all('article', class_='search-result-card')
-
-    # Loop all elements to get the data.
-    for article in articles:
-        job_listing_title = article.h2.a.text.strip()
-        job_listing_details_Reference = article.find('a', class_='text-orane ref-number font-weight-bold').text.strip()
-        job_listing_details_company_name = article.find("div", class_="card-contact-block").find_all("p")[1].text.strip()
-        listing_url = article.h2.a['href']
-        
-        # Add the data into a JSON object
-        job_listing_data = {
-            "Job Listing Title": job_listing_title,
-            "Job Listing Details Reference": job_listing_details_Reference,
-            "Job Listing Company Name": job_listing_details_company_name,
-            "Listing URL": listing_url
-        }
-        
-        # Append to a list if the job is NOT ALREADY in the database using the Reference ID of the job.
-        existing_jobs = get_list_with_ref_id()
-        if job_listing_details_Reference not in existing_jobs:
+            return
+
+        yield from new_cards()
+
+        # Print the progress.
+        print(f"\rPage: {i} --> Progress: [{'#' * int((i / num_clicks) * 20)}{' ' * (20 - int((i / num_clicks) * 20))}] --> {int(i / num_clicks * 100)}%", end='')
+
+
+# --------------------------------------------------------------------------
+# This function get the URL of a website and scrapes for the available jobs, the title and the URL for each job
+# Modes:
+#   - "incremental": the cards are checked as they arrive and paging stops once `stop_after_known` consecutive cards are already in the database.
+#   - "backfill": clicks for more jobs up to `num_clicks` times, regardless of how many jobs are already known.
+def scrape_for_new_jobs(url, mode=scrape_mode, num_clicks=100, stop_after_known=stop_after_known_cards):
+    # Load the references already in the database once (one round trip), to check each scraped job in constant time
+    known_refs = KnownReferenceIndex.load()
+
+    # Resume from today's checkpoint: the jobs scraped by an earlier (crashed) run that are not in the database yet are kept, and skipped while scraping
+    checkpoint_path = scraped_job_listings_path()
+    job_listings = []
+    resumed_refs = set()
+    for job_listing_data in read_jsonl(checkpoint_path):
+        reference = job_listing_data["Job Listing Details Reference"]
+        if reference not in known_refs and reference not in resumed_refs:
             job_listings.append(job_listing_data)
-        else:
-            # print(f"Job already in the database ----> {job_listing_data}")
-            pass
-        # print(job_listing_data,"\n")
+            resumed_refs.add(reference)
+
+    # How many known jobs were found in a row
+    consecutive_known = 0
+
+    # Each new job is appended to the checkpoint file as soon as it is found
+    with JsonlCheckpointWriter(checkpoint_path) as checkpoint:
+        # Borrow a browser from the shared pool (it is given back, not closed, when done)
+        with get_browser_pool().browser() as driver:
+            # Navigate to the page
+            driver.get(url)  # Replace with the URL of the page
+
+            # Wait for the cookie popup to appear and click on it
+            try:
+                cookie_popup = WebDriverWait(driver, 2).until(
+                    EC.element_to_be_clickable((By.CSS_SELECTOR, ".css-10d0ll5"))
+                )
+                # Click the "ΣΥΜΦΩΝΩ" button to accept the cookie policy
+                cookie_popup.click()
+            except:
+                pass
 
-    # Close the browser
-    driver.quit()
+            # Wait for the first job cards to load
+            try:
+                WebDriverWait(driver, random_number).until(
+                    EC.presence_of_element_located((By.CSS_SELECTOR, "article.search-result-card"))
+                )
+            except:
+                pass
+
+            # Keep the jobs that are NOT ALREADY in the database, as the cards arrive
+            for job_listing_data in iter_listing_cards(driver, num_clicks):
+                reference = job_listing_data["Job Listing Details Reference"]
+                # Already scraped by the earlier run (not counted as known, as it is not in the database yet)
+                if reference in resumed_refs:
+                    continue
+                if reference not in known_refs:
+                    job_listings.append(job_listing_data)
+                    checkpoint.write(job_listing_data)
+                    known_refs.add(reference)
+                    consecutive_known = 0
+                else:
+                    consecutive_known += 1
+
+                # In incremental mode stop paging once we reached the jobs that are already in the database
+                if mode == "incremental" and consecutive_known >= stop_after_known:
+                    print(f"\nReached {consecutive_known} known jobs in a row. Stopping.")
+                    break
 
-    # Write the list of job listings to a JSON file
-    with open(f'{datetime.date.today()}_job_listings.json', 'w', encoding='utf-8') as f:
-        json.dump(job_listings, f, ensure_ascii=False)
-    
     return job_listings
- 
+
+
+# Today's checkpoint file of the scraped job listings (one JSON line per job)
+def scraped_job_listings_path():
+    return f'{datetime.date.today()}_job_listings.jsonl'
+
+
+# --------------------------------------------------------------------------
+# Get the text of the job description from the HTML of a job details page.
+# Returns None if the description block is not in the page (e.g. it is rendered by JavaScript).
+def extract_job_description_text(html, parser=html_parser):
+    soup = BeautifulSoup(html, parser)
+
+    # Find the HTML section
+    description_part = soup.select_one('div.description-part.alpha')
+    if description_part is None:
+        return None
+
+    # Extract the text
+    text = ''
+    for element in description_part.find_all(['p', 'li', 'ul']):
+        if element.text.strip():
+            text += element.text.strip() + '\n'
+    return text
+
 
 # --------------------------------------------------------------------------
 # This function gets a URL for a job, scrapes the job description and outputs as text.
-def scrape_job_description(job_url):
-    # Setup browser and options for Selenium
-
-    # # Wait for the cookie popup to appear and click on it
-    # try:
-    #     cookie_popup = WebDriverWait(driver, 3).until(
-    #         EC.element_to_be_clickable((By.CSS_SELECTOR, ".css-10d0ll5"))
-    #     )
-    #     # Click the "ΣΥΜΦΩΝΩ" button to accept the cookie policy
-    #     cookie_popup.click()
-    # except:
-    #     pass
-
-    # # Wait for the page to fully load
-    # WebDriverWait(driver, 1).until(
-    #     EC.presence_of_element_located((By.CSS_SELECTOR, 'div.description-part.alpha'))
-    # )
+# A browser is borrowed from the pool, so Chrome is not started and closed for every job.
+def scrape_job_description(job_url, pool=None):
+    pool = pool or get_browser_pool()
 
     try:
-        options = Options()
-        options.add_argument("--headless")
-        driver = webdriver.Chrome(options=options)
-
-        # Navigate to the page
-        driver.get(f'https://www.ergodotisi.com/{job_url}')
-
-        
-        # Get the HTML source
-        html = driver.page_source
-        soup = BeautifulSoup(html, 'html.parser')
-
-        # Find the HTML section
-        description_part = soup.find('div', class_='col-md-12 description-part alpha')
-
-        # Extract the text
-        text = ''
-        if description_part:
-            for element in description_part.find_all(['p', 'li', 'ul']):
-                if element.text.strip():
-                    text += element.text.strip() + '\n'
-            # Close the browser
-        driver.quit()
-        
+        with pool.browser() as driver:
+            # Navigate to the page (paced by the per-host rate limiter)
+            host_rate_limiter.acquire(job_site_base_url)
+            driver.get(f'{job_site_base_url}{job_url}')
+
+            # Get the HTML source
+            html = driver.page_source
+        # Keep the rendered page, so it can be re-parsed offline and reused while the page has not changed
+        get_snapshot_store().save(job_url, html, "detail_rendered")
+        text = extract_job_description_text(html) or ''
+
     except:
         text = 'No description'
         print(f" <-------------------------------------------->")
         print(f"Error occurred while scraping the job description: {job_url}\n \n")
         pass
-    
-    # Wait a while before scraping the next job description
-    time.sleep(random_number-2.9)
 
     # print(text)
     return text
 
 
+# --------------------------------------------------------------------------
+# Get the job description with a plain HTTP request first (the description is usually in the server-rendered HTML)
+# and use the browser only when the description block is missing or the request fails.
+# The raw page is kept in the snapshot store: an unchanged page (HTTP 304 or same content hash) is read from disk,
+# and a page that needed the browser last time reuses the stored rendered page instead of opening a browser again.
+def fetch_job_description(job_url, pool=None):
+    store = get_snapshot_store()
+    try:
+        # Ask the server to answer "304 Not Modified" if the page has not changed since the last snapshot
+        headers = {}
+        previous = store.latest(job_url, "detail")
+        if previous:
+            if previous.get("etag"):
+                headers["If-None-Match"] = previous["etag"]
+            if previous.get("last_modified"):
+                headers["If-Modified-Since"] = previous["last_modified"]
+
+        host_rate_limiter.acquire(job_site_base_url)
+        response = http_session.get(f'{job_site_base_url}{job_url}', headers=headers, timeout=http_timeout)
+        html = store.load_latest(job_url, "detail") if response.status_code == 304 else None
+        if response.status_code == 304 and html is None:
+            # The stored page is missing, so the full page is requested again
+            host_rate_limiter.acquire(job_site_base_url)
+            response = http_session.get(f'{job_site_base_url}{job_url}', timeout=http_timeout)
+        if html is None:
+            response.raise_for_status()
+            html = response.text
+            _, changed = store.save(job_url, html, "detail", response.headers.get("ETag"), response.headers.get("Last-Modified"))
+        else:
+            changed = False
+
+        text = extract_job_description_text(html)
+        if text is not None:
+            record_fetch_path("http")
+            return text
+
+        # The page has not changed since the browser rendered it last time, so the rendered page is read from the store
+        rendered_html = store.load_latest(job_url, "detail_rendered") if not changed else None
+        if rendered_html is not None:
+            record_fetch_path("snapshot")
+            return extract_job_description_text(rendered_html) or ''
+    except requests.RequestException as e:
+        print(f"HTTP request failed for {job_url}: {e}. Using the browser.")
+
+    record_fetch_path("selenium")
+    return scrape_job_description(job_url, pool)
+
+
+# --------------------------------------------------------------------------
+# Re-parse the job descriptions offline from the snapshot store (e.g. after a parser fix), without loading any page.
+# Returns a dictionary {job_url: description text}. The rendered page is used when the raw page has no description block.
+def reparse_job_descriptions_from_store():
+    store = get_snapshot_store()
+    descriptions = {}
+    for record, html in store.iter_latest("detail"):
+        descriptions[record["url"]] = extract_job_description_text(html)
+    for record, html in store.iter_latest("detail_rendered"):
+        if descriptions.get(record["url"]) is None:
+            descriptions[record["url"]] = extract_job_description_text(html) or ''
+    return descriptions
+
+
+# Re-parse the job cards of the stored listing pages offline. Yields the card data, like `iter_listing_cards`.
+def reparse_listing_cards_from_store():
+    store = get_snapshot_store()
+    for record, html in store.iter_latest("listing"):
+        for article in BeautifulSoup(html, html_parser).find_all('article', class_='search-result-card'):
+            yield parse_job_card(article)
+
+
+def record_fetch_path(path):
+    with fetch_path_stats_lock:
+        fetch_path_stats[path] += 1
+
+
+# Print how many job descriptions were fetched by each path (HTTP or Selenium).
+def report_fetch_path_stats():
+    with fetch_path_stats_lock:
+        total = sum(fetch_path_stats.values())
+        stats = dict(fetch_path_stats)
+    if not total:
+        print("No job descriptions fetched.")
+        return stats
+    print(f"Job descriptions fetched: {total} --> " + ", ".join(f"{path}: {count} ({count / total:.0%})" for path, count in stats.items()))
+    return stats
+
+
+# --------------------------------------------------------------------------
+# Fetch several job descriptions at the same time (over HTTP, or each one in a separate browser of the pool when needed).
+# Returns a dictionary {job_url: description text} in the same order as the URLs.
+def scrape_job_descriptions(job_urls, pool=None, max_workers=None):
+    pool = pool or get_browser_pool()
+    with ThreadPoolExecutor(max_workers=max_workers or pool.size) as executor:
+        descriptions = executor.map(lambda job_url: fetch_job_description(job_url, pool), job_urls)
+        return dict(zip(job_urls, descriptions))
+
+
 # --------------------------------------------------------------------------
 # This function gets the job listing, uses the listing URl and then A) Scraped the description, B) Translates it if in Greek and C) updates the database wit hthe translated job description.
 def get_job_description(job_listings):
@@ -189,7 +346,7 @@ def get_job_description(job_listings):
         # Use the URL to scrape the job description
         job_url = job_listing["Job Listing URL"]
         # Scrape the job description
-        job_description = scrape_job_description(job_url)
+        job_description = fetch_job_description(job_url)
         #  Translate the job description if in Greek
         translated_job_description = translate_job_description(job_description)
         # Use the reference ID to update the job description in the database
@@ -197,8 +354,6 @@ def get_job_description(job_listings):
         # Update the job description in the database
         update_job_description_data(translated_job_description, reference)
         # print(f"Job Description for {reference} has been updated.")
-        # Wait a while before scraping the next job description
-        time.sleep(random_number-3.1)
     return
 
 # ---------------------------# Tests # ---------------------------#
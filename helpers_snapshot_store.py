@@ -0,0 +1,105 @@
+import os, json, gzip, hashlib, datetime, threading
+
+#  -----------------     Variables    ----------------- #
+# Where the raw HTML of the scraped pages is kept
+snapshot_store_path = os.getenv("SNAPSHOT_STORE_PATH", "data/snapshots")
+
+
+# --------------------------------------------------------------------------
+# A local, content-addressed store of the raw HTML we scrape (listing and job details pages).
+# Each page is stored once, gzip compressed, under the SHA-256 of its content: `objects/<2 first chars>/<sha256>.html.gz`.
+# Every fetch is recorded in `index.jsonl` (url, kind, fetch time, sha256 and the HTTP validators), so
+# parsers can re-run offline from the store and a re-fetch can tell if a page has changed since the last time.
+class SnapshotStore:
+    def __init__(self, root=snapshot_store_path):
+        self.root = root
+        self.index_path = os.path.join(root, "index.jsonl")
+        self._latest = {}
+        self._lock = threading.Lock()
+        self._load_index()
+
+    @staticmethod
+    def content_hash(html):
+        return hashlib.sha256(html.encode('utf-8')).hexdigest()
+
+    # Store the HTML of a page and record the fetch. Returns the content hash and whether the page changed since its last snapshot.
+    def save(self, url, html, kind, etag=None, last_modified=None):
+        sha256 = self.content_hash(html)
+        object_path = self._object_path(sha256)
+        record = {
+            "url": url,
+            "kind": kind,
+            "fetched_at": datetime.datetime.now().isoformat(timespec='seconds'),
+            "sha256": sha256,
+            "etag": etag,
+            "last_modified": last_modified,
+        }
+        with self._lock:
+            previous = self._latest.get((url, kind))
+            if not os.path.exists(object_path):
+                os.makedirs(os.path.dirname(object_path), exist_ok=True)
+                tmp_path = f"{object_path}.tmp"
+                with gzip.open(tmp_path, 'wt', encoding='utf-8') as f:
+                    f.write(html)
+                os.replace(tmp_path, object_path)
+            with open(self.index_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self._latest[(url, kind)] = record
+        return sha256, previous is None or previous["sha256"] != sha256
+
+    # The record of the last fetch of a page, or None if it was never stored
+    def latest(self, url, kind):
+        with self._lock:
+            return self._latest.get((url, kind))
+
+    def load(self, sha256):
+        with gzip.open(self._object_path(sha256), 'rt', encoding='utf-8') as f:
+            return f.read()
+
+    # The HTML of the last fetch of a page, or None
+    def load_latest(self, url, kind):
+        record = self.latest(url, kind)
+        if record is None:
+            return None
+        try:
+            return self.load(record["sha256"])
+        except OSError:
+            return None
+
+    # Yield (record, html) for the last snapshot of every page of a kind, to re-parse offline
+    def iter_latest(self, kind):
+        with self._lock:
+            records = [record for (url, record_kind), record in self._latest.items() if record_kind == kind]
+        for record in records:
+            try:
+                yield record, self.load(record["sha256"])
+            except OSError as e:
+                print(f"Snapshot {record['sha256']} of {record['url']} could not be read: {e}")
+
+    def _object_path(self, sha256):
+        return os.path.join(self.root, "objects", sha256[:2], f"{sha256}.html.gz")
+
+    def _load_index(self):
+        os.makedirs(self.root, exist_ok=True)
+        if not os.path.exists(self.index_path):
+            return
+        with open(self.index_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # A partly written last line (crash while writing) is skipped
+                    continue
+                self._latest[(record["url"], record["kind"])] = record
+
+
+# A shared store for the scrapers, opened on first use.
+_shared_store = None
+_shared_store_lock = threading.Lock()
+
+def get_snapshot_store():
+    global _shared_store
+    with _shared_store_lock:
+        if _shared_store is None:
+            _shared_store = SnapshotStore()
+        return _shared_store
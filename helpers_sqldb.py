@@ -1,6 +1,7 @@
 import psycopg2, os, json, requests, logging, datetime
 from dotenv import load_dotenv
 from neo4j import GraphDatabase
+from helpers_taxonomy import get_taxonomy
 
 # Configuration for logging
 timestamp = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
@@ -125,14 +126,32 @@ def get_list_with_ref_id():
     return list_of_ref_ids
 
 
+# Get the reference IDs (and their created date) added since a given timestamp, together with the total number of rows, in one query.
+# If `since` is None all references are returned. Rows without a created date are always included, because they cannot be ordered.
+def get_ref_ids_created_since(since=None):
+    cur, conn = connect_pg_conn(host, database, username, password)
+    cur.execute("""
+        SELECT total.count, total.checksum, j.reference, j.created_date
+        FROM (SELECT COUNT(*) AS count,
+                     COALESCE(SUM(('x' || lpad(substr(md5(refs.reference), 1, 8), 16, '0'))::bit(64)::bigint), 0) AS checksum
+              FROM (SELECT DISTINCT reference::text AS reference FROM job_listings WHERE reference IS NOT NULL) AS refs) AS total
+        LEFT JOIN job_listings j ON (%(since)s IS NULL OR j.created_date > %(since)s OR j.created_date IS NULL)
+    """, {"since": since})
+    rows = cur.fetchall()
+    cur.close()
+    conn.close()
+    total_rows, checksum = (rows[0][0], int(rows[0][1])) if rows else (0, 0)
+    return total_rows, checksum, [(row[2], row[3]) for row in rows if row[2] is not None]
+
+
 # Get all data from jobs if the 'imported' column is NOT True.
-# Return a list with the following JOB data in JSON format: {"job_title", "job_reference", "job_description"}
+# Return a list with the following JOB data in JSON format: {"job_title", "job_reference", "job_description", "job_description_clean", "company_name"}
 def get_jobs_not_imported_to_neo4j():
     cur, conn = connect_pg_conn(host, database, username, password)
     cur.execute("""
-        SELECT title, reference, job_description FROM job_listings WHERE imported IS NULL
+        SELECT title, reference, job_description, job_description_clean, company_name FROM job_listings WHERE imported IS NULL
     """)
-    list_of_jobs = [{"job_title": row[0], "job_reference": row[1], "job_description": row[2]} for row in cur.fetchall()]
+    list_of_jobs = [{"job_title": row[0], "job_reference": row[1], "job_description": row[2], "job_description_clean": row[3], "company_name": row[4]} for row in cur.fetchall()]
     conn.close()
     return list_of_jobs
 
@@ -147,6 +166,205 @@ def update_job_as_imported(job_reference):
     """, (job_reference,))
     conn.commit()
     conn.close()
+
+
+# Add the columns of the normalized descriptions, if they do not exist (see aileana_helper_SQL_queries.sql)
+# - `job_description_clean`: the description without boilerplate, used in the LLM prompts (see helpers_description_normalizer)
+# - `job_description_tokens` / `job_description_clean_tokens`: the (estimated) tokens of the raw and the clean description
+def ensure_description_normalization_schema():
+    cur, conn = connect_pg_conn(host, database, username, password)
+    cur.execute("""
+        ALTER TABLE job_listings ADD COLUMN IF NOT EXISTS job_description_clean TEXT;
+        ALTER TABLE job_listings ADD COLUMN IF NOT EXISTS job_description_tokens INTEGER;
+        ALTER TABLE job_listings ADD COLUMN IF NOT EXISTS job_description_clean_tokens INTEGER;
+        ALTER TABLE job_listings ADD COLUMN IF NOT EXISTS job_description_hash TEXT;
+    """)
+    conn.commit()
+    conn.close()
+
+
+# All the job descriptions: [(reference, company name, job description, hash of the description when it was normalized or None)]
+def get_job_descriptions_for_normalization():
+    cur, conn = connect_pg_conn(host, database, username, password)
+    cur.execute("""
+        SELECT reference, company_name, job_description, job_description_hash FROM job_listings
+        WHERE job_description IS NOT NULL AND job_description <> ''
+    """)
+    rows = cur.fetchall()
+    conn.close()
+    return rows
+
+
+# Save the clean descriptions: [(reference, clean description, hash of the description, tokens of the description, tokens of the clean description)]
+def save_clean_job_descriptions(rows):
+    cur, conn = connect_pg_conn(host, database, username, password)
+    cur.executemany("""
+        UPDATE job_listings
+        SET job_description_clean = %s, job_description_hash = %s, job_description_tokens = %s, job_description_clean_tokens = %s
+        WHERE reference = %s
+    """, [(clean, text_hash, tokens, clean_tokens, reference) for reference, clean, text_hash, tokens, clean_tokens in rows])
+    conn.commit()
+    conn.close()
+
+
+# Create the table of the industry of each company, if it does not exist (see helpers_company_industry and aileana_helper_SQL_queries.sql)
+def ensure_company_industry_schema():
+    cur, conn = connect_pg_conn(host, database, username, password)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS company_industry_cache (
+            company_key TEXT PRIMARY KEY,
+            company_name TEXT,
+            industry_name TEXT,
+            nace_standardized_name TEXT,
+            nace_code TEXT,
+            confidence REAL NOT NULL DEFAULT 0,
+            classifications INTEGER NOT NULL DEFAULT 1,
+            manual_override BOOLEAN NOT NULL DEFAULT FALSE,
+            source_job_reference TEXT,
+            updated_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        ALTER TABLE company_industry_cache ADD COLUMN IF NOT EXISTS agreements INTEGER NOT NULL DEFAULT 1;
+        ALTER TABLE company_industry_cache ADD COLUMN IF NOT EXISTS disagreements INTEGER NOT NULL DEFAULT 0;
+    """)
+    conn.commit()
+    conn.close()
+
+
+# The cached industry of a company: {"industry_name", "nace_standardized_name", "confidence", "manual_override", "agreements", "disagreements"}, or None
+def get_company_industry(company_key):
+    cur, conn = connect_pg_conn(host, database, username, password)
+    cur.execute("""
+        SELECT industry_name, nace_standardized_name, confidence, manual_override, agreements, disagreements FROM company_industry_cache WHERE company_key = %s
+    """, (company_key,))
+    row = cur.fetchone()
+    conn.close()
+    return {"industry_name": row[0], "nace_standardized_name": row[1], "confidence": row[2], "manual_override": row[3],
+            "agreements": row[4], "disagreements": row[5]} if row else None
+
+
+# Save the industry classified for a company (a manual override is never replaced)
+def save_company_industry(company_key, company_name, industry_name, nace_standardized_name, nace_code, confidence, agreements, disagreements, job_reference):
+    cur, conn = connect_pg_conn(host, database, username, password)
+    cur.execute("""
+        INSERT INTO company_industry_cache (company_key, company_name, industry_name, nace_standardized_name, nace_code, confidence, agreements, disagreements, source_job_reference)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+        ON CONFLICT (company_key) DO UPDATE
+        SET company_name = EXCLUDED.company_name, industry_name = EXCLUDED.industry_name, nace_standardized_name = EXCLUDED.nace_standardized_name,
+            nace_code = EXCLUDED.nace_code, confidence = EXCLUDED.confidence, agreements = EXCLUDED.agreements, disagreements = EXCLUDED.disagreements,
+            source_job_reference = EXCLUDED.source_job_reference, classifications = company_industry_cache.classifications + 1, updated_date = CURRENT_TIMESTAMP
+        WHERE NOT company_industry_cache.manual_override
+    """, (company_key, company_name, industry_name, nace_standardized_name, nace_code, confidence, agreements, disagreements, job_reference))
+    conn.commit()
+    conn.close()
+
+
+# Add the columns and the table of the near-duplicate detection, if they do not exist (see aileana_helper_SQL_queries.sql)
+# - `extracted_data`: the structured data extracted by the LLM, reused for the reposts of the same job
+# - `description_minhash`: the MinHash signature of the description (see helpers_near_duplicates)
+# - `job_duplicate_clusters`: every job that is a near-duplicate, with the job it was copied from (the canonical job)
+def ensure_duplicate_detection_schema():
+    cur, conn = connect_pg_conn(host, database, username, password)
+    cur.execute("""
+        ALTER TABLE job_listings ADD COLUMN IF NOT EXISTS extracted_data JSONB;
+        ALTER TABLE job_listings ADD COLUMN IF NOT EXISTS description_minhash BIGINT[];
+        CREATE TABLE IF NOT EXISTS job_duplicate_clusters (
+            job_reference TEXT PRIMARY KEY,
+            canonical_reference TEXT NOT NULL,
+            similarity REAL NOT NULL,
+            detected_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        CREATE INDEX IF NOT EXISTS job_duplicate_clusters_canonical ON job_duplicate_clusters (canonical_reference);
+    """)
+    conn.commit()
+    conn.close()
+
+
+# The jobs extracted by the LLM (not copied from a duplicate): [(reference, MinHash signature or None, job description)]
+def get_extracted_job_signatures():
+    cur, conn = connect_pg_conn(host, database, username, password)
+    cur.execute("""
+        SELECT j.reference, j.description_minhash, j.job_description
+        FROM job_listings AS j
+        LEFT JOIN job_duplicate_clusters AS d ON d.job_reference = j.reference
+        WHERE j.extracted_data IS NOT NULL AND d.job_reference IS NULL
+    """)
+    rows = cur.fetchall()
+    conn.close()
+    return rows
+
+
+# Save the MinHash signatures of jobs: [(reference, signature)]
+def save_job_minhash_signatures(signatures):
+    cur, conn = connect_pg_conn(host, database, username, password)
+    cur.executemany("""
+        UPDATE job_listings SET description_minhash = %s WHERE reference = %s
+    """, [(signature, reference) for reference, signature in signatures])
+    conn.commit()
+    conn.close()
+
+
+# Save the data extracted for a job (and the MinHash signature of its description, if given)
+def save_extracted_data(job_reference, extracted_data, signature=None):
+    cur, conn = connect_pg_conn(host, database, username, password)
+    cur.execute("""
+        UPDATE job_listings
+        SET extracted_data = %s::jsonb, description_minhash = COALESCE(%s, description_minhash)
+        WHERE reference = %s
+    """, (json.dumps(extracted_data, ensure_ascii=False), signature, job_reference))
+    conn.commit()
+    conn.close()
+
+
+# The data extracted for a job, or None
+def get_extracted_data(job_reference):
+    cur, conn = connect_pg_conn(host, database, username, password)
+    cur.execute("SELECT extracted_data FROM job_listings WHERE reference = %s", (job_reference,))
+    row = cur.fetchone()
+    conn.close()
+    return row[0] if row else None
+
+
+# A random sample of `n` extracted jobs (not near-duplicates), with their extracted data (e.g. to label a benchmark sample, see benchmark_models.py)
+def get_extracted_jobs_sample(n):
+    cur, conn = connect_pg_conn(host, database, username, password)
+    cur.execute("""
+        SELECT j.title, j.reference, j.job_description, j.job_description_clean, j.company_name, j.extracted_data
+        FROM job_listings AS j
+        LEFT JOIN job_duplicate_clusters AS d ON d.job_reference = j.reference
+        WHERE j.extracted_data IS NOT NULL AND d.job_reference IS NULL
+        ORDER BY random() LIMIT %s
+    """, (n,))
+    list_of_jobs = [{"job_title": row[0], "job_reference": row[1], "job_description": row[2], "job_description_clean": row[3], "company_name": row[4], "extracted_data": row[5]}
+                    for row in cur.fetchall()]
+    conn.close()
+    return list_of_jobs
+
+
+# Record that a job is a near-duplicate of the canonical job
+def save_duplicate_of(job_reference, canonical_reference, similarity):
+    cur, conn = connect_pg_conn(host, database, username, password)
+    cur.execute("""
+        INSERT INTO job_duplicate_clusters (job_reference, canonical_reference, similarity)
+        VALUES (%s, %s, %s)
+        ON CONFLICT (job_reference) DO UPDATE
+        SET canonical_reference = EXCLUDED.canonical_reference, similarity = EXCLUDED.similarity, detected_date = CURRENT_TIMESTAMP
+    """, (job_reference, canonical_reference, similarity))
+    conn.commit()
+    conn.close()
+
+
+# The embedding of the canonical job of a near-duplicate, or None (not a duplicate, or no embedding yet)
+def get_canonical_embedding(job_reference):
+    cur, conn = connect_pg_conn(host, database, username, password)
+    cur.execute("""
+        SELECT c.embedding
+        FROM job_duplicate_clusters AS d
+        JOIN job_listings AS c ON c.reference = d.canonical_reference
+        WHERE d.job_reference = %s AND c.embedding IS NOT NULL
+    """, (job_reference,))
+    row = cur.fetchone()
+    conn.close()
+    return row[0] if row else None
     
 
 #  ----------------- HELPER GRAPHDB and EMBEDDING FUNTIONS ----------------- #
@@ -212,19 +430,26 @@ def create_relationship_skill_and_responsibilities_in_neo4j(structured_job_data)
 
 # Function to create nodes and relationships
 def import_job_data_to_neo4j(session, job_data, job_reference, country, job_description_text):
+    # The NACE and ISCO codes of the standardized names (see helpers_taxonomy), stored next to the names
+    taxonomy = get_taxonomy()
+    nace_code = taxonomy.nace_code(job_data['industry']['NACE_standardized_name'])
+    nace_section_code = taxonomy.nace_parent(nace_code) or nace_code
+    isco_code = taxonomy.isco_code(job_data['isco_name'])
 
     # Create INDUSTRY node
     industry_query = """
     MERGE (i:INDUSTRY {standardized_industry_name: $standardized_industry_name})
-    ON CREATE SET i.industry_name = $industry_name;
+    ON CREATE SET i.industry_name = $industry_name
+    SET i.nace_code = $nace_code, i.nace_section_code = $nace_section_code;
     """
-    session.run(industry_query, industry_name=job_data['industry']['industry_name'], standardized_industry_name=job_data['industry']['NACE_standardized_name'])
+    session.run(industry_query, industry_name=job_data['industry']['industry_name'], standardized_industry_name=job_data['industry']['NACE_standardized_name'],
+                nace_code=nace_code, nace_section_code=nace_section_code)
 
 
     # Create JOB node
     job_query = """
     CREATE (j:JOB {job_title: $job_title, job_reference: $job_reference, 
-                standardized_occupation: $standardized_occupation, job_seniority: $job_seniority, 
+                standardized_occupation: $standardized_occupation, isco_code: $isco_code, job_seniority: $job_seniority, 
                 minimum_level_of_education: $minimum_level_of_education, employment_type: $employment_type, 
                 employment_model: $employment_model, country: $country, job_description: $job_description_text, embedding: NULL})
     """
@@ -233,6 +458,7 @@ def import_job_data_to_neo4j(session, job_data, job_reference, country, job_desc
         'job_title': job_data['job_title'],
         'job_reference': job_reference,
         'standardized_occupation': job_data['isco_name'],
+        'isco_code': isco_code,
         'job_seniority': job_data['occupation_details']['job_seniority'],
         'minimum_level_of_education': job_data['occupation_details']['minimum_level_of_education'],
         'employment_type': job_data['occupation_details'].get('employment_type', None),
@@ -336,9 +562,9 @@ def import_job_data_to_neo4j(session, job_data, job_reference, country, job_desc
     # for relationship in create_relationship_skill_and_responsibilities_in_neo4j(job_data):
     #     session.run(relationship)
 
-    # Update the PostgreSQL database to mark the job as imported to Neo4j and close the connection
+    # Update the PostgreSQL database to mark the job as imported to Neo4j
+    # (the session and its driver belong to the caller, several workers import jobs at the same time)
     update_job_as_imported(job_reference)
-    driver.close()
 
 
 
@@ -0,0 +1,89 @@
+import os, time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+#  -----------------     Variables    ----------------- #
+# How many stages of a graph can run at the same time (the LLM calls are still paced by the shared client of each provider)
+stage_graph_workers = int(os.getenv("EXTRACTION_STAGE_WORKERS", 5))
+
+
+class StageGraphError(Exception):
+    def __init__(self, message, results=None, failures=None):
+        super().__init__(message)
+        self.results = results or {}
+        self.failures = failures or {}
+
+
+# A step of a stage graph: `func` receives a dict with the results of the stages it depends on and returns its own result
+class Stage:
+    def __init__(self, name, func, depends_on=()):
+        self.name = name
+        self.func = func
+        self.depends_on = tuple(depends_on)
+
+
+# --------------------------------------------------------------------------
+# Run a small dependency graph of stages in a thread pool: every stage starts as soon as the stages it depends on are done,
+# so independent chains run at the same time and the wall-clock time is about the time of the longest chain.
+# The timing and the status of every stage are printed. The stages that depend on a failed stage are skipped, and
+# a StageGraphError is raised at the end if any stage failed. Returns a dict {stage name: result}.
+def run_stage_graph(stages, max_workers=stage_graph_workers, label="Stage graph"):
+    stages = {stage.name: stage for stage in stages}
+    for stage in stages.values():
+        unknown = [dependency for dependency in stage.depends_on if dependency not in stages]
+        if unknown:
+            raise ValueError(f"Stage {stage.name} depends on unknown stages: {unknown}")
+
+    results, failures, timings = {}, {}, {}
+    pending, running = dict(stages), {}
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while pending or running:
+            # Start every stage that is ready and skip the ones after a failure (repeat until nothing changes, for the chains of skips)
+            changed = True
+            while changed:
+                changed = False
+                for name, stage in list(pending.items()):
+                    if any(dependency in failures for dependency in stage.depends_on):
+                        failures[name] = "skipped (a stage it depends on failed)"
+                    elif all(dependency in results for dependency in stage.depends_on):
+                        running[executor.submit(_run_timed, stage.func, {dependency: results[dependency] for dependency in stage.depends_on})] = name
+                    else:
+                        continue
+                    del pending[name]
+                    changed = True
+            if not running:
+                if pending:
+                    raise ValueError(f"The stages {list(pending)} depend on each other (cycle)")
+                break
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                seconds, result, error = future.result()
+                timings[name] = seconds
+                if error is None:
+                    results[name] = result
+                else:
+                    failures[name] = error
+
+    report_stage_timings(label, stages, timings, failures, time.perf_counter() - started)
+    if failures:
+        raise StageGraphError(f"{label}: {len(failures)} stage(s) failed: {failures}", results, failures)
+    return results
+
+
+def _run_timed(func, inputs):
+    started = time.perf_counter()
+    try:
+        result = func(inputs)
+        return time.perf_counter() - started, result, None
+    except Exception as e:
+        return time.perf_counter() - started, None, f"{type(e).__name__}: {e}"
+
+
+def report_stage_timings(label, stages, timings, failures, total_seconds):
+    print(f"~~ {label} finished in {total_seconds:.1f}s (sum of the stages {sum(timings.values()):.1f}s):")
+    for name in stages:
+        status = "failed" if name in failures else "ok"
+        seconds = f"{timings[name]:.1f}s" if name in timings else "-"
+        print(f"   {name:<50} {status:<7} {seconds}" + (f"  {failures[name]}" if name in failures else ""))
@@ -0,0 +1,198 @@
+import os, re, csv, json, threading
+from helpers_label_match import normalize_label
+
+#  -----------------     Variables    ----------------- #
+# The source files of the taxonomies and the snapshot they are cached in (rebuilt when a source file changes).
+# The names of the prompt files (standard_*.txt) are the canonical names (the ones already stored in the Graph DB and in PostgreSQL),
+# the CSV files of the resources folder only give the ISCO codes and the ISCED descriptions.
+taxonomy_sources = {
+    "nace_sections": os.path.join("data", "prompts", "standard_NACE.txt"),
+    "nace_tree": os.path.join("data", "prompts", "NACE_Classification_Tree.json"),
+    "isco_titles": os.path.join("data", "prompts", "standard_ISCO.txt"),
+    "isco": os.path.join("data", "resources", "ISCO-88 occupations only.csv"),
+    "isced_levels": os.path.join("data", "prompts", "standard_ISCED.txt"),
+    "isced": os.path.join("data", "resources", "ISCED 2011 levels of education.csv"),
+}
+taxonomy_snapshot_path = os.getenv("TAXONOMY_SNAPSHOT", os.path.join("data", "cache", "taxonomy.json"))
+
+# NACE Rev.2: the code of each section (in the order of standard_NACE.txt) and the range of the codes of its divisions
+# (the divisions of NACE_Classification_Tree.json are in the order of their codes)
+nace_section_division_ranges = [
+    ("A", 1, 3), ("B", 5, 9), ("C", 10, 33), ("D", 35, 35), ("E", 36, 39), ("F", 41, 43), ("G", 45, 47),
+    ("H", 49, 53), ("I", 55, 56), ("J", 58, 63), ("K", 64, 66), ("L", 68, 68), ("M", 69, 75), ("N", 77, 82),
+    ("O", 84, 84), ("P", 85, 85), ("Q", 86, 88), ("R", 90, 93), ("S", 94, 96), ("T", 97, 98), ("U", 99, 99),
+]
+
+
+# Read a list of standard titles from the prompt files (a JSON-like list with one quoted title per line)
+def read_standard_titles(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        text = f.read()
+    return [title.strip().strip('"').strip() for title in text.strip().strip('[]').split(',\n') if title.strip()]
+
+
+# Read a `;` separated CSV of the resources folder (the files may start with a BOM and have trailing spaces)
+def read_resource_csv(path):
+    with open(path, 'r', encoding='utf-8-sig', newline='') as f:
+        return [[value.strip() for value in row] for row in csv.reader(f, delimiter=';')][1:]
+
+
+# --------------------------------------------------------------------------
+# The taxonomies used to classify the jobs (NACE Rev.2 sections and divisions, ISCO-88 unit groups, ISCED 2011 levels),
+# loaded once from the data files and kept in a JSON snapshot. Names are looked up by their normalized form
+# (see `normalize_label`), so the small differences between the files (e.g. "agriculture,hunting" / "agriculture, hunting")
+# map to the same code. All the lookups are dictionary lookups.
+class TaxonomyRegistry:
+    def __init__(self, data):
+        self.data = data
+        self.nace = {entry["code"]: entry for entry in data["nace"]}
+        self.isco = {entry["code"]: entry for entry in data["isco"]}
+        self.isced = {entry["level"]: entry for entry in data["isced"]}
+        # One map per NACE level: some sections have the same name as one of their divisions (e.g. "Education", 85)
+        self._nace_codes = {1: {}, 2: {}}
+        for entry in data["nace"]:
+            self._nace_codes[entry["level"]][normalize_label(entry["name"])] = entry["code"]
+        self._isco_codes = {normalize_label(entry["name"]): entry["code"] for entry in data["isco"]}
+        self._children = {}
+        for entry in data["nace"]:
+            if entry["parent"]:
+                self._children.setdefault(entry["parent"], []).append(entry["code"])
+
+    # Load the snapshot, or build it from the source files when it is missing or older than one of them
+    @classmethod
+    def load(cls, snapshot_path=taxonomy_snapshot_path):
+        sources_signature = {name: os.path.getmtime(path) for name, path in taxonomy_sources.items()}
+        if os.path.exists(snapshot_path):
+            with open(snapshot_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get("sources_signature") == sources_signature:
+                return cls(data)
+
+        data = cls.build()
+        data["sources_signature"] = sources_signature
+        os.makedirs(os.path.dirname(snapshot_path) or '.', exist_ok=True)
+        tmp_path = f"{snapshot_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, snapshot_path)
+        return cls(data)
+
+    @staticmethod
+    def build():
+        sections = read_standard_titles(taxonomy_sources["nace_sections"])
+        with open(taxonomy_sources["nace_tree"], 'r', encoding='utf-8') as f:
+            tree = json.load(f)
+        if list(tree) != sections or len(sections) != len(nace_section_division_ranges):
+            raise ValueError("The NACE sections of standard_NACE.txt and NACE_Classification_Tree.json do not match")
+
+        nace = []
+        for name, (section_code, first, last) in zip(sections, nace_section_division_ranges):
+            divisions = tree[name]
+            if len(divisions) != last - first + 1:
+                raise ValueError(f"NACE section {section_code} should have {last - first + 1} divisions, found {len(divisions)}")
+            nace.append({"code": section_code, "name": name, "level": 1, "parent": None})
+            for division_code, division in zip(range(first, last + 1), divisions):
+                nace.append({"code": f"{division_code:02d}", "name": division, "level": 2, "parent": section_code})
+
+        # The ISCO titles of standard_ISCO.txt, with the code of the same title (normalized) in the CSV
+        isco_codes = {normalize_label(name): code for code, name in read_resource_csv(taxonomy_sources["isco"])}
+        isco = []
+        for name in read_standard_titles(taxonomy_sources["isco_titles"]):
+            if normalize_label(name) not in isco_codes:
+                raise ValueError(f"The ISCO title '{name}' of standard_ISCO.txt is not in the ISCO-88 CSV")
+            isco.append({"code": isco_codes[normalize_label(name)], "name": name})
+
+        # The ISCED levels of standard_ISCED.txt ("* 6: Bachelor's or equivalent level"), with the description of the level in the CSV
+        isced_descriptions = {int(level): description for level, _, description in read_resource_csv(taxonomy_sources["isced"])}
+        with open(taxonomy_sources["isced_levels"], 'r', encoding='utf-8') as f:
+            isced_levels = re.findall(r"^\*\s*(\d+):\s*(.+?)\s*$", f.read(), re.MULTILINE)
+        isced = [{"level": int(level), "label": label, "description": isced_descriptions.get(int(level))} for level, label in isced_levels]
+        return {"nace": nace, "isco": isco, "isced": isced}
+
+    #---------------------- NACE ----------------------#
+    # The code of a section (level 1) or a division (level 2). Without a level, a name shared by a section and a division is the division.
+    def nace_code(self, name, level=None):
+        if not isinstance(name, str):
+            return None
+        normalized = normalize_label(name)
+        if level is not None:
+            return self._nace_codes[level].get(normalized)
+        return self._nace_codes[2].get(normalized) or self._nace_codes[1].get(normalized)
+
+    def nace_name(self, code):
+        entry = self.nace.get(code)
+        return entry["name"] if entry else None
+
+    # The section of a division (None for a section)
+    def nace_parent(self, code):
+        entry = self.nace.get(code)
+        return entry["parent"] if entry else None
+
+    # The divisions of a section
+    def nace_children(self, code):
+        return list(self._children.get(code, []))
+
+    def nace_section_names(self):
+        return [entry["name"] for entry in self.data["nace"] if entry["level"] == 1]
+
+    # The names of the divisions (of one section, by code or name, or of all the sections)
+    def nace_division_names(self, section=None):
+        if section is None:
+            return [entry["name"] for entry in self.data["nace"] if entry["level"] == 2]
+        section_code = section if section in self.nace else self.nace_code(section, level=1)
+        return [self.nace[code]["name"] for code in self.nace_children(section_code)]
+
+    # {section name: [division names]}, like NACE_Classification_Tree.json
+    def nace_tree(self):
+        return {name: self.nace_division_names(self.nace_code(name, level=1)) for name in self.nace_section_names()}
+
+    def is_nace_section(self, name):
+        code = self.nace_code(name, level=1)
+        return code is not None and self.nace[code]["name"] == name
+
+    # Is the name a NACE division (of the section, if one is given)?
+    def is_nace_division(self, name, section=None):
+        code = self.nace_code(name, level=2)
+        if code is None or self.nace[code]["name"] != name:
+            return False
+        return section is None or self.nace_parent(code) in (section, self.nace_code(section, level=1))
+
+    #---------------------- ISCO ----------------------#
+    def isco_code(self, name):
+        return self._isco_codes.get(normalize_label(name)) if isinstance(name, str) else None
+
+    def isco_name(self, code):
+        entry = self.isco.get(str(code))
+        return entry["name"] if entry else None
+
+    def isco_names(self):
+        return [entry["name"] for entry in self.data["isco"]]
+
+    # Is the name exactly an ISCO title?
+    def is_isco_title(self, name):
+        code = self.isco_code(name)
+        return code is not None and self.isco[code]["name"] == name
+
+    #---------------------- ISCED ----------------------#
+    def isced_label(self, level):
+        entry = self.isced.get(level)
+        return entry["label"] if entry else None
+
+    def is_isced_level(self, level):
+        return isinstance(level, int) and not isinstance(level, bool) and level in self.isced
+
+    # The ISCED levels as text for the prompts
+    def isced_prompt(self):
+        return "ISCED Levels of education:\n" + "\n".join(f"* {entry['level']}: {entry['label']}" for entry in self.data["isced"])
+
+
+# The shared registry, loaded on first use.
+_taxonomy = None
+_taxonomy_lock = threading.Lock()
+
+def get_taxonomy():
+    global _taxonomy
+    with _taxonomy_lock:
+        if _taxonomy is None:
+            _taxonomy = TaxonomyRegistry.load()
+        return _taxonomy
@@ -1,97 +1,302 @@
 import json
 # import requests
-import time, datetime
+import time, datetime, re
+from concurrent.futures import ThreadPoolExecutor
 # from openai import OpenAI
 import os 
 from dotenv import load_dotenv
-from groq import Groq
+from helpers_llm_client import get_llm_client
+from helpers_checkpoint import JsonlCheckpointWriter, read_jsonl, follow_jsonl
+from helpers_translation_memory import get_translation_memory
+from helpers_known_refs import KnownReferenceIndex
 
 load_dotenv()
 GROQ_API_KEY = os.environ["GROQ_API_KEY"]
 
+# Is the character a Greek letter? Covers the Greek and Coptic block (with the accented letters) and the Greek Extended block (polytonic)
+def is_greek_letter(c):
+    return c.isalpha() and ('\u0370' <= c <= '\u03ff' or '\u1f00' <= c <= '\u1fff')
+
+
 # Check if the text is in Greek
 def is_greek(text):
     # Simple heuristic to detect Greek text
-    return any(ord(c) >= 913 and ord(c) <= 969 for c in text)
+    return any(is_greek_letter(c) for c in text)
 
 
-# Translate the Title of a Job listing
-def translate_job_listings(job_listings):
-    # Openllm = OpenAI(base_url=OPENAI_API_BASE, api_key=OPENAI_API_KEY)
-    Groqllm = Groq(api_key=os.environ.get("GROQ_API_KEY"))
-    translated_list = []
-    
-    time.sleep(1)
-    for job_listing in job_listings:
-
-        title = job_listing["Job Listing Title"]
-        
-        if is_greek(title):
-            time.sleep(2)
-            
-            # Send API Request for translation
-            chat_completion = Groqllm.chat.completions.create(
-                messages=[
-                    {
-                        "role": "user",
-                        "content": f'''translate '{title}' from Greek to English. 
-                        Examples: 
-                        if the user provides the words 'Εργάτης/τρια' then your output will be 'Worker'.
-                        if the user provides the words 'Καθηγητής/τρια Χημείας' then your output will be 'Chemistry Professor'.
-                        Provide ONLY the translated words(s) and NOTHING elese.
-                        ''',
-                    }
-                ],
-                model="llama-3.1-70b-versatile",
-                # models= "llama-3.1-70b-versatile","llama3-70b-8192" or "mixtral-8x7b-32768"
-                temperature=0,
-            )
-            translated_title = str(chat_completion.choices[0].message.content)
-            
-        else:
-            translated_title = title
-        job_listing["Job Listing Title"] = translated_title
-        print(translated_title)
-        translated_list.append(job_listing)
-        
-        # Write the list of job listings to a JSON file
-        with open(f'{datetime.date.today()}_job_listings_translated.json', 'w', encoding='utf-8') as f:
-            json.dump(translated_list, f, ensure_ascii=False )
-    return translated_list
+# The share of the letters of a text that are Greek (0 to 1)
+def greek_ratio(text):
+    letters = [c for c in text if c.isalpha()]
+    if not letters:
+        return 0.0
+    return sum(is_greek_letter(c) for c in letters) / len(letters)
 
 
-# Translate the description of the Job listing
-def translate_job_description(job_description):
-    # Openllm = OpenAI(base_url=OPENAI_API_BASE, api_key=OPENAI_API_KEY)
-    Groqllm = Groq(api_key=os.environ.get("GROQ_API_KEY"))
+# Settings for the translation of the job titles: the model, its context size and how many titles are sent in one request.
+title_translation_model = "llama-3.1-70b-versatile"
+title_translation_context_tokens = int(os.getenv("TITLE_TRANSLATION_CONTEXT_TOKENS", 8192))
+title_translation_batch_size = int(os.getenv("TITLE_TRANSLATION_BATCH_SIZE", 50))
+# Tokens of the batch prompt without the titles
+title_translation_prompt_tokens = 200
+# The model of the job descriptions translation
+description_translation_model = "llama3-70b-8192"
+# Versions of the translation prompts, part of the translation memory key. Change them when a prompt changes.
+title_prompt_version = "title-v1"
+description_prompt_version = "description-v1"
+# A paragraph is translated when at least this share of its letters are Greek
+greek_segment_threshold = float(os.getenv("GREEK_SEGMENT_THRESHOLD", 0.25))
+# Token budget of one translation request of a description, and how many requests of one description run at the same time
+description_chunk_tokens = int(os.getenv("DESCRIPTION_CHUNK_TOKENS", 1500))
+description_translation_workers = int(os.getenv("DESCRIPTION_TRANSLATION_WORKERS", 4))
 
-    # Check if the text is in Greek
-    if is_greek(job_description):
-        # wait and then send API Request for translation
-        time.sleep(4)
-        chat_completion = Groqllm.chat.completions.create(
-            messages=[
+
+# Translate one job title (also used when a batch cannot be matched back to its titles)
+def translate_job_title(title):
+    # Send API Request for translation
+    translated_title = get_llm_client("groq").chat(
+        title_translation_model,
+        [
+            {
+                "role": "user",
+                "content": f'''translate '{title}' from Greek to English. 
+                Examples: 
+                if the user provides the words 'Εργάτης/τρια' then your output will be 'Worker'.
+                if the user provides the words 'Καθηγητής/τρια Χημείας' then your output will be 'Chemistry Professor'.
+                Provide ONLY the translated words(s) and NOTHING elese.
+                ''',
+            }
+        ],
+        # models= "llama-3.1-70b-versatile","llama3-70b-8192" or "mixtral-8x7b-32768"
+        temperature=0,
+    )
+    return str(translated_title)
+
+
+# Translate many job titles with one request: the titles are sent as a numbered JSON array and the response must
+# have the same length and order. If it does not, the batch is split in two and each half is translated again.
+def translate_job_titles_batch(titles):
+    if len(titles) == 1:
+        return [translate_job_title(titles[0])]
+
+    numbered_titles = [{"id": i, "el": title} for i, title in enumerate(titles)]
+    try:
+        translated_batch = get_llm_client("groq").chat(
+            title_translation_model,
+            [
                 {
                     "role": "user",
-                    "content": f'''Translate '{job_description}' from Greek to English. 
-                    Steps:
-                    1) read the provided text in Greek.
-                    2) Translate the text into English.
-                    3) Provide the translation of the text.
-                    
-                    Example:
-                    If the user provides the text 'Ζητείται υπάλληλος γραφείου για μερική απασχόληση.' then your output will be 'Office worker wanted for part-time employment.'
-                    
-                    Think step,by step and provide ONLY the translated textt and NOTHING else.
-                    Do not include phrases like `here is the translation of the text:` or anythin simillar, provide ONLY the translated text.
+                    "content": f'''Translate the job titles of the following JSON array from Greek to English.
+                    Examples: 
+                    'Εργάτης/τρια' is translated to 'Worker'.
+                    'Καθηγητής/τρια Χημείας' is translated to 'Chemistry Professor'.
+                    Job titles: {json.dumps(numbered_titles, ensure_ascii=False)}
+                    Return ONLY a JSON object with one item for each job title, in the same order and with the same "id":
+                    {{"translations": [{{"id": 0, "en": "The translated job title"}}]}}
                     ''',
                 }
             ],
-            model="llama3-70b-8192",
-            # available models for GROQ => "llama3-70b-8192" or "mixtral-8x7b-32768"
             temperature=0,
+            json_mode=True,
         )
-        translated_jobDescription = str(chat_completion.choices[0].message.content)
+        translations = json.loads(translated_batch)["translations"]
+        if [item["id"] for item in translations] == list(range(len(titles))) and all(isinstance(item["en"], str) and item["en"].strip() for item in translations):
+            return [item["en"].strip() for item in translations]
+        print(f"The batch translation of {len(titles)} titles did not match the titles. Splitting the batch.")
+    except (ValueError, KeyError, TypeError) as e:
+        print(f"The batch translation of {len(titles)} titles could not be read ({e}). Splitting the batch.")
+
+    middle = len(titles) // 2
+    return translate_job_titles_batch(titles[:middle]) + translate_job_titles_batch(titles[middle:])
+
+
+# A rough token count (Greek text needs more tokens per character than English)
+def estimate_tokens(text):
+    return len(text) // 2 + 1
+
+
+# Is there room for one more title in the batch? Limited by the batch size and by the context of the model
+# (the prompt and the answer both hold every title, so each title is counted twice, plus the JSON around it).
+def title_batch_has_room(titles, title):
+    if len(titles) >= title_translation_batch_size:
+        return False
+    batch_tokens = sum(2 * estimate_tokens(t) + 12 for t in titles + [title])
+    return title_translation_prompt_tokens + batch_tokens <= title_translation_context_tokens
+
+
+# Translate the Title of a Job listing
+# Greek titles are translated in batches (one request for many titles). Each translated listing is appended to today's
+# JSONL checkpoint and a restarted run skips the listings already in the checkpoint.
+# Returns the translated listings that are not in the database yet (the listings of the checkpoint inserted by an earlier run are left out).
+# `job_listings` can be a list or a stream of listings (e.g. `follow_jsonl` on the scraping checkpoint while the scraper still runs).
+# If `job_listings` is None, today's scraping checkpoint is followed.
+def translate_job_listings(job_listings=None):
+    if job_listings is None:
+        job_listings = follow_jsonl(f'{datetime.date.today()}_job_listings.jsonl')
+
+    # The listings already translated by an earlier run of today
+    checkpoint_path = f'{datetime.date.today()}_job_listings_translated.jsonl'
+    translated_list = read_jsonl(checkpoint_path)
+    translated_refs = {job_listing["Job Listing Details Reference"] for job_listing in translated_list}
+    if translated_list:
+        known_refs = KnownReferenceIndex.load()
+        translated_list = [job_listing for job_listing in translated_list if job_listing["Job Listing Details Reference"] not in known_refs]
+
+    # The listings waiting for their batch to be translated (in their original order) and their Greek titles
+    pending_listings, pending_titles = [], []
+    # Greek title -> English title, for the titles already translated
+    translation_memory = get_translation_memory()
+    remembered_titles = {}
+
+    # Translate the pending Greek titles with one request, then write the pending listings to the checkpoint
+    def flush_pending():
+        new_titles = list(dict.fromkeys(pending_titles))
+        if new_titles:
+            for title, translated_title in zip(new_titles, translate_job_titles_batch(new_titles)):
+                remembered_titles[title] = translated_title
+                translation_memory.put(title, title_translation_model, title_prompt_version, translated_title)
+        for job_listing in pending_listings:
+            title = job_listing["Job Listing Title"]
+            if title in remembered_titles:
+                job_listing["Job Listing Title"] = remembered_titles[title]
+            print(job_listing["Job Listing Title"])
+            translated_list.append(job_listing)
+            # Append the translated job listing to the JSONL checkpoint
+            checkpoint.write(job_listing)
+        pending_listings.clear()
+        pending_titles.clear()
+
+    with JsonlCheckpointWriter(checkpoint_path) as checkpoint:
+        for job_listing in job_listings:
+            if job_listing["Job Listing Details Reference"] in translated_refs:
+                continue
+            translated_refs.add(job_listing["Job Listing Details Reference"])
+
+            title = job_listing["Job Listing Title"]
+            if is_greek(title) and title not in remembered_titles and title not in pending_titles:
+                # Titles translated before (in any run) come from the translation memory, the rest wait for a batch
+                remembered_title = translation_memory.get(title, title_translation_model, title_prompt_version)
+                if remembered_title is not None:
+                    remembered_titles[title] = remembered_title
+                else:
+                    if not title_batch_has_room(pending_titles, title):
+                        flush_pending()
+                    pending_titles.append(title)
+            pending_listings.append(job_listing)
+        flush_pending()
+    translation_memory.report()
+    return translated_list
+
+
+# Split a description into its paragraphs / list items (one per line, as the scraper writes them) and the line breaks between them.
+# Returns a list of (text, language) where language is "el" (Greek), "other" or None for the line breaks, so the parts can be put back in order.
+def segment_description(job_description):
+    segments = []
+    for part in re.split(r'(\n+)', job_description):
+        if not part:
+            continue
+        if not part.strip():
+            segments.append((part, None))
+        else:
+            segments.append((part, "el" if greek_ratio(part) >= greek_segment_threshold else "other"))
+    return segments
+
+
+# The Greek paragraphs translated before (in any run) are taken from the translation memory and kept as they are ("other"),
+# so only the new paragraphs are grouped into chunks for the LLM (repeated boilerplate paragraphs rarely give the same whole chunk).
+def recall_paragraph_translations(segments):
+    translation_memory = get_translation_memory()
+    recalled = []
+    for text, language in segments:
+        translation = translation_memory.get(text, description_translation_model, description_prompt_version) if language == "el" else None
+        recalled.append((translation, "other") if translation is not None else (text, language))
+    return recalled
+
+
+# Save the translation of each paragraph of a chunk in the translation memory. The paragraphs are matched to the lines of the
+# translation, so nothing is saved for a chunk of many paragraphs whose translation does not have one line per paragraph.
+def remember_paragraph_translations(text, translated_text):
+    translation_memory = get_translation_memory()
+    paragraphs = [line for line in text.split("\n") if line.strip()]
+    translated_lines = [line.strip() for line in translated_text.split("\n") if line.strip()]
+    if len(paragraphs) == len(translated_lines):
+        for paragraph, translated_line in zip(paragraphs, translated_lines):
+            translation_memory.put(paragraph, description_translation_model, description_prompt_version, translated_line)
+    elif len(paragraphs) == 1:
+        translation_memory.put(text, description_translation_model, description_prompt_version, translated_text)
+
+
+# Group the consecutive Greek paragraphs into chunks of at most `description_chunk_tokens` (estimated) tokens.
+# Returns the pieces of the description in order: (text, True) for a Greek chunk to translate, (text, False) for text kept as it is.
+def chunk_description(segments):
+    pieces, chunk, chunk_tokens = [], [], 0
+
+    def close_chunk():
+        nonlocal chunk, chunk_tokens
+        # Line breaks at the end of a chunk are kept outside of it
+        trailing = []
+        while chunk and chunk[-1][1] is None:
+            trailing.insert(0, chunk.pop())
+        if chunk:
+            pieces.append(("".join(text for text, _ in chunk), True))
+        pieces.extend((text, False) for text, _ in trailing)
+        chunk, chunk_tokens = [], 0
+
+    for text, language in segments:
+        if language == "el":
+            if chunk and chunk_tokens + estimate_tokens(text) > description_chunk_tokens:
+                close_chunk()
+            chunk.append((text, language))
+            chunk_tokens += estimate_tokens(text)
+        elif language is None and chunk:
+            chunk.append((text, language))
+        else:
+            close_chunk()
+            pieces.append((text, False))
+    close_chunk()
+    return pieces
+
+
+# Translate a Greek text with the LLM and save the translation of its paragraphs in the translation memory
+def translate_text_chunk(text):
+    # Send API Request for translation
+    translated_text = get_llm_client("groq").chat(
+        description_translation_model,
+        [
+            {
+                "role": "user",
+                "content": f'''Translate '{text}' from Greek to English. 
+                Steps:
+                1) read the provided text in Greek.
+                2) Translate the text into English.
+                3) Provide the translation of the text.
+                
+                Example:
+                If the user provides the text 'Ζητείται υπάλληλος γραφείου για μερική απασχόληση.' then your output will be 'Office worker wanted for part-time employment.'
+                
+                Think step,by step and provide ONLY the translated textt and NOTHING else.
+                Do not include phrases like `here is the translation of the text:` or anythin simillar, provide ONLY the translated text.
+                ''',
+            }
+        ],
+        # available models for GROQ => "llama3-70b-8192" or "mixtral-8x7b-32768"
+        temperature=0,
+    )
+    translated_text = str(translated_text).strip()
+    remember_paragraph_translations(text, translated_text)
+    return translated_text
+
+
+# Translate the description of the Job listing
+# Only the Greek paragraphs are translated (English paragraphs are kept as they are). The Greek paragraphs that are not in the
+# translation memory are sent in chunks within a token budget, at the same time, and put back in their original order.
+def translate_job_description(job_description):
+    # Check if the text is in Greek
+    if is_greek(job_description):
+        pieces = chunk_description(recall_paragraph_translations(segment_description(job_description)))
+        greek_chunks = [text for text, to_translate in pieces if to_translate]
+        with ThreadPoolExecutor(max_workers=description_translation_workers) as executor:
+            translated_chunks = iter(list(executor.map(translate_text_chunk, greek_chunks)))
+        translated_jobDescription = "".join(next(translated_chunks) if to_translate else text for text, to_translate in pieces)
     else: #If not in Greek
         translated_jobDescription = job_description
     print(translated_jobDescription)
@@ -0,0 +1,97 @@
+import os, re, sqlite3, hashlib, threading, unicodedata
+from collections import OrderedDict
+
+#  -----------------     Variables    ----------------- #
+# The durable translation memory (SQLite) and how many translations are also kept in memory
+translation_memory_path = os.getenv("TRANSLATION_MEMORY_PATH", "data/cache/translation_memory.sqlite3")
+translation_memory_lru_size = int(os.getenv("TRANSLATION_MEMORY_LRU_SIZE", 5000))
+
+
+# Normalize the source text, so the same text with different spacing or Unicode form gets the same key
+def normalize_source_text(text):
+    text = unicodedata.normalize("NFC", text)
+    return re.sub(r"\s+", " ", text).strip()
+
+
+# --------------------------------------------------------------------------
+# A translation memory: translations keyed by the normalized source text, the model and the prompt version.
+# A bounded in-process LRU cache sits in front of a SQLite table, so repeated titles and paragraphs are translated
+# only once across all runs. Changing the model or the prompt version gives new keys (old translations are not reused).
+class TranslationMemory:
+    def __init__(self, path=translation_memory_path, lru_size=translation_memory_lru_size):
+        self.lru_size = lru_size
+        self.hits = 0
+        self.misses = 0
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS translation_memory (
+                key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                prompt_version TEXT NOT NULL,
+                source_text TEXT NOT NULL,
+                translation TEXT NOT NULL,
+                created_date TEXT DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        self._db.commit()
+
+    @staticmethod
+    def key(text, model, prompt_version):
+        return hashlib.sha256("\x1f".join([normalize_source_text(text), model, prompt_version]).encode('utf-8')).hexdigest()
+
+    # The stored translation, or None
+    def get(self, text, model, prompt_version):
+        key = self.key(text, model, prompt_version)
+        with self._lock:
+            if key in self._lru:
+                self._lru.move_to_end(key)
+                self.hits += 1
+                return self._lru[key]
+            row = self._db.execute("SELECT translation FROM translation_memory WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._remember(key, row[0])
+            return row[0]
+
+    def put(self, text, model, prompt_version, translation):
+        key = self.key(text, model, prompt_version)
+        with self._lock:
+            self._db.execute("""
+                INSERT OR REPLACE INTO translation_memory (key, model, prompt_version, source_text, translation)
+                VALUES (?, ?, ?, ?, ?)
+            """, (key, model, prompt_version, normalize_source_text(text), translation))
+            self._db.commit()
+            self._remember(key, translation)
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / total if total else 0.0}
+
+    def report(self):
+        stats = self.stats()
+        print(f"Translation memory --> hits: {stats['hits']}, misses: {stats['misses']}, hit rate: {stats['hit_rate']:.0%}")
+        return stats
+
+    def _remember(self, key, translation):
+        self._lru[key] = translation
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.lru_size:
+            self._lru.popitem(last=False)
+
+
+# A shared translation memory, opened on first use.
+_shared_memory = None
+_shared_memory_lock = threading.Lock()
+
+def get_translation_memory():
+    global _shared_memory
+    with _shared_memory_lock:
+        if _shared_memory is None:
+            _shared_memory = TranslationMemory()
+        return _shared_memory